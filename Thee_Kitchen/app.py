@@ -1,9 +1,12 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, current_app
+import json
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, current_app, Response, stream_with_context
 from extensions import db
-from models import User, MenuItem, Order, OrderItem
+from models import User, Order, OrderItem
 from translations import translations
 from datetime import datetime
-from delivery_service import quote_delivery
+from delivery_service import delivery_service, quote_delivery, quote_delivery_async, quote_delivery_batch
+from cart_store import Cart, create_cart_store, parse_cart_operations
+from menu_catalog import menu_catalog
 from config import Config
 
 app = Flask(__name__)
@@ -80,6 +83,27 @@ print(f"📊 ENV={app.config['ENV']} DB={app.config['SANITIZED_DB_URI']}")
 with app.app_context():
     db.create_all()
 
+# Seed the sample menu into an empty database (a no-op once items exist)
+if Config.MENU_SEED_ON_STARTUP:
+    try:
+        from menu_seed import SAMPLE_MENU_ITEMS, seed_menu_items
+        with app.app_context():
+            seeded = seed_menu_items(SAMPLE_MENU_ITEMS)
+        if seeded:
+            print(f"🍽️ Seeded {seeded} sample menu items")
+    except Exception as e:
+        print(f"⚠️ Menu seeding skipped: {e}")
+
+# Warm the delivery distance cache so repeat customers skip ORS after a deploy
+if Config.DELIVERY_CACHE_WARM_ON_STARTUP and not app.config.get('TESTING', False):
+    try:
+        from delivery_warmup import warm_delivery_cache
+        with app.app_context():
+            warmup = warm_delivery_cache(delivery_service)
+        print(f"🔥 Delivery cache warmed with {warmup['primed']} order locations")
+    except Exception as e:
+        print(f"⚠️ Delivery cache warm-up skipped: {e}")
+
 
 @app.context_processor
 def inject_globals():
@@ -101,88 +125,19 @@ def home():
 
 @app.route('/menu')
 def menu():
-    from models import MenuItem  # Import here to avoid circular import
-    from extensions import db
-    
     current_lang = session.get('lang', 'ar')
     category_filter = request.args.get('category', 'all')
     
-    # Create sample items if database is empty
-    if MenuItem.query.first() is None:
-        with app.app_context():
-            sample_items = [
-                MenuItem(
-                    name_ar="كبسة الدجاج",
-                    name_en="Chicken Kabsa",
-                    description_ar="طبق تقليدي شهير من الدجاج مع الأرز البسمتي والتوابل العربية",
-                    description_en="Traditional famous dish of chicken with basmati rice and Arabic spices",
-                    price=120.0,
-                    category="main"
-                ),
-                MenuItem(
-                    name_ar="مندي لحم",
-                    name_en="Mandi Lamb",
-                    description_ar="لحم ضأن مطهو ببطء على الفحم مع أرز معطر",
-                    description_en="Slow-cooked lamb on charcoal with fragrant rice",
-                    price=150.0,
-                    category="main"
-                ),
-                MenuItem(
-                    name_ar="سمبوسك خضار",
-                    name_en="Vegetable Samosa",
-                    description_ar="معجنات مقرمشة محشوة بالخضار المتبلة",
-                    description_en="Crispy pastries filled with seasoned vegetables",
-                    price=25.0,
-                    category="side"
-                ),
-                MenuItem(
-                    name_ar="سلطة عربية",
-                    name_en="Arabic Salad",
-                    description_ar="سلطة طازجة بالخضار الموسمية وتوابل السماق",
-                    description_en="Fresh salad with seasonal vegetables and sumac spices",
-                    price=30.0,
-                    category="side"
-                ),
-                MenuItem(
-                    name_ar="أم علي",
-                    name_en="Um Ali",
-                    description_ar="حلوى مصرية تقليدية بالكريم والتمر والمكسرات",
-                    description_en="Traditional Egyptian dessert with cream, dates and nuts",
-                    price=35.0,
-                    category="dessert"
-                ),
-                MenuItem(
-                    name_ar="كنافة بالجبن",
-                    name_en="Kunafa with Cheese",
-                    description_ar="كنافة مقرمشة بالجبن والشرق الحلو",
-                    description_en="Crispy kunafa with cheese and sweet syrup",
-                    price=40.0,
-                    category="dessert"
-                )
-            ]
-            
-            for item in sample_items:
-                db.session.add(item)
-            db.session.commit()
-    
-    # Get all available items
-    items_query = MenuItem.query.filter_by(is_available=True)
-    
-    # Filter by category if specified
-    if category_filter != 'all':
-        items_query = items_query.filter_by(category=category_filter)
-    
-    menu_items = items_query.all()
+    # Available items come from the cached catalog, already grouped by category
+    catalog = menu_catalog.snapshot()
+    categories = {
+        category: {'items': items}
+        for category, items in catalog.by_category.items()
+        if category_filter == 'all' or category == category_filter
+    }
     
     # Check if any items exist for empty state handling
-    has_items = len(menu_items) > 0
-    
-    # Group items by category and build proper structure for template
-    categories = {}
-    for item in menu_items:
-        if item.category not in categories:
-            categories[item.category] = {'items': []}
-        categories[item.category]['items'].append(item)
+    has_items = bool(categories)
     
     # Define category names for template iteration
     category_names = {
@@ -322,121 +277,160 @@ def resend_verification():
     return redirect(url_for('login'))
 
 
+# Carts live server-side; the session only holds the cart id
+cart_store = create_cart_store(Config.CART_STORE_BACKEND, ttl=Config.CART_TTL_SECONDS)
+
+
+def load_cart():
+    """Current visitor's cart (empty if none or expired)"""
+    cart_id = session.get('cart_id')
+    if not cart_id:
+        return Cart()
+    return Cart.from_data(cart_store.get(cart_id))
+
+
+def save_cart(cart):
+    """Store the cart, giving the session a cart id on first use"""
+    cart_id = session.get('cart_id')
+    if not cart_id:
+        cart_id = session['cart_id'] = cart_store.new_id()
+    cart_store.save(cart_id, cart.to_data())
+
+
+def clear_session_cart():
+    """Drop the stored cart and forget its id"""
+    cart_id = session.pop('cart_id', None)
+    if cart_id:
+        cart_store.delete(cart_id)
+
+
+def cart_item_id(data):
+    """Menu item id from a cart request body, or None if missing or invalid"""
+    try:
+        return int(data.get('item_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def cart_response(cart):
+    """JSON body the cart routes answer with"""
+    return {
+        'success': True,
+        'cart': cart.lines(),
+        'cart_count': cart.count
+    }
+
+
 @app.route('/add_to_cart', methods=['POST'])
 def add_to_cart():
-    from models import MenuItem
-    
-    item_id = request.json.get('item_id')
+    item_id = cart_item_id(request.json)
     quantity = request.json.get('quantity', 1)
     
     if not item_id:
         return {'success': False, 'message': 'Item ID is required'}
     
-    item = db.session.get(MenuItem, item_id)
-    if not item or not item.is_available:
+    item = menu_catalog.get_available(item_id)
+    if not item:
         return {'success': False, 'message': 'Item not found or not available'}
     
-    # Get current cart from session or create new one
-    cart = session.get('cart', [])
-    
-    # Check if item already in cart
-    existing_item_index = None
-    for i, cart_item in enumerate(cart):
-        if cart_item['id'] == item_id:
-            existing_item_index = i
-            break
-    
-    if existing_item_index is not None:
-        # Update quantity of existing item
-        cart[existing_item_index]['quantity'] += quantity
-    else:
-        # Add new item to cart
-        cart.append({
-            'id': item.id,
-            'name': item.get_name(session.get('lang', 'ar')),
-            'price': item.price,
-            'quantity': quantity
-        })
-    
-    # Save cart back to session
-    session['cart'] = cart
+    cart = load_cart()
+    cart.add(item.id, item.get_name(session.get('lang', 'ar')), item.price, quantity)
+    save_cart(cart)
     
     return {
         'success': True, 
         'message': 'Item added to cart',
-        'cart_count': sum(item['quantity'] for item in cart)
+        'cart_count': cart.count
     }
 
 
 @app.route('/get_cart')
 def get_cart():
-    cart = session.get('cart', [])
-    cart_count = sum(item['quantity'] for item in cart)
-    
-    return {
-        'success': True,
-        'cart': cart,
-        'cart_count': cart_count
-    }
+    return cart_response(load_cart())
 
 
 @app.route('/update_cart', methods=['POST'])
 def update_cart():
-    item_id = request.json.get('item_id')
+    item_id = cart_item_id(request.json)
     change = request.json.get('change', 0)
     
     if not item_id:
         return {'success': False, 'message': 'Item ID is required'}
     
-    cart = session.get('cart', [])
-    
-    # Find and update item
-    for i, cart_item in enumerate(cart):
-        if cart_item['id'] == item_id:
-            cart[i]['quantity'] += change
-            if cart[i]['quantity'] <= 0:
-                cart.pop(i)
-            break
-    
-    session['cart'] = cart
-    cart_count = sum(item['quantity'] for item in cart)
+    cart = load_cart()
+    cart.change(item_id, change)
+    save_cart(cart)
     
-    return {
-        'success': True,
-        'cart': cart,
-        'cart_count': cart_count
-    }
+    return cart_response(cart)
 
 
 @app.route('/remove_from_cart', methods=['POST'])
 def remove_from_cart():
-    item_id = request.json.get('item_id')
+    item_id = cart_item_id(request.json)
     
     if not item_id:
         return {'success': False, 'message': 'Item ID is required'}
     
-    cart = session.get('cart', [])
-    cart = [item for item in cart if item['id'] != item_id]
+    cart = load_cart()
+    cart.remove(item_id)
+    save_cart(cart)
     
-    session['cart'] = cart
-    cart_count = sum(item['quantity'] for item in cart)
+    return cart_response(cart)
+
+
+@app.route('/update_cart_batch', methods=['POST'])
+def update_cart_batch():
+    """Apply a list of cart operations in one request, all or nothing
     
-    return {
-        'success': True,
-        'cart': cart,
-        'cart_count': cart_count
-    }
+    Body: {"operations": [{"op": "add", "item_id": 3, "quantity": 2},
+    {"op": "change", "item_id": 3, "change": -1}, {"op": "remove", "item_id": 5},
+    {"op": "clear"}]}. Operations run in order. Added items are checked
+    against the menu catalog, and if any operation is invalid the cart is
+    left unchanged.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        operations = parse_cart_operations(data.get('operations'), Config.CART_BATCH_MAX_OPERATIONS)
+    except ValueError as e:
+        return {'success': False, 'message': str(e)}
+    
+    catalog = menu_catalog.snapshot()
+    added_ids = {item_id for op, item_id, _ in operations if op == 'add'}
+    items = {item_id: catalog.get_available(item_id) for item_id in added_ids}
+    missing = sorted(item_id for item_id, item in items.items() if item is None)
+    if missing:
+        return {
+            'success': False,
+            'message': 'Item not found or not available',
+            'item_ids': missing
+        }
+    
+    lang = session.get('lang', 'ar')
+    cart = load_cart()
+    for op, item_id, amount in operations:
+        if op == 'add':
+            item = items[item_id]
+            cart.add(item.id, item.get_name(lang), item.price, amount)
+        elif op == 'change':
+            cart.change(item_id, amount)
+        elif op == 'remove':
+            cart.remove(item_id)
+        else:
+            cart.clear()
+    save_cart(cart)
+    
+    return cart_response(cart)
 
 
 @app.route('/clear_cart')
 def clear_cart():
-    session['cart'] = []
+    clear_session_cart()
     return {'success': True, 'message': 'Cart cleared'}
 
 
 @app.route('/api/delivery/quote', methods=['POST'])
-def delivery_quote():
-    """API endpoint for delivery quote"""
+async def delivery_quote():
+    """API endpoint for delivery quote (awaits ORS instead of blocking on it)"""
     try:
         # Get coordinates from form data or JSON
         if request.form:
@@ -453,7 +447,7 @@ def delivery_quote():
                 'error': translations.get(session.get('lang', 'ar'), {}).get('delivery_required', 'Coordinates are required')
             })
         
-        result = quote_delivery(lat, lng)
+        result = await quote_delivery_async(lat, lng)
         
         if not result['ok']:
             return jsonify(result)
@@ -481,17 +475,49 @@ def delivery_quote():
         })
 
 
+@app.route('/api/delivery/quote/batch', methods=['POST'])
+def delivery_quote_batch():
+    """Admin-only bulk delivery quotes, streamed back as one JSON object per line
+    
+    Body: {"points": [{"lat": 30.0, "lng": 31.2}, ...]}. Each line carries the
+    ``index`` of its point; lines arrive as soon as each result is known, so
+    they are not in input order.
+    """
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    points = data.get('points')
+    if not isinstance(points, list) or not points:
+        return jsonify({'ok': False, 'error': 'A non-empty list of points is required'}), 400
+    if len(points) > Config.DELIVERY_BATCH_MAX_POINTS:
+        return jsonify({
+            'ok': False,
+            'error': f'At most {Config.DELIVERY_BATCH_MAX_POINTS} points per request'
+        }), 400
+    
+    coordinates = [
+        (point.get('lat'), point.get('lng')) if isinstance(point, dict) else (None, None)
+        for point in points
+    ]
+    
+    def generate():
+        for result in quote_delivery_batch(coordinates):
+            yield json.dumps(result) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @app.route('/checkout')
 def checkout():
     """Display checkout page - allow both logged-in and guest users"""
-    # Get cart from session
-    cart = session.get('cart', [])
+    cart = load_cart()
     
     if not cart:
         return redirect(url_for('menu'))
     
     # Calculate totals
-    subtotal = sum(item['price'] * item['quantity'] for item in cart)
+    subtotal = cart.subtotal
     
     # Check if user is logged in
     is_logged_in = 'user_id' in session
@@ -507,7 +533,7 @@ def checkout():
             }
     
     return render_template('checkout.html', 
-                     cart=cart,
+                     cart=cart.lines(),
                      subtotal=subtotal,
                      is_logged_in=is_logged_in,
                      user_info=user_info,
@@ -518,8 +544,7 @@ def checkout():
 def place_order():
     """Handle order placement with JSON data and database persistence"""
     try:
-        # Get cart from session
-        cart = session.get('cart', [])
+        cart = load_cart()
         if not cart:
             flash(translations.get(session.get('lang', 'ar'), {}).get('empty_cart_checkout', 'Your cart is empty'), 'error')
             return redirect(url_for('checkout'))
@@ -555,7 +580,7 @@ def place_order():
             return redirect(url_for('checkout'))
         
         # Get delivery quote server-side (never trust client)
-        delivery_result = quote_delivery(customer_lat, customer_lng)
+        delivery_result = quote_delivery(customer_lat, customer_lng, exact=True)
         
         if not delivery_result['ok']:
             flash(translations.get(session.get('lang', 'ar'), {}).get('delivery_try_again', 'Unable to calculate delivery. Please try again.'), 'error')
@@ -566,7 +591,7 @@ def place_order():
             return redirect(url_for('checkout'))
         
         # Calculate totals
-        subtotal = sum(item['price'] * item['quantity'] for item in cart)
+        subtotal = cart.subtotal
         delivery_fee = delivery_result['delivery_fee']
         total = subtotal + delivery_fee
         deposit_amount = round(total * 0.20, 2)  # 20% deposit
@@ -595,7 +620,7 @@ def place_order():
         db.session.flush()  # Get order ID without committing
         
         # Create order items
-        for cart_item in cart:
+        for cart_item in cart.lines():
             order_item = OrderItem(
                 order_id=order.id,
                 menu_item_id=cart_item.get('id'),  # May be None if item deleted
@@ -610,7 +635,7 @@ def place_order():
         db.session.commit()
         
         # Clear cart
-        session['cart'] = []
+        clear_session_cart()
         
         # Return appropriate response
         if request.is_json:
@@ -674,6 +699,28 @@ def admin_db_info():
         }), 500
 
 
+@app.route('/admin/delivery-metrics')
+def admin_delivery_metrics():
+    """Admin-only delivery service health, latency and cache information"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    try:
+        return jsonify({
+            'circuit_breaker': delivery_service.get_breaker_state(),
+            'cache': delivery_service.get_cache_stats(),
+            'prefilter': delivery_service.get_prefilter_stats(),
+            'routing': delivery_service.get_routing_stats(),
+            'metrics': delivery_service.get_metrics(),
+            'http_pool': delivery_service.get_http_pool_stats()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'error': str(e)
+        }), 500
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Delivery quote load test against a local OpenRouteService stub
+
+Drives quote_delivery and the /api/delivery/quote endpoint through cold
+cache, warm cache and failure-injection scenarios at several concurrency
+levels, and reports throughput and latency percentiles as JSON:
+    python benchmarks/bench_delivery_quote.py
+    python benchmarks/bench_delivery_quote.py --latency 0.05 --concurrency 1 8 32 --output bench.json
+    python benchmarks/bench_delivery_quote.py --baseline bench.json   # exit 1 on regression
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Callable, List, Tuple
+
+# Add project root (and tests, for the ORS stub) to path
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'tests'))
+
+# Never touch a real database or warm the cache from one while benchmarking
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['DELIVERY_CACHE_WARM_ON_STARTUP'] = 'false'
+
+import delivery_service as delivery_module
+from delivery_cache import MemoryDistanceCache
+from delivery_resilience import QuotaScheduler
+from delivery_service import DeliveryService
+from ors_stub import ORSStubServer
+
+SCENARIOS = ('cold', 'warm', 'failure')
+TARGETS = ('service', 'endpoint')
+
+
+def random_points(count: int, seed: int) -> List[Tuple[float, float]]:
+    """Distinct customer locations spread over Greater Cairo"""
+    rng = random.Random(seed)
+    return [(round(rng.uniform(29.95, 30.20), 5), round(rng.uniform(31.15, 31.60), 5)) for _ in range(count)]
+
+
+def make_service(stub: ORSStubServer) -> DeliveryService:
+    """A delivery service that routes every cache miss through the stub; close it when done"""
+    service = DeliveryService()
+    service.ors_base_url = stub.base_url
+    service.cache = MemoryDistanceCache(max_entries=100000)
+    service.quota = QuotaScheduler(per_minute=10 ** 9, per_day=10 ** 12)  # measure ORS, not the quota
+    service.prefilter_enabled = False
+    service.zones = None
+    return service
+
+
+def service_target(service: DeliveryService) -> Callable[[float, float], bool]:
+    def quote(lat, lng):
+        return service.quote_delivery(lat, lng)['ok']
+    return quote
+
+
+def endpoint_target(service: DeliveryService) -> Callable[[float, float], bool]:
+    """POST /api/delivery/quote through the Flask test client, one client per thread"""
+    from app import app  # Import here; only the endpoint benchmark needs Flask
+    delivery_module.delivery_service = service  # the endpoint quotes through the module global
+    local = threading.local()
+
+    def quote(lat, lng):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        response = client.post('/api/delivery/quote', json={'lat': str(lat), 'lng': str(lng)})
+        return response.status_code == 200 and response.get_json()['ok']
+    return quote
+
+
+def percentile(sorted_ms: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted samples"""
+    if not sorted_ms:
+        return None
+    rank = max(int(round(pct / 100.0 * len(sorted_ms))) - 1, 0)
+    return round(sorted_ms[min(rank, len(sorted_ms) - 1)], 3)
+
+
+def run_load(quote: Callable[[float, float], bool], points: List[Tuple[float, float]],
+             concurrency: int) -> Dict[str, Any]:
+    """Quote every point once across ``concurrency`` threads"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(point):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = quote(*point)
+        except Exception:
+            ok = False
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        with lock:
+            latencies.append(elapsed_ms)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, points))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(points),
+        'errors': errors,
+        'error_rate': round(errors / len(points), 4) if points else 0.0,
+        'throughput_rps': round(len(points) / wall, 2) if wall else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': round(latencies[-1], 3) if latencies else None
+        }
+    }
+
+
+def run_benchmark(requests: int = 200, concurrency: List[int] = (1, 8, 32), latency: float = 0.02,
+                  failure_rate: float = 0.2, targets: List[str] = TARGETS,
+                  scenarios: List[str] = SCENARIOS, seed: int = 42) -> Dict[str, Any]:
+    """Run every scenario/target/concurrency combination; returns the report"""
+    original_service = delivery_module.delivery_service
+    results = []
+    try:
+        for target in targets:
+            make_target = service_target if target == 'service' else endpoint_target
+            for level in concurrency:
+                points = random_points(requests, seed + level)
+
+                if 'cold' in scenarios or 'warm' in scenarios:
+                    with ORSStubServer(latency=latency) as stub:
+                        service = make_service(stub)
+                        try:
+                            quote = make_target(service)
+                            cold = run_load(quote, points, level)  # also warms the cache
+                            if 'cold' in scenarios:
+                                results.append(dict(cold, scenario='cold', target=target, concurrency=level,
+                                                    ors_requests=stub.requests))
+                            if 'warm' in scenarios:
+                                before = stub.requests
+                                warm = run_load(quote, points, level)
+                                results.append(dict(warm, scenario='warm', target=target, concurrency=level,
+                                                    ors_requests=stub.requests - before))
+                        finally:
+                            service.close()
+
+                if 'failure' in scenarios:
+                    with ORSStubServer(latency=latency, failure_rate=failure_rate) as stub:
+                        service = make_service(stub)
+                        try:
+                            failure = run_load(make_target(service), points, level)
+                            results.append(dict(failure, scenario='failure', target=target, concurrency=level,
+                                                ors_requests=stub.requests))
+                        finally:
+                            service.close()
+    finally:
+        delivery_module.delivery_service = original_service
+
+    return {
+        'benchmark': 'delivery_quote',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'settings': {
+            'requests': requests,
+            'concurrency': list(concurrency),
+            'stub_latency_s': latency,
+            'failure_rate': failure_rate,
+            'seed': seed
+        },
+        'results': results
+    }
+
+
+def find_regressions(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Runs whose p95 latency rose or throughput fell by more than ``tolerance``"""
+    def key(result):
+        return result['scenario'], result['target'], result['concurrency']
+
+    previous = {key(result): result for result in baseline.get('results', [])}
+    regressions = []
+    for result in report['results']:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        name = '/'.join(str(part) for part in key(result))
+        p95, old_p95 = result['latency_ms']['p95'], before['latency_ms']['p95']
+        if p95 and old_p95 and p95 > old_p95 * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old_p95}ms -> {p95}ms")
+        rps, old_rps = result['throughput_rps'], before['throughput_rps']
+        if rps and old_rps and rps < old_rps * (1 - tolerance):
+            regressions.append(f"{name}: throughput {old_rps} -> {rps} req/s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark delivery quotes against a local ORS stub")
+    parser.add_argument('--requests', type=int, default=200, help='Quotes per run')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--latency', type=float, default=0.02, help='Stub response delay in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.2, help='Share of stub requests that fail')
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=list(TARGETS))
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression')
+    parser.add_argument('--verbose', action='store_true', help='Show service logs while running')
+    args = parser.parse_args(argv)
+
+    # Injected failures log on every request; keep them out of the report on stdout
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(sys.stderr if args.verbose else devnull):
+        if not args.verbose:
+            logging.disable(logging.ERROR)
+        report = run_benchmark(args.requests, args.concurrency, args.latency, args.failure_rate,
+                               args.targets, args.scenarios, args.seed)
+        logging.disable(logging.NOTSET)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📊 Wrote {len(report['results'])} benchmark results to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("✅ No regressions against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
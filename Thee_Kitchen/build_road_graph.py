@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Build the memory-mapped road graph used by the local routing backend
+
+Input is a pair of CSV files, e.g. exported from an OpenStreetMap extract
+of Greater Cairo:
+    nodes.csv  id,lat,lng
+    edges.csv  from,to,length_m[,oneway]   (oneway: 1 for one-way streets)
+
+    python build_road_graph.py graph nodes.csv edges.csv
+    python build_road_graph.py graph nodes.csv edges.csv --output /data/cairo_roads.graph
+
+Precompute distance tables for the configured hubs (rerun when the graph or
+DELIVERY_HUBS change):
+    python build_road_graph.py tables
+
+Then set DELIVERY_ROUTING_BACKEND=local_graph and restart the app.
+"""
+
+import argparse
+import csv
+import os
+import sys
+from typing import List, Tuple
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from delivery_routing import RoadGraph, write_road_graph, write_hub_tables
+
+
+def read_road_csv(nodes_path: str, edges_path: str) -> Tuple[List[float], List[float], List[Tuple[int, int, float]]]:
+    """Read node and edge CSVs into dense node indices and directed edges"""
+    index = {}
+    lats, lngs = [], []
+    with open(nodes_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            index[row['id']] = len(lats)
+            lats.append(float(row['lat']))
+            lngs.append(float(row['lng']))
+
+    edges = []
+    with open(edges_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            source, target = index[row['from']], index[row['to']]
+            length_m = float(row['length_m'])
+            edges.append((source, target, length_m))
+            if row.get('oneway', '0').strip() not in ('1', 'true', 'yes'):
+                edges.append((target, source, length_m))
+
+    return lats, lngs, edges
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the local road graph for delivery routing")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    graph_parser = subparsers.add_parser('graph', help="Build the road graph from CSV")
+    graph_parser.add_argument('nodes')
+    graph_parser.add_argument('edges')
+    graph_parser.add_argument('--output', default=Config.ROAD_GRAPH_PATH)
+
+    tables_parser = subparsers.add_parser('tables', help="Precompute hub distance tables")
+    tables_parser.add_argument('--graph', default=Config.ROAD_GRAPH_PATH)
+    tables_parser.add_argument('--output', default=Config.HUB_TABLES_PATH)
+
+    args = parser.parse_args(argv)
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write next to the target and swap, so running workers keep their mapping
+    tmp_path = f"{args.output}.tmp"
+
+    if args.command == 'graph':
+        lats, lngs, edges = read_road_csv(args.nodes, args.edges)
+        print(f"🛣️ Building road graph with {len(lats)} nodes and {len(edges)} directed edges")
+        write_road_graph(tmp_path, lats, lngs, edges)
+        os.replace(tmp_path, args.output)
+        print(f"✅ Wrote road graph to {args.output}")
+        print("Rebuild the hub tables, then restart the app to load the new graph.")
+        return 0
+
+    graph = RoadGraph(args.graph)
+    print(f"🛣️ Computing distances from {len(Config.DELIVERY_HUBS)} hubs to {graph.node_count} nodes")
+    write_hub_tables(tmp_path, graph, Config.DELIVERY_HUBS)
+    graph.close()
+    os.replace(tmp_path, args.output)
+    print(f"✅ Wrote hub distance tables to {args.output}")
+    print("Restart the app to load the new tables.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
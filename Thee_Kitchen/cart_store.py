@@ -0,0 +1,244 @@
+import json
+import secrets
+import threading
+import time
+from typing import Optional, Dict, Any, List, Tuple
+
+from extensions import db
+
+
+class Cart:
+    """Cart lines keyed by menu item id, with a running item count and subtotal.
+
+    Every change is O(1). Carts serialize to compact
+    ``[id, name, price, quantity]`` rows; older carts stored as a list of
+    dicts still load.
+    """
+
+    def __init__(self):
+        self._lines: Dict[int, Dict[str, Any]] = {}
+        self.count = 0
+        self._subtotal = 0.0
+
+    @classmethod
+    def from_data(cls, data: Optional[List[Any]]) -> 'Cart':
+        cart = cls()
+        for row in data or []:
+            if isinstance(row, dict):
+                cart.add(row['id'], row['name'], row['price'], row['quantity'])
+            else:
+                cart.add(*row)
+        return cart
+
+    def to_data(self) -> List[List[Any]]:
+        return [[line['id'], line['name'], line['price'], line['quantity']] for line in self._lines.values()]
+
+    @property
+    def subtotal(self) -> float:
+        # Rounded so repeated float updates cannot drift from the summed total
+        return round(self._subtotal, 2)
+
+    def get(self, item_id: int) -> Optional[Dict[str, Any]]:
+        return self._lines.get(item_id)
+
+    def add(self, item_id: int, name: str, price: float, quantity: int = 1):
+        """Add ``quantity`` of an item, creating its line if needed"""
+        line = self._lines.get(item_id)
+        if line is None:
+            line = self._lines[item_id] = {'id': item_id, 'name': name, 'price': price, 'quantity': 0}
+        self._adjust(line, quantity)
+
+    def change(self, item_id: int, delta: int):
+        """Change an item's quantity; lines that reach zero are removed"""
+        line = self._lines.get(item_id)
+        if line is not None:
+            self._adjust(line, delta)
+
+    def remove(self, item_id: int):
+        line = self._lines.get(item_id)
+        if line is not None:
+            self._adjust(line, -line['quantity'])
+
+    def clear(self):
+        self._lines.clear()
+        self.count = 0
+        self._subtotal = 0.0
+
+    def lines(self) -> List[Dict[str, Any]]:
+        """Cart lines in the order they were added"""
+        return list(self._lines.values())
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def _adjust(self, line: Dict[str, Any], delta: int):
+        delta = max(delta, -line['quantity'])
+        line['quantity'] += delta
+        self.count += delta
+        self._subtotal += line['price'] * delta
+        if line['quantity'] <= 0:
+            del self._lines[line['id']]
+        if not self._lines:
+            self._subtotal = 0.0
+
+
+CART_OPERATIONS = ('add', 'change', 'remove', 'clear')
+
+
+def parse_cart_operations(operations: Any, max_operations: int) -> List[Tuple[str, Optional[int], int]]:
+    """Validate a batch of cart operations into ``(op, item_id, amount)`` tuples.
+
+    ``amount`` is the quantity for ``add`` and the delta for ``change``.
+    Raises ValueError naming the first bad operation so a malformed batch
+    is rejected before anything is applied.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('A non-empty list of operations is required')
+    if len(operations) > max_operations:
+        raise ValueError(f'At most {max_operations} operations per request')
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op not in CART_OPERATIONS:
+            raise ValueError(f'Operation {index}: op must be one of {", ".join(CART_OPERATIONS)}')
+        if op == 'clear':
+            parsed.append((op, None, 0))
+            continue
+        try:
+            item_id = int(operation.get('item_id'))
+            amount = int(operation.get('quantity', 1) if op == 'add' else operation.get('change', 0))
+        except (TypeError, ValueError):
+            raise ValueError(f'Operation {index}: item_id and quantities must be integers')
+        if op == 'add' and amount < 1:
+            raise ValueError(f'Operation {index}: quantity must be at least 1')
+        parsed.append((op, item_id, amount))
+    return parsed
+
+
+class CartStore:
+    """Base class for server-side cart backends.
+
+    The browser session only carries a short random cart id; the cart itself
+    is stored here as JSON (see ``Cart.to_data``) with an expiry ``ttl``
+    seconds after its last save. Expired carts read as missing and are
+    purged at most once per ``purge_interval`` seconds.
+    """
+
+    def __init__(self, ttl: float, purge_interval: float = 3600):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+
+    @staticmethod
+    def new_id() -> str:
+        """A fresh cart id, short enough to keep the session cookie small"""
+        return secrets.token_urlsafe(12)
+
+    def get(self, cart_id: str) -> Optional[List[Any]]:
+        raise NotImplementedError
+
+    def save(self, cart_id: str, items: List[Any]):
+        raise NotImplementedError
+
+    def delete(self, cart_id: str):
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        """Drop expired carts; returns how many were removed"""
+        raise NotImplementedError
+
+    def _maybe_purge(self, now: float):
+        if now >= self._next_purge:
+            self._next_purge = now + self.purge_interval
+            self.purge_expired()
+
+
+class MemoryCartStore(CartStore):
+    """Per-process cart store; carts are lost on restart and not shared by workers"""
+
+    def __init__(self, ttl: float, purge_interval: float = 3600):
+        super().__init__(ttl, purge_interval)
+        self._carts: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, cart_id: str) -> Optional[List[Any]]:
+        with self._lock:
+            entry = self._carts.get(cart_id)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at <= time.time():
+                del self._carts[cart_id]
+                return None
+        return json.loads(payload)
+
+    def save(self, cart_id: str, items: List[Any]):
+        now = time.time()
+        payload = json.dumps(items)
+        with self._lock:
+            self._carts[cart_id] = (now + self.ttl, payload)
+        self._maybe_purge(now)
+
+    def delete(self, cart_id: str):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [cart_id for cart_id, (expires_at, _) in self._carts.items() if expires_at <= now]
+            for cart_id in expired:
+                del self._carts[cart_id]
+        return len(expired)
+
+
+class DatabaseCartStore(CartStore):
+    """Cart store in the application database, shared by every worker"""
+
+    def get(self, cart_id: str) -> Optional[List[Any]]:
+        from models import StoredCart
+
+        row = db.session.get(StoredCart, cart_id)
+        if row is None:
+            return None
+        if row.expires_at <= time.time():
+            db.session.delete(row)
+            db.session.commit()
+            return None
+        return json.loads(row.items)
+
+    def save(self, cart_id: str, items: List[Any]):
+        from models import StoredCart
+
+        now = time.time()
+        row = db.session.get(StoredCart, cart_id)
+        if row is None:
+            row = StoredCart(id=cart_id)
+            db.session.add(row)
+        row.items = json.dumps(items)
+        row.expires_at = now + self.ttl
+        db.session.commit()
+        self._maybe_purge(now)
+
+    def delete(self, cart_id: str):
+        from models import StoredCart
+
+        StoredCart.query.filter_by(id=cart_id).delete()
+        db.session.commit()
+
+    def purge_expired(self) -> int:
+        from models import StoredCart
+
+        removed = StoredCart.query.filter(StoredCart.expires_at <= time.time()).delete()
+        db.session.commit()
+        return removed
+
+
+def create_cart_store(backend: str, ttl: float = 604800) -> CartStore:
+    """Build the cart store backend named in configuration"""
+    if backend == 'memory':
+        return MemoryCartStore(ttl=ttl)
+    if backend == 'database':
+        return DatabaseCartStore(ttl=ttl)
+    raise ValueError(f"Unknown cart store backend: {backend}")
@@ -79,18 +79,112 @@ class Config:
             "max_overflow": 20
         }
     
+    # Server-side carts ("database" shared by all workers, or "memory" per worker);
+    # the session cookie only carries the cart id
+    CART_STORE_BACKEND = os.getenv("CART_STORE_BACKEND", "database")
+    CART_TTL_SECONDS = 7 * 86400  # 7 days since the last change
+    CART_BATCH_MAX_OPERATIONS = 100  # per /update_cart_batch request
+
+    # Menu items are served from a per-worker snapshot; other workers' edits
+    # are noticed by checking the shared menu version this often
+    MENU_CATALOG_CHECK_SECONDS = 30
+    # Insert the sample menu at startup when the menu table is empty
+    MENU_SEED_ON_STARTUP = os.getenv("MENU_SEED_ON_STARTUP", "true").lower() == "true"
+
     # OpenRouteService API configuration
     ORS_API_KEY = os.getenv("ORS_API_KEY", "eyJvcmciOiI1YjNjZTM1OTc4NTExMTAwMDFjZjYyNDgiLCJpZCI6IjQ0MWFkNjJiNzI3ODRlNGJhMzJiMzQwMDRkMTExNWQwIiwiaCI6Im11cm11cjY0In0=")
+    ORS_BASE_URL = os.getenv("ORS_BASE_URL", "https://api.openrouteservice.org")
+    ORS_TIMEOUT = 7  # seconds
+
+    # Keep-alive connection pool for ORS calls (per worker process)
+    ORS_POOL_CONNECTIONS = 2   # number of hosts to keep pools for
+    ORS_POOL_MAXSIZE = 10      # connections kept open per host
+
+    # Retries: jittered exponential backoff inside a per-quote deadline budget
+    ORS_MAX_RETRIES = 2
+    ORS_RETRY_BACKOFF_SECONDS = 0.2
+    ORS_RETRY_DEADLINE_SECONDS = 10
+
+    # Circuit breaker: fail fast (or serve stale cache) while ORS is unhealthy
+    ORS_BREAKER_FAILURE_THRESHOLD = 5
+    ORS_BREAKER_RESET_SECONDS = 30
+
+    # Hedging: send a second request if the first is slower than the recent p95
+    ORS_HEDGE_ENABLED = os.getenv("ORS_HEDGE_ENABLED", "false").lower() == "true"
+    ORS_HEDGE_MIN_SAMPLES = 20
+
+    # Client-side ORS quota (free plan: 40 matrix requests a minute, 500 a day).
+    # Order placement may spend all of it; other quotes leave the reserve share
+    # untouched and are shed if no token frees up within their wait
+    ORS_QUOTA_PER_MINUTE = 40
+    ORS_QUOTA_PER_DAY = 500
+    ORS_QUOTA_ORDER_RESERVE = 0.25
+    ORS_QUOTA_MAX_WAIT_SECONDS = {'high': 5.0, 'low': 1.0}
+
+    # OpenRouteService matrix limits per request (locations = hubs + destinations)
+    ORS_MATRIX_MAX_LOCATIONS = 50
+    ORS_MATRIX_MAX_ROUTES = 3500
 
     # Delivery configuration
     DELIVERY_FEE_NEAR = 50
     DELIVERY_FEE_FAR = 80
     DELIVERY_THRESHOLD_NEAR_KM = 25.0
     DELIVERY_MAX_KM = 70.0
+    # Fee tiers as (up_to_km, fee) breakpoints; past the last one is out of range
+    DELIVERY_FEE_TIERS = [
+        (DELIVERY_THRESHOLD_NEAR_KM, DELIVERY_FEE_NEAR),
+        (DELIVERY_MAX_KM, DELIVERY_FEE_FAR)
+    ]
+    DELIVERY_BATCH_MAX_POINTS = 1000  # per /api/delivery/quote/batch request
 
     # Delivery hubs (backend only - never expose to frontend)
     DELIVERY_HUBS = [
         {"lat": 30.1610413, "lng": 31.5609381},  # Future City
         {"lat": 30.0809753, "lng": 31.2355689}   # Shubra Masr
     ]
+    # Optional per-hub fee tiers, keyed by index into DELIVERY_HUBS; the hub
+    # with the shortest driving distance prices the order
+    DELIVERY_HUB_FEE_TIERS = {}
+    # Hubs routed per quote: the straight-line nearest first, then others only
+    # while their straight-line distance could still beat the best route
+    DELIVERY_HUB_CANDIDATES = 2
     OSRM_BASE_URL = "https://router.project-osrm.org"
+
+    # Delivery distance cache ("memory" per worker, or "sqlite" shared by all workers)
+    DELIVERY_CACHE_BACKEND = os.getenv("DELIVERY_CACHE_BACKEND", "memory")
+    DELIVERY_CACHE_PATH = os.getenv("DELIVERY_CACHE_PATH", "/data/delivery_cache.sqlite3")
+    DELIVERY_CACHE_TTL = 600  # 10 minutes
+    # Entries past the TTL are kept until the hard TTL so they can still be
+    # served while OpenRouteService is down
+    DELIVERY_CACHE_HARD_TTL = 86400  # 1 day
+    # Serve entries past the TTL immediately and refresh them in the background
+    DELIVERY_CACHE_STALE_WHILE_REVALIDATE = True
+    DELIVERY_CACHE_MAX_ENTRIES = 5000
+    DELIVERY_CACHE_SHARDS = 16  # independently locked slices of the memory cache
+    # Nearby points share one cached distance per grid cell (0 disables snapping).
+    # Points whose distance is within the guard of a fee boundary use exact keys.
+    DELIVERY_CACHE_CELL_METERS = 100
+    DELIVERY_CACHE_BOUNDARY_GUARD_KM = 0.5
+    # Preload distances of recent order addresses (most frequent first) at startup
+    DELIVERY_CACHE_WARM_ON_STARTUP = os.getenv("DELIVERY_CACHE_WARM_ON_STARTUP", "true").lower() == "true"
+    DELIVERY_CACHE_WARM_DAYS = 180
+    DELIVERY_CACHE_WARM_LIMIT = 2000
+
+    # Straight-line pre-filter: road distance is never shorter than the
+    # great-circle distance and rarely longer than it times the circuity factor
+    DELIVERY_PREFILTER_ENABLED = True
+    DELIVERY_ROAD_CIRCUITY = 1.6
+
+    # Precomputed driving isochrones per hub (build with: python delivery_zones.py build)
+    DELIVERY_ZONES_PATH = os.getenv("DELIVERY_ZONES_PATH", "/data/delivery_zones.geojson")
+
+    # Routing backend: "ors" (HTTP per quote) or "local_graph" (in-process
+    # search over a preprocessed road graph, falling back to ORS when a point
+    # is off the graph). Build the graph with: python build_road_graph.py graph
+    DELIVERY_ROUTING_BACKEND = os.getenv("DELIVERY_ROUTING_BACKEND", "ors")
+    ROAD_GRAPH_PATH = os.getenv("ROAD_GRAPH_PATH", "/data/cairo_roads.graph")
+    ROAD_GRAPH_MAX_SNAP_KM = 0.5
+    # Give up on a graph search after this many nodes and ask the next backend
+    ROAD_GRAPH_MAX_SETTLED_NODES = int(os.getenv("ROAD_GRAPH_MAX_SETTLED_NODES", "20000"))
+    # Per-hub distance to every graph node (build with: python build_road_graph.py tables)
+    HUB_TABLES_PATH = os.getenv("HUB_TABLES_PATH", "/data/cairo_hub_tables.bin")
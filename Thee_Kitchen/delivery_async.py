@@ -0,0 +1,276 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Optional, Any, Awaitable, Callable, Dict, List, Set
+
+import aiohttp
+
+from config import Config
+from delivery_resilience import CircuitBreaker
+from delivery_service import _log, _ors_priority
+
+
+class AsyncORSClient:
+    """asyncio client for the OpenRouteService Matrix API.
+
+    Shares request building and response parsing with ``DeliveryService``
+    so the sync and async paths always agree on payloads and results.
+
+    One client lives as long as its service (see ``DeliveryService.async_ors``).
+    It runs its own event loop on a background thread with one keep-alive
+    ``aiohttp`` session, so the short-lived loops Flask starts for async views
+    only wait on it and every quote reuses the same upstream connections.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.timeout = aiohttp.ClientTimeout(total=service.ors_timeout)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tasks: Set['asyncio.Task'] = set()
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name='ors-async', daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Only called on the client's own loop, so no lock is needed
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=Config.ORS_POOL_MAXSIZE)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def _post_matrix(self, session: aiohttp.ClientSession,
+                           hubs: List[Dict[str, float]],
+                           dest_lat: float, dest_lng: float,
+                           outcome: Optional[Dict[str, bool]] = None,
+                           timeout: Optional[float] = None) -> Optional[List[Optional[float]]]:
+        """POST one matrix request; returns per-hub distances or None on failure.
+
+        The quota and breaker are checked by the caller (see ``_with_retry``).
+        ``outcome['rejected']`` is set when ORS answered but refused or could
+        not route the matrix, as opposed to being slow, failing or skipped.
+        """
+        outcome = outcome if outcome is not None else {}
+        headers = {
+            'Authorization': self.service.api_key,
+            'Content-Type': 'application/json'
+        }
+        payload = self.service._build_matrix_request(hubs, dest_lat, dest_lng)
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else self.timeout
+
+        breaker = self.service.breaker
+        metrics = self.service.metrics
+        metrics.increment('ors_calls')
+        try:
+            started = time.monotonic()
+            with metrics.timer('ors_call'):
+                async with session.post(self.service.matrix_url, json=payload, headers=headers,
+                                        timeout=request_timeout) as response:
+                    self.service.quota.update_from_headers(response.headers, response.status)
+                    response.raise_for_status()
+                    breaker.record_success()
+                    data = await response.json()
+            self.service.ors_latency.record(time.monotonic() - started)
+            result = self.service._parse_matrix_response(data, len(hubs))
+            outcome['rejected'] = result is None
+            return result
+
+        except asyncio.CancelledError:
+            # Cut off by the quote deadline; never leave a half-open probe taken
+            breaker.record_failure()
+            metrics.increment('ors_failures')
+            raise
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            metrics.increment('ors_failures')
+            _log('error', "OpenRouteService API timeout")
+            return None
+        except aiohttp.ClientResponseError as e:
+            # Only server-side trouble and throttling count against ORS health
+            if e.status >= 500 or e.status == 429:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+                outcome['rejected'] = True
+            metrics.increment('ors_failures')
+            _log('error', f"OpenRouteService API request error: {e}")
+            return None
+        except aiohttp.ClientError as e:
+            breaker.record_failure()
+            metrics.increment('ors_failures')
+            _log('error', f"OpenRouteService API request error: {e}")
+            return None
+        except (KeyError, ValueError, TypeError, IndexError) as e:
+            outcome['rejected'] = True
+            metrics.increment('ors_failures')
+            _log('error', f"OpenRouteService API parsing error: {e}")
+            return None
+
+    async def hub_distances(self, hubs: List[Dict[str, float]],
+                            dest_lat: float, dest_lng: float) -> Optional[List[Optional[float]]]:
+        """Get driving distance (km) from every hub to the customer.
+
+        Runs on the client's loop whatever loop awaits it, and gives up once
+        the service's retry deadline has passed.
+        """
+        if not self.service.api_key:
+            _log('error', "OpenRouteService API key not configured")
+            return None
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._hub_distances(hubs, dest_lat, dest_lng, _ors_priority.get()), self._ensure_loop()
+        )
+        return await asyncio.wrap_future(future)
+
+    async def _hub_distances(self, hubs: List[Dict[str, float]], dest_lat: float, dest_lng: float,
+                             priority: str) -> Optional[List[Optional[float]]]:
+        _ors_priority.set(priority)
+        try:
+            return await asyncio.wait_for(self._route(hubs, dest_lat, dest_lng), self.service.retry_deadline)
+        except asyncio.TimeoutError:
+            _log('error', "OpenRouteService async quote ran past its deadline")
+            return None
+
+    async def _with_retry(self, call: Callable[[float], Awaitable[Any]],
+                          outcome: Optional[Dict[str, bool]] = None,
+                          max_retries: Optional[int] = None) -> Any:
+        """Async counterpart of ``DeliveryService._with_retry``.
+
+        Same full-jitter backoff, quota and breaker checks, within the
+        service's retry deadline. Stops early once ``outcome`` says ORS
+        rejected the request, since sending it again will not help.
+        """
+        service = self.service
+        max_retries = service.max_retries if max_retries is None else max_retries
+        deadline = time.monotonic() + service.retry_deadline
+        attempt = 0
+        while True:
+            priority = _ors_priority.get()
+            if not await service.quota.acquire_async(priority):
+                service.metrics.increment(f'ors_shed.{priority}')
+                _log('warning', f"OpenRouteService quota exhausted; shedding {priority}-priority call")
+                return None
+            # Only take the breaker's half-open probe once the call will really be made
+            if not service.breaker.allow_request():
+                service.quota.refund()
+                _log('warning', "OpenRouteService circuit open; skipping call")
+                return None
+
+            remaining = deadline - time.monotonic()
+            result = await call(min(service.ors_timeout, remaining))
+            if result is not None or (outcome is not None and outcome.get('rejected')):
+                return result
+
+            attempt += 1
+            if attempt > max_retries:
+                return None
+
+            backoff = random.uniform(0, service.retry_backoff * (2 ** attempt))
+            # Leave room for at least one more reasonable attempt
+            if time.monotonic() + backoff + 1.0 >= deadline:
+                return None
+
+            service._count(service.resilience_stats, 'retries')
+            _log('info', "Retrying OpenRouteService API call")
+            await asyncio.sleep(backoff)
+
+    async def _post_matrix_hedged(self, session: aiohttp.ClientSession, hubs: List[Dict[str, float]],
+                                  dest_lat: float, dest_lng: float, timeout: float,
+                                  outcome: Dict[str, bool]) -> Optional[List[Optional[float]]]:
+        """POST the matrix, hedging with a second request after the p95 delay"""
+        service = self.service
+        hedge_delay = service.ors_latency.percentile(95)
+        if not service.hedge_enabled or len(service.ors_latency) < service.hedge_min_samples or hedge_delay is None:
+            return await self._post_matrix(session, hubs, dest_lat, dest_lng, outcome, timeout=timeout)
+
+        primary = self._start(self._post_matrix(session, hubs, dest_lat, dest_lng, outcome, timeout=timeout))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        if done or not service.quota.try_acquire(_ors_priority.get()):
+            return await primary
+        if not service.breaker.allow_request():
+            service.quota.refund()
+            return await primary
+
+        service._count(service.resilience_stats, 'hedged_requests')
+        hedge = self._start(self._post_matrix(session, hubs, dest_lat, dest_lng, outcome,
+                                              timeout=max(timeout - hedge_delay, 0.1)))
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result is not None:
+                    # The slower call finishes on its own and still updates the breaker
+                    return result
+        return None
+
+    def _start(self, coro: Awaitable[Any]) -> 'asyncio.Task':
+        # Hedged calls may outlive the quote that started them; keep them referenced
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _route(self, hubs: List[Dict[str, float]],
+                     dest_lat: float, dest_lng: float) -> Optional[List[Optional[float]]]:
+        """One batched matrix request, split per hub only when ORS rejected the batch.
+
+        The batch is retried and hedged like the sync path. ORS refuses a
+        whole matrix when one hub is unroutable, so each hub is then asked
+        on its own. After timeouts, server errors, throttling or a shed call
+        the split is skipped: more calls would only add load.
+        """
+        session = self._get_session()
+        outcome = {}
+        result = await self._with_retry(
+            lambda timeout: self._post_matrix_hedged(session, hubs, dest_lat, dest_lng, timeout, outcome),
+            outcome
+        )
+        if result is not None or len(hubs) == 1:
+            return result
+        if not outcome.get('rejected') or self.service.breaker.state != CircuitBreaker.CLOSED:
+            return None
+
+        _log('info', "Retrying OpenRouteService API call per hub")
+        per_hub = await asyncio.gather(*[
+            self._with_retry(
+                lambda timeout, hub=hub: self._post_matrix(session, [hub], dest_lat, dest_lng, timeout=timeout),
+                max_retries=0
+            )
+            for hub in hubs
+        ])
+
+        results = [distances[0] if distances else None for distances in per_hub]
+        if all(distance is None for distance in results):
+            return None
+        return results
+
+    async def _close_session(self) -> None:
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def close(self) -> None:
+        """Close the shared session and stop the client's loop"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close_session(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
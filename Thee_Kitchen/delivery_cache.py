@@ -0,0 +1,275 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+
+METERS_PER_DEGREE_LAT = 111320.0
+
+
+def grid_cell_key(lat: float, lng: float, cell_meters: float) -> str:
+    """Snap coordinates to a roughly square grid cell of ``cell_meters``.
+
+    Rows are a fixed height in latitude; each row is split into columns whose
+    width in longitude is scaled by the row's latitude, so cells stay close
+    to ``cell_meters`` wide anywhere on the map.
+    """
+    cell_lat = cell_meters / METERS_PER_DEGREE_LAT
+    row = math.floor((lat + 90.0) / cell_lat)
+
+    row_center_lat = -90.0 + (row + 0.5) * cell_lat
+    meters_per_degree_lng = METERS_PER_DEGREE_LAT * max(math.cos(math.radians(row_center_lat)), 1e-6)
+    cell_lng = cell_meters / meters_per_degree_lng
+    col = math.floor((lng + 180.0) / cell_lng)
+
+    return f"g{int(cell_meters)}:{row}:{col}"
+
+
+class DistanceCache:
+    """Base class for delivery distance cache backends.
+
+    Entries are stored as ``(stored_at, value)`` pairs. Backends drop entries
+    older than ``ttl`` seconds and evict the least recently used entries once
+    ``max_entries`` is reached.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def _is_expired(self, stored_at: float, now: float) -> bool:
+        return now - stored_at >= self.ttl
+
+    def _record(self, hits: int = 0, misses: int = 0, evictions: int = 0) -> None:
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/eviction counters for this process"""
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend_name,
+            'size': len(self),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class MemoryDistanceCache(DistanceCache):
+    """In-process LRU cache with TTL expiry.
+
+    Keys are spread over independently locked shards so concurrent threads
+    rarely wait on each other. Each shard evicts its own least recently used
+    entries once it holds its share of ``max_entries``; small caches use a
+    single shard so eviction order stays exact.
+    """
+
+    backend_name = 'memory'
+    MIN_SHARD_ENTRIES = 64
+
+    def __init__(self, max_entries: int = 5000, ttl: float = 600, shards: int = 16):
+        super().__init__(max_entries, ttl)
+        shard_count = max(1, min(shards, max_entries // self.MIN_SHARD_ENTRIES))
+        self._shard_capacity = -(-max_entries // shard_count)
+        self._shards = [OrderedDict() for _ in range(shard_count)]
+        self._locks = [threading.Lock() for _ in range(shard_count)]
+
+    def _shard_for(self, key: str) -> Tuple[OrderedDict, threading.Lock]:
+        index = hash(key) % len(self._shards)
+        return self._shards[index], self._locks[index]
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        entries, lock = self._shard_for(key)
+        with lock:
+            entry = entries.get(key)
+            if entry is None:
+                self._record(misses=1)
+                return None
+
+            if self._is_expired(entry[0], time.time()):
+                del entries[key]
+                self._record(misses=1, evictions=1)
+                return None
+
+            entries.move_to_end(key)
+            self._record(hits=1)
+            return entry
+
+    def set(self, key: str, value: Any) -> None:
+        entries, lock = self._shard_for(key)
+        with lock:
+            entries[key] = (time.time(), value)
+            entries.move_to_end(key)
+
+            evicted = 0
+            while len(entries) > self._shard_capacity:
+                entries.popitem(last=False)
+                evicted += 1
+            if evicted:
+                self._record(evictions=evicted)
+
+    def delete(self, key: str) -> None:
+        entries, lock = self._shard_for(key)
+        with lock:
+            entries.pop(key, None)
+
+    def clear(self) -> None:
+        for entries, lock in zip(self._shards, self._locks):
+            with lock:
+                entries.clear()
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._shards)
+
+
+class SQLiteDistanceCache(DistanceCache):
+    """Cache shared by every worker on the host through a SQLite file.
+
+    Each thread (and each forked gunicorn worker) opens its own connection.
+    WAL mode lets readers proceed while another worker writes.
+
+    To keep reads and writes to one statement each, the row count is
+    tracked in-process and only re-counted once it passes ``max_entries``;
+    eviction then frees ``EVICTION_BATCH`` of the capacity at once. A hit
+    refreshes its recency at most every ``TOUCH_INTERVAL`` seconds, so LRU
+    order is that coarse.
+    """
+
+    backend_name = 'sqlite'
+    EVICTION_BATCH = 0.1  # share of max_entries freed per eviction
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, path: str, max_entries: int = 5000, ttl: float = 600):
+        super().__init__(max_entries, ttl)
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS distance_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_distance_cache_accessed_at "
+            "ON distance_cache (accessed_at)"
+        )
+        self._size_lock = threading.Lock()
+        self._size = len(self)  # rows as of the last count, plus this process's inserts since
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return a connection owned by the current thread and process"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, stored_at, accessed_at FROM distance_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self._record(misses=1)
+            return None
+
+        now = time.time()
+        if self._is_expired(row[1], now):
+            conn.execute("DELETE FROM distance_cache WHERE key = ?", (key,))
+            self._record(misses=1, evictions=1)
+            return None
+
+        if now - row[2] >= self.TOUCH_INTERVAL:
+            conn.execute(
+                "UPDATE distance_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        self._record(hits=1)
+        return row[1], json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO distance_cache (key, value, stored_at, accessed_at) "
+            "VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now, now)
+        )
+
+        with self._size_lock:
+            # Replacing a key is counted too; the re-count below corrects it
+            self._size += 1
+            if self._size <= self.max_entries:
+                return
+            self._size = len(self)
+            if self._size <= self.max_entries:
+                return
+            overflow = self._size - self.max_entries + int(self.max_entries * self.EVICTION_BATCH)
+            conn.execute(
+                "DELETE FROM distance_cache WHERE key IN ("
+                "SELECT key FROM distance_cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,)
+            )
+            self._size -= overflow
+        self._record(evictions=overflow)
+
+    def delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM distance_cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        self._connect().execute("DELETE FROM distance_cache")
+        with self._size_lock:
+            self._size = 0
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM distance_cache").fetchone()[0]
+
+
+def create_distance_cache(backend: str, path: str = None, max_entries: int = 5000,
+                          ttl: float = 600, shards: int = 16) -> DistanceCache:
+    """Build the cache backend named in configuration"""
+    if backend == 'memory':
+        return MemoryDistanceCache(max_entries=max_entries, ttl=ttl, shards=shards)
+    if backend == 'sqlite':
+        if not path:
+            raise ValueError("DELIVERY_CACHE_PATH is required for the sqlite cache backend")
+        return SQLiteDistanceCache(path, max_entries=max_entries, ttl=ttl)
+    raise ValueError(f"Unknown delivery cache backend: {backend}")
@@ -0,0 +1,97 @@
+from bisect import bisect_left
+from typing import Optional, Dict, Any, List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; batches fall back to bisect
+    np = None
+
+
+class FeeSchedule:
+    """Distance-based delivery fee tiers as a sorted breakpoint table.
+
+    ``tiers`` are ``(up_to_km, fee)`` pairs: a distance up to and including
+    ``up_to_km`` pays ``fee``. Anything past the last breakpoint is out of
+    range. Lookup is a binary search over the breakpoints.
+    """
+
+    def __init__(self, tiers: Sequence[Tuple[float, float]]):
+        if not tiers:
+            raise ValueError("A fee schedule needs at least one tier")
+        ordered = sorted((float(up_to_km), fee) for up_to_km, fee in tiers)
+        self.breakpoints = [up_to_km for up_to_km, _ in ordered]
+        self.fees = [fee for _, fee in ordered]
+
+    @property
+    def max_km(self) -> float:
+        return self.breakpoints[-1]
+
+    def tier_index(self, distance_km: float) -> int:
+        """Index of the tier a distance falls in; ``len(fees)`` when out of range"""
+        return bisect_left(self.breakpoints, distance_km)
+
+    def price(self, distance_km: float) -> Dict[str, Any]:
+        """Return ``{'delivery_fee', 'out_of_range'}`` for one distance"""
+        tier = self.tier_index(distance_km)
+        if tier >= len(self.fees):
+            return {'delivery_fee': 0, 'out_of_range': True}
+        return {'delivery_fee': self.fees[tier], 'out_of_range': False}
+
+    def price_many(self, distances_km: Sequence[float]) -> Tuple[Any, Any]:
+        """Price an array of distances at once.
+
+        Returns ``(fees, out_of_range)``; out-of-range entries have fee 0.
+        With NumPy installed both are arrays from one ``searchsorted`` call,
+        otherwise plain lists.
+        """
+        if np is not None:
+            tiers = np.searchsorted(np.asarray(self.breakpoints), np.asarray(distances_km, dtype=float), side='left')
+            fees = np.append(np.asarray(self.fees), 0)[tiers]
+            return fees, tiers >= len(self.fees)
+
+        tiers = [bisect_left(self.breakpoints, distance_km) for distance_km in distances_km]
+        fees = [self.fees[tier] if tier < len(self.fees) else 0 for tier in tiers]
+        return fees, [tier >= len(self.fees) for tier in tiers]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FeeSchedule) and (self.breakpoints, self.fees) == (other.breakpoints, other.fees)
+
+    def __repr__(self) -> str:
+        return f"FeeSchedule({list(zip(self.breakpoints, self.fees))!r})"
+
+
+class FeeSchedules:
+    """The default fee schedule plus optional per-hub overrides"""
+
+    def __init__(self, default: FeeSchedule, per_hub: Optional[Dict[int, FeeSchedule]] = None):
+        self.default = default
+        self.per_hub = dict(per_hub or {})
+
+    @classmethod
+    def from_config(cls, tiers: Sequence[Tuple[float, float]],
+                    hub_tiers: Optional[Dict[int, Sequence[Tuple[float, float]]]] = None) -> 'FeeSchedules':
+        return cls(FeeSchedule(tiers), {
+            int(hub_index): FeeSchedule(hub_schedule) for hub_index, hub_schedule in (hub_tiers or {}).items()
+        })
+
+    def for_hub(self, hub_index: Optional[int]) -> FeeSchedule:
+        return self.per_hub.get(hub_index, self.default)
+
+    def all(self) -> List[FeeSchedule]:
+        return [self.default] + list(self.per_hub.values())
+
+    @property
+    def max_km(self) -> float:
+        """Farthest distance any hub delivers to"""
+        return max(schedule.max_km for schedule in self.all())
+
+    def boundaries(self) -> List[float]:
+        """Every distance (km) where some hub's fee or range changes"""
+        return sorted({km for schedule in self.all() for km in schedule.breakpoints})
+
+    def common_first_tier(self) -> Optional[Tuple[float, float]]:
+        """``(up_to_km, fee)`` every hub charges below; None if hubs disagree"""
+        first_fees = {schedule.fees[0] for schedule in self.all()}
+        if len(first_fees) != 1:
+            return None
+        return min(schedule.breakpoints[0] for schedule in self.all()), first_fees.pop()
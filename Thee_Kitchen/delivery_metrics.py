@@ -0,0 +1,113 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Sequence
+
+# Upper bounds (milliseconds) of the latency buckets
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with interpolated percentiles.
+
+    Memory stays constant however many observations are recorded; each
+    percentile is interpolated inside the bucket holding its rank.
+    """
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.bounds = list(buckets_ms)
+        self._counts = [0] * (len(self.bounds) + 1)  # last bucket is overflow
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms: float) -> None:
+        with self._lock:
+            self._counts[bisect_left(self.bounds, value_ms)] += 1
+            self._count += 1
+            self._sum += value_ms
+            self._max = max(self._max, value_ms)
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Estimated percentile in milliseconds, or None when empty"""
+        with self._lock:
+            counts, total, maximum = list(self._counts), self._count, self._max
+        if not total:
+            return None
+
+        rank = pct / 100.0 * total
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else maximum
+                upper = min(upper, maximum)
+                return lower + (upper - lower) * max(rank - seen, 0) / bucket_count
+            seen += bucket_count
+        return maximum
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total_ms, maximum = self._count, self._sum, self._max
+
+        def rounded(value):
+            return round(value, 2) if value is not None else None
+
+        return {
+            'count': count,
+            'mean_ms': rounded(total_ms / count) if count else None,
+            'max_ms': rounded(maximum) if count else None,
+            'p50_ms': rounded(self.percentile(50)),
+            'p95_ms': rounded(self.percentile(95)),
+            'p99_ms': rounded(self.percentile(99))
+        }
+
+
+class DeliveryMetrics:
+    """Named latency histograms and counters for the delivery service"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram()
+            return self._histograms[name]
+
+    def observe(self, name: str, value_ms: float) -> None:
+        self.histogram(name).observe(value_ms)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Record the duration of the block, even when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - started) * 1000.0)
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        return {
+            'latency': {name: histogram.snapshot() for name, histogram in sorted(histograms.items())},
+            'counters': dict(sorted(counters.items()))
+        }
@@ -0,0 +1,310 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, Callable, Tuple
+
+
+class CircuitBreaker:
+    """Circuit breaker for an upstream dependency.
+
+    ``closed``: calls flow normally. After ``failure_threshold`` consecutive
+    failures the breaker goes ``open`` and rejects calls for
+    ``reset_timeout`` seconds. It then goes ``half_open`` and lets a single
+    probe through: success closes it, failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.times_opened = 0
+        self.rejected_calls = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        """Return True if a call may go upstream now"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected_calls += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return breaker state for monitoring"""
+        with self._lock:
+            self._maybe_half_open()
+            retry_in = None
+            if self._state == self.OPEN:
+                retry_in = round(max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0), 1)
+            return {
+                'state': self._state,
+                'consecutive_failures': self._consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'times_opened': self.times_opened,
+                'rejected_calls': self.rejected_calls,
+                'retry_in_seconds': retry_in
+            }
+
+
+class LatencyWindow:
+    """Rolling window of recent latencies (seconds) for percentile estimates"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Nearest-rank percentile of the window, or None when empty"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        rank = max(int(round(pct / 100.0 * len(samples))) - 1, 0)
+        return samples[min(rank, len(samples) - 1)]
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one.
+
+    The first caller for a key becomes the leader and does the work; callers
+    arriving while it is in flight wait on the leader's ``Future`` instead of
+    repeating it. Async callers can ``await asyncio.wrap_future(future)``.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def begin(self, key: str) -> Tuple[Future, bool]:
+        """Return ``(future, is_leader)`` for key"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def finish(self, key: str, future: Future, result: Any = None,
+               error: Optional[BaseException] = None) -> None:
+        """Publish the leader's outcome to every waiting caller"""
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn once for all concurrent callers with the same key"""
+        future, is_leader = self.begin(key)
+        if not is_leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result=result)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {'in_flight': in_flight, 'leaders': self.leaders, 'shared': self.shared}
+
+
+def _header_number(headers, name: str) -> Optional[float]:
+    """Numeric value of a response header, or None when absent or malformed"""
+    value = headers.get(name) if headers is not None else None
+    if not isinstance(value, str):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class QuotaScheduler:
+    """Client-side token bucket for a rate-limited upstream, with priorities.
+
+    Tokens refill at ``per_minute`` a minute, up to a minute's worth. A daily
+    budget of ``per_day`` requests is counted down alongside and corrected
+    from the upstream's ``x-ratelimit-*`` response headers. ``high`` priority
+    calls may spend everything; ``low`` priority calls must leave the
+    ``reserve`` share of both untouched. Callers wait up to their priority's
+    ``max_wait`` for a token and are shed after that.
+    """
+
+    HIGH = 'high'
+    LOW = 'low'
+
+    def __init__(self, per_minute: float = 40, per_day: int = 500, reserve: float = 0.25,
+                 max_wait: Optional[Dict[str, float]] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.daily_limit = per_day
+        self.reserve = reserve
+        self.max_wait = max_wait or {self.HIGH: 5.0, self.LOW: 1.0}
+        self._tokens = self.capacity
+        self._refilled_at = time.monotonic()
+        self._daily_remaining = float(per_day)
+        self._daily_reset_at = time.time() + 86400
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.granted = {self.HIGH: 0, self.LOW: 0}
+        self.shed = {self.HIGH: 0, self.LOW: 0}
+        self.throttled = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if time.time() >= self._daily_reset_at:
+            self._daily_remaining = float(self.daily_limit)
+            self._daily_reset_at = time.time() + 86400
+
+    def _floors(self, priority: str) -> Tuple[float, float]:
+        """Tokens and daily requests a caller of this priority must leave behind"""
+        if priority == self.HIGH:
+            return 0.0, 0.0
+        return self.capacity * self.reserve, self.daily_limit * self.reserve
+
+    def _try_acquire(self, priority: str) -> Optional[float]:
+        """Take a token: 0.0 if granted, seconds to wait before retrying, or None if shed"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            token_floor, daily_floor = self._floors(priority)
+            if self._daily_remaining - 1 < daily_floor:
+                return None  # waiting will not help before the daily reset
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            if self._tokens - 1 < token_floor:
+                return (token_floor + 1 - self._tokens) / self.rate
+            self._tokens -= 1
+            self._daily_remaining -= 1
+            self.granted[priority] += 1
+            return 0.0
+
+    def _record_shed(self, priority: str) -> bool:
+        with self._lock:
+            self.shed[priority] += 1
+        return False
+
+    def try_acquire(self, priority: str = LOW) -> bool:
+        """Take a token only if one is available right now"""
+        return self._try_acquire(priority) == 0.0
+
+    def acquire(self, priority: str = LOW) -> bool:
+        """Wait for a token; False if the call should be shed"""
+        deadline = time.monotonic() + self.max_wait.get(priority, 0.0)
+        while True:
+            wait = self._try_acquire(priority)
+            if wait == 0.0:
+                return True
+            if wait is None or time.monotonic() + wait > deadline:
+                return self._record_shed(priority)
+            time.sleep(wait)
+
+    async def acquire_async(self, priority: str = LOW) -> bool:
+        """``acquire`` that awaits instead of blocking the event loop"""
+        import asyncio  # Only the async ORS client needs this
+        deadline = time.monotonic() + self.max_wait.get(priority, 0.0)
+        while True:
+            wait = self._try_acquire(priority)
+            if wait == 0.0:
+                return True
+            if wait is None or time.monotonic() + wait > deadline:
+                return self._record_shed(priority)
+            await asyncio.sleep(wait)
+
+    def refund(self) -> None:
+        """Return a token that was acquired but not spent upstream"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+            self._daily_remaining = min(float(self.daily_limit), self._daily_remaining + 1)
+
+    def update_from_headers(self, headers, status_code: Optional[int] = None) -> None:
+        """Correct local counts from ``x-ratelimit-*`` headers; back off on 429"""
+        remaining = _header_number(headers, 'x-ratelimit-remaining')
+        limit = _header_number(headers, 'x-ratelimit-limit')
+        reset_at = _header_number(headers, 'x-ratelimit-reset')
+        retry_after = _header_number(headers, 'retry-after')
+        with self._lock:
+            if limit is not None:
+                self.daily_limit = int(limit)
+            if remaining is not None:
+                self._daily_remaining = remaining
+            if reset_at is not None and reset_at > time.time():
+                self._daily_reset_at = reset_at
+            if status_code == 429:
+                # Upstream says we are over: stop everyone until it lets us back in
+                self.throttled += 1
+                self._tokens = min(self._tokens, 0.0)
+                pause = retry_after if retry_after is not None else 1.0 / self.rate
+                self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'tokens': round(self._tokens, 2),
+                'capacity': self.capacity,
+                'daily_remaining': int(self._daily_remaining),
+                'daily_limit': self.daily_limit,
+                'daily_reset_in_seconds': round(max(self._daily_reset_at - time.time(), 0.0)),
+                'granted': dict(self.granted),
+                'shed': dict(self.shed),
+                'throttled': self.throttled
+            }
@@ -0,0 +1,610 @@
+import heapq
+import math
+import mmap
+import struct
+import threading
+import zlib
+from array import array
+from typing import Optional, Dict, Any, List, Tuple
+
+from delivery_geo import haversine_km
+
+ROAD_GRAPH_MAGIC = b'TKRG'
+ROAD_GRAPH_VERSION = 2  # 2: KD-tree order stored after the reverse CSR
+_HEADER = struct.Struct('<4sIII')  # magic, version, node count, edge count
+
+HUB_TABLES_MAGIC = b'TKHT'
+HUB_TABLES_VERSION = 2
+# magic, version, hub count, node count, edge count, CRC-32 of the graph file
+_TABLES_HEADER = struct.Struct('<4sIIIII')
+
+
+class KDTree:
+    """2-d tree for nearest-neighbour lookup over (lat, lng) points.
+
+    Points are projected onto a local flat plane (longitude scaled by the
+    cosine of the mean latitude), which ranks neighbours the same way as
+    great-circle distance at city scale. The tree is stored implicitly as a
+    permutation of point indices: each slice's median is its root.
+
+    Pass a previously built ``order`` (e.g. stored in a road graph file) to
+    skip the build; coordinates may then be memory-mapped views.
+    """
+
+    def __init__(self, lats, lngs, order=None):
+        count = len(lats)
+        mean_lat = sum(lats) / count if count else 0.0
+        self._lng_scale = math.cos(math.radians(mean_lat))
+        self._lats = lats
+        self._lngs = lngs
+
+        if order is None:
+            xs = [lng * self._lng_scale for lng in lngs]
+            ys = list(lats)
+            order = list(range(count))
+            self._build(order, xs, ys, 0, count, 0)
+            order = array('i', order)
+        elif len(order) != count:
+            raise ValueError("KD-tree order does not match the points")
+        self.order = order
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def _build(self, order: List[int], xs: List[float], ys: List[float],
+               lo: int, hi: int, depth: int) -> None:
+        if hi - lo <= 1:
+            return
+        coords = xs if depth % 2 == 0 else ys
+        order[lo:hi] = sorted(order[lo:hi], key=coords.__getitem__)
+        mid = (lo + hi) // 2
+        self._build(order, xs, ys, lo, mid, depth + 1)
+        self._build(order, xs, ys, mid + 1, hi, depth + 1)
+
+    def nearest(self, lat: float, lng: float, k: int = 1) -> List[int]:
+        """Return the indices of the k nearest points, closest first"""
+        scale = self._lng_scale
+        qx, qy = lng * scale, lat
+        lngs, lats, order = self._lngs, self._lats, self.order
+        best = []  # max-heap of (-squared distance, index)
+
+        def visit(lo, hi, depth):
+            if lo >= hi:
+                return
+            mid = (lo + hi) // 2
+            point = order[mid]
+            dx, dy = lngs[point] * scale - qx, lats[point] - qy
+            d2 = dx * dx + dy * dy
+            if len(best) < k:
+                heapq.heappush(best, (-d2, point))
+            elif d2 < -best[0][0]:
+                heapq.heapreplace(best, (-d2, point))
+
+            diff = -dx if depth % 2 == 0 else -dy
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            visit(near[0], near[1], depth + 1)
+            # Only cross the split if the other side could hold something closer
+            if len(best) < k or diff * diff < -best[0][0]:
+                visit(far[0], far[1], depth + 1)
+
+        visit(0, len(order), 0)
+        return [point for _, point in sorted(best, reverse=True)]
+
+
+class RoutingBackend:
+    """Answers driving distances from the hubs to a customer.
+
+    ``hub_distances`` returns one distance (km) per hub, ``None`` for a hub
+    it cannot route, or ``None`` overall when the backend cannot answer.
+    """
+
+    name = 'base'
+
+    def hub_distances(self, hubs: List[Dict[str, float]],
+                      lat: float, lng: float) -> Optional[List[Optional[float]]]:
+        raise NotImplementedError
+
+    async def hub_distances_async(self, hubs: List[Dict[str, float]],
+                                  lat: float, lng: float) -> Optional[List[Optional[float]]]:
+        # In-process backends are fast enough to answer inline
+        return self.hub_distances(hubs, lat, lng)
+
+    def hub_distances_many(self, hubs: List[Dict[str, float]],
+                           points: List[Tuple[float, float]]) -> List[Optional[List[Optional[float]]]]:
+        """``hub_distances`` for each point, in order"""
+        return [self.hub_distances(hubs, lat, lng) for lat, lng in points]
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': self.name}
+
+
+class ORSMatrixBackend(RoutingBackend):
+    """OpenRouteService Matrix API, with the service's retry and breaker logic"""
+
+    name = 'ors'
+
+    def __init__(self, service):
+        self.service = service
+
+    def hub_distances(self, hubs, lat, lng):
+        return self.service._call_ors_matrix_with_retry(hubs, lat, lng)
+
+    def hub_distances_many(self, hubs, points):
+        # As many points per matrix request as the ORS limits allow
+        chunk_size = self.service._matrix_chunk_size(len(hubs))
+        results = []
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            columns = self.service._call_ors_matrix_many_with_retry(hubs, chunk)
+            results.extend(columns if columns is not None else [None] * len(chunk))
+        return results
+
+    async def hub_distances_async(self, hubs, lat, lng):
+        return await self.service.async_ors.hub_distances(hubs, lat, lng)
+
+
+class FallbackBackend(RoutingBackend):
+    """Try each backend in order until one answers"""
+
+    def __init__(self, backends: List[RoutingBackend]):
+        self.backends = backends
+        self.name = '+'.join(backend.name for backend in backends)
+        self.answered_by = {backend.name: 0 for backend in backends}
+        self._lock = threading.Lock()
+
+    def _answered(self, name: str) -> None:
+        with self._lock:
+            self.answered_by[name] += 1
+
+    def hub_distances(self, hubs, lat, lng):
+        for backend in self.backends:
+            result = backend.hub_distances(hubs, lat, lng)
+            if result is not None:
+                self._answered(backend.name)
+                return result
+        return None
+
+    async def hub_distances_async(self, hubs, lat, lng):
+        for backend in self.backends:
+            result = await backend.hub_distances_async(hubs, lat, lng)
+            if result is not None:
+                self._answered(backend.name)
+                return result
+        return None
+
+    def hub_distances_many(self, hubs, points):
+        results = [None] * len(points)
+        pending = list(range(len(points)))
+        for backend in self.backends:
+            if not pending:
+                break
+            answers = backend.hub_distances_many(hubs, [points[i] for i in pending])
+            unanswered = []
+            for i, result in zip(pending, answers):
+                if result is None:
+                    unanswered.append(i)
+                else:
+                    results[i] = result
+                    self._answered(backend.name)
+            pending = unanswered
+        return results
+
+    def stats(self):
+        with self._lock:
+            stats = {'backend': self.name, 'answered_by': dict(self.answered_by)}
+        for backend in self.backends:
+            if backend.name != 'ors':
+                stats[backend.name] = backend.stats()
+        return stats
+
+
+class NearestHubPruning(RoutingBackend):
+    """Routes only the hubs that could still be nearest by road.
+
+    Hubs are ranked by straight-line distance, a lower bound on driving
+    distance. The ``candidates`` nearest are routed first; further hubs are
+    routed, ``candidates`` at a time, only while their straight-line
+    distance is shorter than the best driving distance found so far.
+    Skipped hubs are reported as ``None``.
+    """
+
+    def __init__(self, backend: RoutingBackend, candidates: int = 2):
+        self.backend = backend
+        self.name = backend.name
+        self.candidates = max(1, candidates)
+        self.hubs_routed = 0
+        self.hubs_pruned = 0
+        self._index = None  # (hub list, KDTree over it)
+        self._lock = threading.Lock()
+
+    def _next_batch(self, hubs, lat, lng, position, best_km) -> List[int]:
+        """Hub indices ranked ``position`` onwards that could beat ``best_km``"""
+        index = self._index  # read once; another thread may swap it
+        if index is None or index[0] is not hubs:
+            index = self._index = (hubs, KDTree([hub['lat'] for hub in hubs], [hub['lng'] for hub in hubs]))
+        ranked = index[1].nearest(lat, lng, k=position + self.candidates)[position:]
+        return [i for i in ranked if haversine_km(hubs[i]['lat'], hubs[i]['lng'], lat, lng) < best_km]
+
+    def _merge(self, results, batch, distances, best_km) -> float:
+        for hub_index, km in zip(batch, distances):
+            results[hub_index] = km
+            if km is not None and km < best_km:
+                best_km = km
+        return best_km
+
+    def _finish(self, results, routed):
+        if not routed:
+            return None
+        with self._lock:
+            self.hubs_routed += routed
+            self.hubs_pruned += len(results) - routed
+        return results
+
+    def hub_distances(self, hubs, lat, lng):
+        if len(hubs) <= self.candidates:
+            return self.backend.hub_distances(hubs, lat, lng)
+
+        results = [None] * len(hubs)
+        best_km, position, routed = math.inf, 0, 0
+        while position < len(hubs):
+            batch = self._next_batch(hubs, lat, lng, position, best_km)
+            if not batch:
+                break
+            distances = self.backend.hub_distances([hubs[i] for i in batch], lat, lng)
+            if distances is None:
+                break  # Keep whatever earlier batches answered
+            best_km = self._merge(results, batch, distances, best_km)
+            position += self.candidates
+            routed += len(batch)
+        return self._finish(results, routed)
+
+    async def hub_distances_async(self, hubs, lat, lng):
+        if len(hubs) <= self.candidates:
+            return await self.backend.hub_distances_async(hubs, lat, lng)
+
+        results = [None] * len(hubs)
+        best_km, position, routed = math.inf, 0, 0
+        while position < len(hubs):
+            batch = self._next_batch(hubs, lat, lng, position, best_km)
+            if not batch:
+                break
+            distances = await self.backend.hub_distances_async([hubs[i] for i in batch], lat, lng)
+            if distances is None:
+                break
+            best_km = self._merge(results, batch, distances, best_km)
+            position += self.candidates
+            routed += len(batch)
+        return self._finish(results, routed)
+
+    def hub_distances_many(self, hubs, points):
+        # Batches already share one matrix request across all hubs
+        return self.backend.hub_distances_many(hubs, points)
+
+    def stats(self):
+        stats = self.backend.stats()
+        stats['hub_pruning'] = {
+            'candidates': self.candidates,
+            'hubs_routed': self.hubs_routed,
+            'hubs_pruned': self.hubs_pruned
+        }
+        return stats
+
+
+def write_road_graph(path: str, lats: List[float], lngs: List[float],
+                     edges: List[Tuple[int, int, float]]) -> None:
+    """Write a road graph in the memory-mappable format read by RoadGraph.
+
+    ``edges`` are directed ``(from_node, to_node, length_m)`` triples.
+    Forward and reverse adjacency are both stored in CSR form, followed
+    by the nearest-node KD-tree order so workers never rebuild it.
+    """
+    n = len(lats)
+
+    def csr(pairs):
+        pairs = sorted(pairs)
+        offsets = array('i', [0] * (n + 1))
+        targets = array('i')
+        weights = array('f')
+        for source, target, weight in pairs:
+            offsets[source + 1] += 1
+            targets.append(target)
+            weights.append(weight)
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+        return offsets, targets, weights
+
+    forward = csr(edges)
+    reverse = csr([(target, source, weight) for source, target, weight in edges])
+    kd_order = KDTree(lats, lngs).order
+
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(ROAD_GRAPH_MAGIC, ROAD_GRAPH_VERSION, n, len(edges)))
+        for section in (array('d', lats), array('d', lngs)) + forward + reverse + (kd_order,):
+            data = section.tobytes()
+            f.write(data)
+            f.write(b'\0' * (-len(data) % 8))  # keep sections 8-byte aligned
+
+
+class RoadGraph:
+    """Read-only road graph memory-mapped from disk.
+
+    Node coordinates and CSR adjacency arrays are views straight into the
+    mapped file, so loading is cheap and every gunicorn worker shares the
+    same physical pages.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        magic, version, n, m = _HEADER.unpack_from(view, 0)
+        if magic != ROAD_GRAPH_MAGIC:
+            raise ValueError(f"Not a road graph file: {path}")
+        if version != ROAD_GRAPH_VERSION:
+            raise ValueError(f"Road graph format {version} is outdated, rebuild it: {path}")
+        self.node_count = n
+        self.edge_count = m
+
+        offset = _HEADER.size
+
+        def section(fmt, count, itemsize):
+            nonlocal offset
+            size = count * itemsize
+            data = view[offset:offset + size].cast(fmt)
+            offset += size + (-size % 8)
+            return data
+
+        self.lats = section('d', n, 8)
+        self.lngs = section('d', n, 8)
+        self.offsets = section('i', n + 1, 4)
+        self.targets = section('i', m, 4)
+        self.weights = section('f', m, 4)
+        self.reverse_offsets = section('i', n + 1, 4)
+        self.reverse_targets = section('i', m, 4)
+        self.reverse_weights = section('f', m, 4)
+        self.kd_order = section('i', n, 4)
+
+        self.kdtree = KDTree(self.lats, self.lngs, order=self.kd_order)
+        self._checksum = None
+
+    @property
+    def checksum(self) -> int:
+        """CRC-32 of the graph file, identifying the exact graph tables were built over"""
+        if self._checksum is None:
+            self._checksum = zlib.crc32(self._mmap)
+        return self._checksum
+
+    def nearest_node(self, lat: float, lng: float) -> Tuple[Optional[int], float]:
+        """Return ``(node, snap_km)`` for the graph node closest to a point"""
+        nearest = self.kdtree.nearest(lat, lng)
+        if not nearest:
+            return None, float('inf')
+        node = nearest[0]
+        return node, haversine_km(lat, lng, self.lats[node], self.lngs[node])
+
+    def distances_from(self, source: int) -> array:
+        """One-to-all Dijkstra: driving distance (km) from source to every node"""
+        distances = array('f', [float('inf')]) * self.node_count
+        distances[source] = 0.0
+        settled = bytearray(self.node_count)
+        queue = [(0.0, source)]
+        while queue:
+            g_score, node = heapq.heappop(queue)
+            if settled[node]:
+                continue
+            settled[node] = 1
+            for i in range(self.offsets[node], self.offsets[node + 1]):
+                neighbour = self.targets[i]
+                candidate = g_score + self.weights[i] / 1000.0
+                if candidate < distances[neighbour]:
+                    distances[neighbour] = candidate
+                    heapq.heappush(queue, (candidate, neighbour))
+        return distances
+
+    def distances_to(self, target: int, sources: List[int], limit_km: float,
+                     max_settled: Optional[int] = None) -> Optional[List[Optional[float]]]:
+        """Driving distance (km) from each source node to ``target``.
+
+        Runs one A* search backwards from the target over the reverse
+        graph. The heuristic (straight line to the closest source) is
+        consistent, so every settled node has its exact distance and all
+        sources are answered by a single search. Sources farther than
+        ``limit_km`` come back as ``None``. Returns ``None`` overall if the
+        search settles ``max_settled`` nodes with sources still unanswered.
+        """
+        remaining = set(sources)
+        source_coords = [(self.lats[s], self.lngs[s]) for s in remaining]
+        limit_m = limit_km * 1000.0
+
+        def heuristic(node):
+            lat, lng = self.lats[node], self.lngs[node]
+            return min(haversine_km(lat, lng, s_lat, s_lng) for s_lat, s_lng in source_coords) * 1000.0
+
+        best = {target: 0.0}
+        settled = {}
+        queue = [(heuristic(target), 0.0, target)]
+        while queue and remaining:
+            f_score, g_score, node = heapq.heappop(queue)
+            if f_score > limit_m:
+                break
+            if node in settled:
+                continue
+            settled[node] = g_score
+            remaining.discard(node)
+            if max_settled is not None and len(settled) >= max_settled and remaining:
+                return None
+
+            for i in range(self.reverse_offsets[node], self.reverse_offsets[node + 1]):
+                neighbour = self.reverse_targets[i]
+                candidate = g_score + self.reverse_weights[i]
+                if neighbour not in settled and candidate < best.get(neighbour, float('inf')):
+                    best[neighbour] = candidate
+                    heapq.heappush(queue, (candidate + heuristic(neighbour), candidate, neighbour))
+
+        return [settled[s] / 1000.0 if s in settled else None for s in sources]
+
+    def close(self) -> None:
+        for name in ('lats', 'lngs', 'offsets', 'targets', 'weights',
+                     'reverse_offsets', 'reverse_targets', 'reverse_weights', 'kd_order'):
+            getattr(self, name).release()
+        self._mmap.close()
+        self._file.close()
+
+
+class LocalGraphBackend(RoutingBackend):
+    """Routes in-process over a preprocessed road graph; no per-quote HTTP.
+
+    Points farther than ``max_snap_km`` from the graph are left to the next
+    backend. Hubs that cannot reach the customer within ``limit_km`` are
+    reported at ``limit_km``, which prices them as out of range. A search
+    that settles more than ``max_settled`` nodes is abandoned and the quote
+    left to the next backend, so one far point cannot stall a worker.
+    """
+
+    name = 'local_graph'
+
+    def __init__(self, graph: RoadGraph, limit_km: float, max_snap_km: float = 0.5,
+                 max_settled: Optional[int] = None):
+        self.graph = graph
+        self.limit_km = limit_km
+        self.max_snap_km = max_snap_km
+        self.max_settled = max_settled
+        self.searches_abandoned = 0
+        self._hub_nodes = {}
+        self._lock = threading.Lock()
+
+    def _snap_hub(self, hub: Dict[str, float]) -> Tuple[Optional[int], float]:
+        key = (hub['lat'], hub['lng'])
+        if key not in self._hub_nodes:
+            self._hub_nodes[key] = self.graph.nearest_node(hub['lat'], hub['lng'])
+        return self._hub_nodes[key]
+
+    def hub_distances(self, hubs, lat, lng):
+        target, target_snap_km = self.graph.nearest_node(lat, lng)
+        if target is None or target_snap_km > self.max_snap_km:
+            return None
+
+        snapped = [self._snap_hub(hub) for hub in hubs]
+        sources = [node for node, snap_km in snapped if node is not None and snap_km <= self.max_snap_km]
+        if not sources:
+            return None
+
+        distances = self.graph.distances_to(target, sources, self.limit_km, self.max_settled)
+        if distances is None:
+            with self._lock:
+                self.searches_abandoned += 1
+            return None
+        found = dict(zip(sources, distances))
+
+        results = []
+        for node, snap_km in snapped:
+            if node is None or snap_km > self.max_snap_km:
+                results.append(None)
+            elif found.get(node) is None:
+                results.append(self.limit_km)
+            else:
+                results.append(found[node] + snap_km + target_snap_km)
+        return results
+
+    def stats(self):
+        return {'backend': self.name, 'nodes': self.graph.node_count, 'edges': self.graph.edge_count,
+                'path': self.graph.path, 'searches_abandoned': self.searches_abandoned}
+
+
+def write_hub_tables(path: str, graph: RoadGraph, hubs: List[Dict[str, float]]) -> None:
+    """Precompute driving distance from every hub to every graph node.
+
+    Each hub snaps to its nearest node and runs one Dijkstra over the whole
+    graph. Distances (km, including the hub's snap) are stored as one
+    float32 row per hub; unreachable nodes hold infinity.
+    """
+    with open(path, 'wb') as f:
+        f.write(_TABLES_HEADER.pack(HUB_TABLES_MAGIC, HUB_TABLES_VERSION, len(hubs),
+                                    graph.node_count, graph.edge_count, graph.checksum))
+        f.write(array('d', [coord for hub in hubs for coord in (hub['lat'], hub['lng'])]).tobytes())
+        for hub in hubs:
+            node, snap_km = graph.nearest_node(hub['lat'], hub['lng'])
+            row = graph.distances_from(node)
+            for i in range(len(row)):
+                row[i] += snap_km
+            f.write(row.tobytes())
+
+
+class HubDistanceTables:
+    """Memory-mapped per-hub distance rows written by ``write_hub_tables``"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        magic, version, hub_count, node_count, edge_count, checksum = _TABLES_HEADER.unpack_from(view, 0)
+        if magic != HUB_TABLES_MAGIC or version != HUB_TABLES_VERSION:
+            raise ValueError(f"Not a hub tables file: {path}")
+        self.node_count = node_count
+        self.edge_count = edge_count
+        self.graph_checksum = checksum
+
+        offset = _TABLES_HEADER.size
+        coords = view[offset:offset + hub_count * 16].cast('d')
+        self.hubs = [{'lat': coords[2 * i], 'lng': coords[2 * i + 1]} for i in range(hub_count)]
+        coords.release()
+        offset += hub_count * 16
+        self.distances = view[offset:offset + hub_count * node_count * 4].cast('f')
+        self._rows = {(hub['lat'], hub['lng']): i for i, hub in enumerate(self.hubs)}
+
+    def matches(self, hubs: List[Dict[str, float]], graph: RoadGraph) -> bool:
+        """True if the tables were built for these hubs over this graph"""
+        if (self.node_count, self.edge_count) != (graph.node_count, graph.edge_count):
+            return False
+        return self.graph_checksum == graph.checksum and [
+            (hub['lat'], hub['lng']) for hub in self.hubs
+        ] == [(hub['lat'], hub['lng']) for hub in hubs]
+
+    def row(self, hub: Dict[str, float]) -> Optional[int]:
+        """Index of the table row for a hub, or None if it has none"""
+        return self._rows.get((hub['lat'], hub['lng']))
+
+    def distance(self, hub_index: int, node: int) -> Optional[float]:
+        km = self.distances[hub_index * self.node_count + node]
+        return None if math.isinf(km) else km
+
+    def close(self) -> None:
+        self.distances.release()
+        self._mmap.close()
+        self._file.close()
+
+
+class HubTableBackend(RoutingBackend):
+    """Quotes from precomputed hub distance tables: a snap plus an array read.
+
+    Answers for any subset of the hubs the tables were built for; other
+    hubs are left to the next backend.
+    """
+
+    name = 'hub_tables'
+
+    def __init__(self, graph: RoadGraph, tables: HubDistanceTables, max_snap_km: float = 0.5):
+        self.graph = graph
+        self.tables = tables
+        self.max_snap_km = max_snap_km
+
+    def hub_distances(self, hubs, lat, lng):
+        rows = [self.tables.row(hub) for hub in hubs]
+        if None in rows:
+            return None
+        node, snap_km = self.graph.nearest_node(lat, lng)
+        if node is None or snap_km > self.max_snap_km:
+            return None
+
+        results = []
+        for row in rows:
+            km = self.tables.distance(row, node)
+            results.append(None if km is None else km + snap_km)
+        return results
+
+    def stats(self):
+        return {'backend': self.name, 'hubs': len(self.tables.hubs), 'path': self.tables.path}
@@ -1,206 +1,911 @@
+import asyncio
+import contextvars
+import hashlib
+import random
+import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import requests
-from typing import Optional, Dict, Any
+from requests.adapters import HTTPAdapter
+from typing import Optional, Dict, Any, Callable, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
 from flask import current_app
 from config import Config
+from delivery_cache import MemoryDistanceCache, DistanceCache, create_distance_cache, grid_cell_key
+from delivery_fees import FeeSchedules
+from delivery_geo import haversine_km
+from delivery_metrics import DeliveryMetrics
+from delivery_resilience import CircuitBreaker, LatencyWindow, QuotaScheduler, SingleFlight
+from delivery_routing import (
+    RoutingBackend, ORSMatrixBackend, FallbackBackend, LocalGraphBackend, HubTableBackend,
+    NearestHubPruning, RoadGraph, HubDistanceTables
+)
+from delivery_zones import DeliveryZoneIndex
+
+ORS_MATRIX_PATH = "/v2/matrix/driving-car"
+
+# ORS quota priority of the quote being served; checkout quotes run as high
+_ors_priority = contextvars.ContextVar('ors_priority', default=QuotaScheduler.LOW)
+
+
+def _log(level: str, message: str) -> None:
+    """Log through Flask when in an app context, otherwise print"""
+    try:
+        getattr(current_app.logger, level)(message)
+    except RuntimeError:
+        # Outside application context, use print for debugging
+        print(message)
+
+
+class RoutedDistance(NamedTuple):
+    """Driving distance to a customer and the hub it was measured from"""
+    distance_km: float
+    hub_index: Optional[int] = None
+
 
 class DeliveryService:
     """Service for calculating delivery fees using OpenRouteService Matrix API"""
     
     def __init__(self):
         self.api_key = Config.ORS_API_KEY
+        self.ors_base_url = Config.ORS_BASE_URL
+        self.ors_timeout = Config.ORS_TIMEOUT
+        self.http = self._create_http_session()
+        self.max_retries = Config.ORS_MAX_RETRIES
+        self.retry_backoff = Config.ORS_RETRY_BACKOFF_SECONDS
+        self.retry_deadline = Config.ORS_RETRY_DEADLINE_SECONDS
+        self.breaker = CircuitBreaker(
+            failure_threshold=Config.ORS_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=Config.ORS_BREAKER_RESET_SECONDS
+        )
+        self.ors_latency = LatencyWindow()
+        self.quota = QuotaScheduler(
+            per_minute=Config.ORS_QUOTA_PER_MINUTE,
+            per_day=Config.ORS_QUOTA_PER_DAY,
+            reserve=Config.ORS_QUOTA_ORDER_RESERVE,
+            max_wait=Config.ORS_QUOTA_MAX_WAIT_SECONDS
+        )
+        self.hedge_enabled = Config.ORS_HEDGE_ENABLED
+        self.hedge_min_samples = Config.ORS_HEDGE_MIN_SAMPLES
+        self._hedge_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ors-hedge')
+        self.metrics = DeliveryMetrics()
+        self.resilience_stats = {
+            'retries': 0,
+            'hedged_requests': 0,
+            'stale_served': 0,
+            'stale_revalidations': 0
+        }
         self.hubs = Config.DELIVERY_HUBS
-        self.fee_near = Config.DELIVERY_FEE_NEAR
-        self.fee_far = Config.DELIVERY_FEE_FAR
-        self.threshold_near_km = Config.DELIVERY_THRESHOLD_NEAR_KM
-        self.max_km = Config.DELIVERY_MAX_KM
-        self.cache_ttl = 600  # 10 minutes
-        self.cache = {}
+        self.fee_schedules = FeeSchedules.from_config(Config.DELIVERY_FEE_TIERS, Config.DELIVERY_HUB_FEE_TIERS)
+        self.cache_ttl = Config.DELIVERY_CACHE_TTL
+        self.cache = self._create_cache(Config.DELIVERY_CACHE_BACKEND, Config.DELIVERY_CACHE_PATH)
+        self.stale_while_revalidate = Config.DELIVERY_CACHE_STALE_WHILE_REVALIDATE
+        self._refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='distance-refresh')
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        self._inflight = SingleFlight()
+        self._async_ors = None
+        self._async_ors_lock = threading.Lock()
+        self.cache_cell_meters = Config.DELIVERY_CACHE_CELL_METERS
+        self.boundary_guard_km = Config.DELIVERY_CACHE_BOUNDARY_GUARD_KM
+        self.prefilter_enabled = Config.DELIVERY_PREFILTER_ENABLED
+        self.road_circuity = Config.DELIVERY_ROAD_CIRCUITY
+        self.prefilter_stats = {'settled_out_of_range': 0, 'settled_near': 0, 'routed': 0}
+        self._stats_lock = threading.Lock()
+        self.zones = None
+        self.load_zones(Config.DELIVERY_ZONES_PATH)
+        self.router = NearestHubPruning(
+            self._create_router(Config.DELIVERY_ROUTING_BACKEND, Config.ROAD_GRAPH_PATH, Config.HUB_TABLES_PATH),
+            candidates=Config.DELIVERY_HUB_CANDIDATES
+        )
     
-    def _get_cache_key(self, lat: float, lng: float) -> str:
-        """Generate cache key for coordinates"""
-        return f"{round(lat, 5)},{round(lng, 5)}"
+    def _count(self, stats: Dict[str, int], name: str) -> None:
+        """Increment a stats counter; quotes run concurrently under threaded workers"""
+        with self._stats_lock:
+            stats[name] += 1
     
-    def _is_cache_valid(self, timestamp: float) -> bool:
-        """Check if cache entry is still valid"""
-        return time.time() - timestamp < self.cache_ttl
+    @property
+    def hubs(self) -> List[Dict[str, float]]:
+        return self._hubs
     
-    def _call_ors_matrix(self, hub_lat: float, hub_lng: float, 
-                       dest_lat: float, dest_lng: float) -> Optional[float]:
-        """Call OpenRouteService Matrix API to get driving distance"""
-        if not self.api_key:
-            try:
-                current_app.logger.error("OpenRouteService API key not configured")
-            except RuntimeError:
-                print("OpenRouteService API key not configured")
-            return None
+    @hubs.setter
+    def hubs(self, hubs: List[Dict[str, float]]) -> None:
+        # Cache keys embed the fingerprint; hash once per hub change, not per key
+        self._hubs = hubs
+        self._hubs_fingerprint = self._fingerprint_hubs(hubs)
+    
+    @property
+    def max_km(self) -> float:
+        """Farthest driving distance any hub delivers to"""
+        return self.fee_schedules.max_km
+    
+    def load_zones(self, path: str) -> bool:
+        """Load delivery zone polygons from disk; returns True if loaded"""
+        try:
+            self.zones = DeliveryZoneIndex.load(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.zones = None
+            _log('error', f"Delivery zones could not be loaded: {e}")
+        return self.zones is not None
+    
+    def _create_cache(self, backend: str, path: Optional[str]) -> DistanceCache:
+        """Build the distance cache; an unusable cache file falls back to memory"""
+        max_entries = Config.DELIVERY_CACHE_MAX_ENTRIES
+        ttl = Config.DELIVERY_CACHE_HARD_TTL
+        shards = Config.DELIVERY_CACHE_SHARDS
+        try:
+            return create_distance_cache(backend, path=path, max_entries=max_entries, ttl=ttl, shards=shards)
+        except (OSError, sqlite3.Error) as e:
+            _log('error', f"Delivery cache at {path} could not be opened, using memory: {e}")
+            return MemoryDistanceCache(max_entries=max_entries, ttl=ttl, shards=shards)
+    
+    def _create_router(self, backend: str, graph_path: str,
+                       tables_path: Optional[str] = None) -> RoutingBackend:
+        """Build the routing backend; ORS is always the last resort"""
+        ors = ORSMatrixBackend(self)
+        if backend == 'ors':
+            return ors
+        if backend != 'local_graph':
+            raise ValueError(f"Unknown routing backend: {backend}")
+        
+        try:
+            graph = RoadGraph(graph_path)
+        except (OSError, ValueError) as e:
+            _log('error', f"Road graph could not be loaded, routing through ORS: {e}")
+            return ors
+        max_snap_km = Config.ROAD_GRAPH_MAX_SNAP_KM
+        backends = [LocalGraphBackend(graph, limit_km=self.max_km * 2, max_snap_km=max_snap_km,
+                                      max_settled=Config.ROAD_GRAPH_MAX_SETTLED_NODES), ors]
         
-        url = "https://api.openrouteservice.org/v2/matrix/driving-car"
-        headers = {
+        # Precomputed hub tables answer with a single array read when they are current
+        if tables_path:
+            try:
+                tables = HubDistanceTables(tables_path)
+            except (OSError, ValueError) as e:
+                _log('warning', f"Hub distance tables not loaded, searching the graph per quote: {e}")
+            else:
+                if tables.matches(self.hubs, graph):
+                    backends.insert(0, HubTableBackend(graph, tables, max_snap_km=max_snap_km))
+                else:
+                    _log('warning', "Hub distance tables are stale (hubs or graph changed); rebuild them")
+                    tables.close()
+        return FallbackBackend(backends)
+    
+    def _create_http_session(self) -> requests.Session:
+        """Create a keep-alive session so ORS calls reuse TCP+TLS connections"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=Config.ORS_POOL_CONNECTIONS,
+            pool_maxsize=Config.ORS_POOL_MAXSIZE,
+            max_retries=0  # Retries are handled by _call_ors_matrix_with_retry
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
             'Authorization': self.api_key,
             'Content-Type': 'application/json'
+        })
+        return session
+    
+    @property
+    def async_ors(self):
+        """Long-lived async ORS client, started on first use"""
+        if self._async_ors is None:
+            with self._async_ors_lock:
+                if self._async_ors is None:
+                    from delivery_async import AsyncORSClient  # Import here to avoid circular import
+                    self._async_ors = AsyncORSClient(self)
+        return self._async_ors
+    
+    def close(self) -> None:
+        """Stop background workers and close upstream connections"""
+        if self._async_ors is not None:
+            self._async_ors.close()
+        self._hedge_executor.shutdown(wait=False)
+        self._refresh_executor.shutdown(wait=False)
+        self.http.close()
+    
+    @property
+    def matrix_url(self) -> str:
+        return f"{self.ors_base_url.rstrip('/')}{ORS_MATRIX_PATH}"
+    
+    def get_http_pool_stats(self) -> Dict[str, Any]:
+        """Return connection reuse counters for the ORS connection pools"""
+        adapter = self.http.get_adapter(self.matrix_url)
+        pools = adapter.poolmanager.pools
+        connections = 0
+        requests_sent = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+        return {
+            'pools': len(pools),
+            'connections_opened': connections,
+            'requests': requests_sent,
+            'connections_reused': max(requests_sent - connections, 0),
+            'reuse_ratio': round(1 - connections / requests_sent, 4) if requests_sent else 0.0
         }
+    
+    @staticmethod
+    def _fingerprint_hubs(hubs: List[Dict[str, float]]) -> str:
+        """Short hash of the hub list so a shared cache never mixes hub setups"""
+        coords = ";".join(f"{hub['lat']},{hub['lng']}" for hub in hubs)
+        return hashlib.sha1(coords.encode()).hexdigest()[:8]
+    
+    def _get_cache_key(self, lat: float, lng: float) -> str:
+        """Generate cache key for coordinates"""
+        return f"{self._hubs_fingerprint}:{round(lat, 5)},{round(lng, 5)}"
+    
+    def _get_cell_cache_key(self, lat: float, lng: float) -> Optional[str]:
+        """Generate grid cell cache key shared by nearby coordinates"""
+        if not self.cache_cell_meters:
+            return None
+        return f"{self._hubs_fingerprint}:{grid_cell_key(lat, lng, self.cache_cell_meters)}"
+    
+    def _fee_boundaries(self) -> List[float]:
+        """Distances (km) where the delivery fee or range changes"""
+        return self.fee_schedules.boundaries()
+    
+    def _is_near_fee_boundary(self, distance_km: float) -> bool:
+        """Check if a snapped distance is too close to a boundary to trust"""
+        return any(abs(distance_km - boundary) <= self.boundary_guard_km
+                   for boundary in self._fee_boundaries())
+    
+    @staticmethod
+    def _decode_cached(value: Any) -> RoutedDistance:
+        # Entries cached before per-hub pricing hold a bare distance
+        if isinstance(value, (list, tuple)):
+            return RoutedDistance(float(value[0]), value[1])
+        return RoutedDistance(float(value))
+    
+    def _get_cache_entry(self, key: Optional[str]) -> Optional[Tuple[RoutedDistance, bool]]:
+        """Return ``(route, is_fresh)`` for key, if the backend still holds it"""
+        if key is None:
+            return None
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        timestamp, value = entry
+        return self._decode_cached(value), self._is_cache_valid(timestamp)
+    
+    def _fresh_entry(self, cache_key: str) -> Optional[RoutedDistance]:
+        """The point's route if a flight that just finished already stored it"""
+        entry = self._get_cache_entry(cache_key)
+        return entry[0] if entry is not None and entry[1] else None
+    
+    def _get_stale_distance(self, lat: float, lng: float, exact: bool = False) -> Optional[RoutedDistance]:
+        """Fallback while ORS is unavailable: any cached distance for the point.
         
+        Exact quotes only fall back to the point's own entry, never its cell's.
+        """
+        entry = None if exact else self._get_cache_entry(self._get_cell_cache_key(lat, lng))
+        if entry is None or self._is_near_fee_boundary(entry[0].distance_km):
+            entry = self._get_cache_entry(self._get_cache_key(lat, lng))
+        if entry is None:
+            return None
+        self._count(self.resilience_stats, 'stale_served')
+        _log('warning', "Serving stale delivery distance while OpenRouteService is unavailable")
+        return entry[0]
+    
+    def _is_cache_valid(self, timestamp: float) -> bool:
+        """Check if cache entry is still valid"""
+        return time.time() - timestamp < self.cache_ttl
+    
+    def _build_matrix_request(self, hubs: List[Dict[str, float]],
+                              dest_lat: float, dest_lng: float) -> Dict[str, Any]:
+        """Build the ORS matrix payload: every hub a source, the customer the destination"""
+        return self._build_matrix_request_many(hubs, [(dest_lat, dest_lng)])
+    
+    def _build_matrix_request_many(self, hubs: List[Dict[str, float]],
+                                   points: List[Tuple[float, float]]) -> Dict[str, Any]:
+        """Build one ORS matrix payload with every hub a source and every point a destination"""
         # OpenRouteService expects [lng, lat] order
-        payload = {
-            "locations": [
-                [hub_lng, hub_lat],      # Hub location
-                [dest_lng, dest_lat]     # Customer location
-            ],
-            "sources": [0],
-            "destinations": [1],
+        locations = [[hub['lng'], hub['lat']] for hub in hubs]  # Hub locations
+        locations.extend([lng, lat] for lat, lng in points)      # Customer locations
+        return {
+            "locations": locations,
+            "sources": list(range(len(hubs))),
+            "destinations": list(range(len(hubs), len(hubs) + len(points))),
             "metrics": ["distance"]
         }
+    
+    def _parse_matrix_response(self, data: Dict[str, Any],
+                               hub_count: int) -> Optional[List[Optional[float]]]:
+        """Turn an ORS matrix response into one distance (km) per hub"""
+        columns = self._parse_matrix_response_many(data, hub_count, 1)
+        if columns is None:
+            return None
+        if columns[0] is None:
+            _log('error', "Null distance in OpenRouteService response")
+        return columns[0]
+    
+    def _parse_matrix_response_many(self, data: Dict[str, Any], hub_count: int,
+                                    point_count: int) -> Optional[List[Optional[List[Optional[float]]]]]:
+        """Turn an ORS matrix response into per-hub distances (km) for each point.
+        
+        A point no hub could reach gets ``None`` instead of a list.
+        """
+        if 'error' in data:
+            _log('error', f"OpenRouteService API error: {data['error']}")
+            return None
+            
+        distances = data.get('distances', [])
+        if len(distances) != hub_count:
+            _log('error', "No distances in OpenRouteService response")
+            return None
+        
+        # One row per hub, one column per customer
+        columns = []
+        for column in range(point_count):
+            results = []
+            for row in distances:
+                distance_meters = row[column] if len(row) > column else None
+                results.append(distance_meters / 1000.0 if distance_meters is not None else None)
+            columns.append(None if all(distance is None for distance in results) else results)
+        return columns
+    
+    def _matrix_chunk_size(self, hub_count: int) -> int:
+        """Most destinations one matrix request can carry within the ORS limits"""
+        by_locations = Config.ORS_MATRIX_MAX_LOCATIONS - hub_count
+        by_routes = Config.ORS_MATRIX_MAX_ROUTES // max(hub_count, 1)
+        return max(min(by_locations, by_routes), 1)
+    
+    def _call_ors_matrix(self, hubs: List[Dict[str, float]],
+                       dest_lat: float, dest_lng: float,
+                       timeout: Optional[float] = None) -> Optional[List[Optional[float]]]:
+        """Call OpenRouteService Matrix API once for every hub.
+
+        All hubs are sent as ``sources`` and the customer as the single
+        destination, so the returned column holds one driving distance (km)
+        per hub. Unroutable hubs come back as ``None``; a failed request
+        returns ``None`` for the whole call.
+        """
+        data = self._post_matrix(self._build_matrix_request(hubs, dest_lat, dest_lng), timeout)
+        if data is None:
+            return None
+        try:
+            return self._parse_matrix_response(data, len(hubs))
+        except (KeyError, ValueError, TypeError, IndexError) as e:
+            _log('error', f"OpenRouteService API parsing error: {e}")
+            return None
+    
+    def _call_ors_matrix_many(self, hubs: List[Dict[str, float]],
+                              points: List[Tuple[float, float]],
+                              timeout: Optional[float] = None) -> Optional[List[Optional[List[Optional[float]]]]]:
+        """Route many points in one matrix request; None if the request failed"""
+        data = self._post_matrix(self._build_matrix_request_many(hubs, points), timeout)
+        if data is None:
+            return None
+        try:
+            return self._parse_matrix_response_many(data, len(hubs), len(points))
+        except (KeyError, ValueError, TypeError, IndexError) as e:
+            _log('error', f"OpenRouteService API parsing error: {e}")
+            return None
+    
+    def _post_matrix(self, payload: Dict[str, Any],
+                     timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """POST one matrix request, keeping the breaker and latency window up to date"""
+        if not self.api_key:
+            _log('error', "OpenRouteService API key not configured")
+            return None
         
+        self.metrics.increment('ors_calls')
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=7)
+            started = time.monotonic()
+            with self.metrics.timer('ors_call'):
+                response = self.http.post(self.matrix_url, json=payload,
+                                          timeout=timeout or self.ors_timeout)
+            self.quota.update_from_headers(response.headers, response.status_code)
             response.raise_for_status()
+            self.ors_latency.record(time.monotonic() - started)
+            self.breaker.record_success()
             
-            data = response.json()
-            
-            if 'error' in data:
-                try:
-                    current_app.logger.error(f"OpenRouteService API error: {data['error']}")
-                except RuntimeError:
-                    print(f"OpenRouteService API error: {data['error']}")
-                return None
-                
-            distances = data.get('distances', [])
-            if not distances or not distances[0]:
-                try:
-                    current_app.logger.error("No distances in OpenRouteService response")
-                except RuntimeError:
-                    print("No distances in OpenRouteService response")
-                return None
-                
-            distance_meters = distances[0][0]
-            if distance_meters is None:
-                try:
-                    current_app.logger.error("Null distance in OpenRouteService response")
-                except RuntimeError:
-                    print("Null distance in OpenRouteService response")
-                return None
-                
-            return distance_meters / 1000.0  # Convert to kilometers
+            return response.json()
             
         except requests.exceptions.Timeout:
-            try:
-                current_app.logger.error("OpenRouteService API timeout")
-            except RuntimeError:
-                print("OpenRouteService API timeout")
+            self.breaker.record_failure()
+            self.metrics.increment('ors_failures')
+            _log('error', "OpenRouteService API timeout")
+            return None
+        except requests.exceptions.HTTPError as e:
+            # Only server-side trouble and throttling count against ORS health
+            if e.response is not None and (e.response.status_code >= 500 or e.response.status_code == 429):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            self.metrics.increment('ors_failures')
+            _log('error', f"OpenRouteService API request error: {e}")
             return None
         except requests.exceptions.RequestException as e:
-            try:
-                current_app.logger.error(f"OpenRouteService API request error: {e}")
-            except RuntimeError:
-                print(f"OpenRouteService API request error: {e}")
+            self.breaker.record_failure()
+            self.metrics.increment('ors_failures')
+            _log('error', f"OpenRouteService API request error: {e}")
             return None
-        except (KeyError, ValueError, TypeError) as e:
+        except ValueError as e:
+            self.metrics.increment('ors_failures')
+            _log('error', f"OpenRouteService API parsing error: {e}")
+            return None
+    
+    def _lookup_cached_distance(self, lat: float, lng: float, exact: bool = False,
+                                refresh_later: Optional[Dict[str, Tuple[float, float, Optional[str]]]] = None
+                                ) -> Tuple[Optional[RoutedDistance], str, Optional[str]]:
+        """Look up a cached distance for a point.
+        
+        Returns ``(route, cache_key, cell_key)``; route is None on a miss.
+        A fresh entry wins; otherwise a stale entry is returned and refreshed
+        in the background (stale-while-revalidate). Callers passing
+        ``refresh_later`` get the stale point added to it instead, so they
+        can refresh many points together. ``exact`` lookups only accept a
+        fresh entry for the point itself, so anything else is routed.
+        """
+        cell_key = self._get_cell_cache_key(lat, lng)
+        cache_key = self._get_cache_key(lat, lng)
+        if exact:
+            route = self._fresh_entry(cache_key)
+            self.metrics.increment('cache_hits' if route is not None else 'cache_misses')
+            return route, cache_key, cell_key
+        stale_distance = None
+        
+        # Check the grid cell first, then the exact point near fee boundaries
+        for key in (cell_key, cache_key):
+            entry = self._get_cache_entry(key)
+            if entry is None:
+                continue
+            route, fresh = entry
+            if key == cell_key and self._is_near_fee_boundary(route.distance_km):
+                continue
+            if fresh:
+                self.metrics.increment('cache_hits')
+                return route, cache_key, cell_key
+            if stale_distance is None:
+                stale_distance = route
+        
+        if stale_distance is not None and self.stale_while_revalidate:
+            self.metrics.increment('cache_hits')
+            self._count(self.resilience_stats, 'stale_revalidations')
+            if refresh_later is not None:
+                refresh_later[cache_key] = (lat, lng, cell_key)
+            else:
+                self._schedule_refresh(lat, lng, cache_key, cell_key)
+            return stale_distance, cache_key, cell_key
+        
+        self.metrics.increment('cache_misses')
+        return None, cache_key, cell_key
+    
+    def _flight_key(self, cache_key: str) -> str:
+        """Single-flight key; checkout quotes never wait on a call that may be shed"""
+        return f"{_ors_priority.get()}:{cache_key}"
+    
+    def _schedule_refresh(self, lat: float, lng: float, cache_key: str, cell_key: Optional[str]) -> None:
+        """Re-route a point in the background, at most once at a time per key"""
+        with self._refreshing_lock:
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+        
+        def refresh():
             try:
-                current_app.logger.error(f"OpenRouteService API parsing error: {e}")
-            except RuntimeError:
-                print(f"OpenRouteService API parsing error: {e}")
+                self._inflight.do(self._flight_key(cache_key),
+                                  lambda: self._route_and_store(lat, lng, cache_key, cell_key))
+            except Exception as e:
+                _log('error', f"Background distance refresh failed: {e}")
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(cache_key)
+        
+        self._refresh_executor.submit(refresh)
+    
+    def _schedule_refresh_many(self, stale: Dict[str, Tuple[float, float, Optional[str]]]) -> None:
+        """Re-route many stale points in the background with one ``hub_distances_many`` call"""
+        with self._refreshing_lock:
+            keys = [key for key in stale if key not in self._refreshing]
+            self._refreshing.update(keys)
+        if not keys:
+            return
+        
+        def refresh():
+            try:
+                with self.metrics.timer('routing_batch'):
+                    columns = self.router.hub_distances_many(self.hubs, [stale[key][:2] for key in keys])
+                for key, distances in zip(keys, columns):
+                    self._store_hub_distances(distances, key, stale[key][2])
+            except Exception as e:
+                _log('error', f"Background distance refresh failed: {e}")
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.difference_update(keys)
+        
+        self._refresh_executor.submit(refresh)
+    
+    def _store_hub_distances(self, distances: Optional[List[Optional[float]]],
+                             cache_key: str, cell_key: Optional[str]) -> Optional[RoutedDistance]:
+        """Take the nearest hub from the returned column and cache it"""
+        if distances is None:
+            return None
+        
+        reachable = [(distance, hub_index) for hub_index, distance in enumerate(distances) if distance is not None]
+        if not reachable:
             return None
+        route = RoutedDistance(*min(reachable))
+        self.metrics.increment(f'hub_wins.{route.hub_index}')
+        
+        # Cache the result (only share it with the cell when it is safe to)
+        self.cache.set(cache_key, route)
+        if cell_key is not None and not self._is_near_fee_boundary(route.distance_km):
+            self.cache.set(cell_key, route)
+        
+        return route
+    
+    def prime_distance(self, lat: float, lng: float, distance_km: float,
+                       hub_index: Optional[int] = None) -> bool:
+        """Seed the cache with a known distance; returns False if the point is already cached"""
+        cache_key = self._get_cache_key(lat, lng)
+        if self._get_cache_entry(cache_key) is not None:
+            return False
+        
+        route = RoutedDistance(float(distance_km), hub_index)
+        self.cache.set(cache_key, route)
+        cell_key = self._get_cell_cache_key(lat, lng)
+        if cell_key is not None and not self._is_near_fee_boundary(route.distance_km) \
+                and self._get_cache_entry(cell_key) is None:
+            self.cache.set(cell_key, route)
+        return True
+    
+    def _get_distance_from_hubs(self, lat: float, lng: float, exact: bool = False) -> Optional[RoutedDistance]:
+        """Get minimum driving distance from all hubs with a single matrix call"""
+        route, cache_key, cell_key = self._lookup_cached_distance(lat, lng, exact=exact)
+        if route is not None:
+            return route
+        
+        # Concurrent misses for the same point share one upstream call
+        route = self._inflight.do(
+            self._flight_key(cache_key), lambda: self._route_and_store(lat, lng, cache_key, cell_key)
+        )
+        if route is None:
+            route = self._get_stale_distance(lat, lng, exact=exact)
+        return route
+    
+    def _route_and_store(self, lat: float, lng: float,
+                         cache_key: str, cell_key: Optional[str]) -> Optional[RoutedDistance]:
+        """Route a point through the routing backend and cache the nearest-hub distance"""
+        route = self._fresh_entry(cache_key)
+        if route is not None:
+            return route
+        with self.metrics.timer('routing'):
+            distances = self.router.hub_distances(self.hubs, lat, lng)
+        return self._store_hub_distances(distances, cache_key, cell_key)
     
-    def _get_distance_from_hubs(self, lat: float, lng: float) -> Optional[float]:
-        """Get minimum driving distance from all hubs"""
-        min_distance = None
+    def _call_ors_matrix_hedged(self, hubs: List[Dict[str, float]],
+                                dest_lat: float, dest_lng: float,
+                                timeout: float) -> Optional[List[Optional[float]]]:
+        """Call the matrix API, hedging with a second request after the p95 delay"""
+        hedge_delay = self.ors_latency.percentile(95)
+        if not self.hedge_enabled or len(self.ors_latency) < self.hedge_min_samples or hedge_delay is None:
+            return self._call_ors_matrix(hubs, dest_lat, dest_lng, timeout=timeout)
+        
+        primary = self._hedge_executor.submit(self._call_ors_matrix, hubs, dest_lat, dest_lng, timeout)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done or not self.quota.try_acquire(_ors_priority.get()):
+            return primary.result()
+        if not self.breaker.allow_request():
+            self.quota.refund()
+            return primary.result()
         
-        for hub in self.hubs:
-            # Check cache first
-            cache_key = self._get_cache_key(lat, lng)
-            hub_cache_key = self._get_cache_key(hub['lat'], hub['lng'])
-            combined_key = f"{hub_cache_key}-{cache_key}"
+        self._count(self.resilience_stats, 'hedged_requests')
+        hedge = self._hedge_executor.submit(self._call_ors_matrix, hubs, dest_lat, dest_lng,
+                                            max(timeout - hedge_delay, 0.1))
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result is not None:
+                    return result
+        return None
+    
+    def _call_ors_matrix_with_retry(self, hubs: List[Dict[str, float]],
+                                  dest_lat: float, dest_lng: float) -> Optional[List[Optional[float]]]:
+        """Call OpenRouteService Matrix API with retry logic"""
+        return self._with_retry(
+            lambda timeout: self._call_ors_matrix_hedged(hubs, dest_lat, dest_lng, timeout=timeout)
+        )
+    
+    def _call_ors_matrix_many_with_retry(self, hubs: List[Dict[str, float]],
+                                         points: List[Tuple[float, float]]) -> Optional[List[Optional[List[Optional[float]]]]]:
+        """Route many points in one matrix request, with retry logic"""
+        return self._with_retry(lambda timeout: self._call_ors_matrix_many(hubs, points, timeout=timeout))
+    
+    def _with_retry(self, call: Callable[[float], Any]) -> Any:
+        """Run an ORS call until it returns a result.
+        
+        Retries use full-jitter exponential backoff and stop once the
+        deadline budget would be exceeded. Calls are skipped entirely while
+        the circuit breaker is open, and shed when the ORS quota has no
+        token for the current priority.
+        """
+        deadline = time.monotonic() + self.retry_deadline
+        attempt = 0
+        while True:
+            priority = _ors_priority.get()
+            if not self.quota.acquire(priority):
+                self.metrics.increment(f'ors_shed.{priority}')
+                _log('warning', f"OpenRouteService quota exhausted; shedding {priority}-priority call")
+                return None
+            if not self.breaker.allow_request():
+                self.quota.refund()
+                _log('warning', "OpenRouteService circuit open; skipping call")
+                return None
             
-            if combined_key in self.cache:
-                timestamp, distance = self.cache[combined_key]
-                if self._is_cache_valid(timestamp):
-                    if min_distance is None or distance < min_distance:
-                        min_distance = distance
-                    continue
+            remaining = deadline - time.monotonic()
+            result = call(min(self.ors_timeout, remaining))
+            if result is not None:
+                return result
             
-            # Call API with retry
-            distance = self._call_ors_matrix_with_retry(hub['lat'], hub['lng'], lat, lng)
+            attempt += 1
+            if attempt > self.max_retries:
+                return None
             
-            if distance is not None:
-                # Cache the result
-                self.cache[combined_key] = (time.time(), distance)
-                
-                if min_distance is None or distance < min_distance:
-                    min_distance = distance
-        
-        return min_distance
+            backoff = random.uniform(0, self.retry_backoff * (2 ** attempt))
+            # Leave room for at least one more reasonable attempt
+            if time.monotonic() + backoff + 1.0 >= deadline:
+                return None
+            
+            self._count(self.resilience_stats, 'retries')
+            _log('info', "Retrying OpenRouteService API call")
+            time.sleep(backoff)
     
-    def _call_ors_matrix_with_retry(self, hub_lat: float, hub_lng: float, 
-                                  dest_lat: float, dest_lng: float) -> Optional[float]:
-        """Call OpenRouteService Matrix API with retry logic"""
-        # First attempt
-        result = self._call_ors_matrix(hub_lat, hub_lng, dest_lat, dest_lng)
-        if result is not None:
-            return result
+    def _prefilter(self, lat: float, lng: float, exact: bool = False) -> Optional[Dict[str, Any]]:
+        """Settle clear-cut quotes from straight-line distance alone.
         
-        # Retry once
-        try:
-            current_app.logger.info("Retrying OpenRouteService API call")
-        except RuntimeError:
-            print("Retrying OpenRouteService API call")
+        Returns a quote when the point is certainly out of range, or (unless
+        ``exact`` is requested) certainly inside the near tier; otherwise
+        None so the caller routes it.
+        """
+        if not self.prefilter_enabled:
+            return None
         
-        return self._call_ors_matrix(hub_lat, hub_lng, dest_lat, dest_lng)
-    
-    def _apply_delivery_rules(self, distance_km: float) -> Dict[str, Any]:
-        """Apply delivery pricing rules based on distance"""
-        if distance_km > self.max_km:
+        straight_km = min(haversine_km(hub['lat'], hub['lng'], lat, lng) for hub in self.hubs)
+        
+        # Road distance is at least the straight-line distance
+        if straight_km > self.max_km:
+            self._count(self.prefilter_stats, 'settled_out_of_range')
             return {
+                'ok': True,
+                'out_of_range': True,
                 'delivery_fee': 0,
-                'out_of_range': True
+                'distance_km': round(straight_km, 2),
+                'estimated': True
             }
-        elif distance_km <= self.threshold_near_km:
+        
+        # Even a winding road stays inside the first tier every hub charges
+        estimated_km = straight_km * self.road_circuity
+        first_tier = self.fee_schedules.common_first_tier()
+        if not exact and first_tier is not None and estimated_km <= first_tier[0]:
+            self._count(self.prefilter_stats, 'settled_near')
+            pricing = self._apply_delivery_rules(estimated_km)
             return {
-                'delivery_fee': self.fee_near,
-                'out_of_range': False
+                'ok': True,
+                'out_of_range': pricing['out_of_range'],
+                'delivery_fee': pricing['delivery_fee'],
+                'distance_km': round(estimated_km, 2),
+                'estimated': True
             }
-        else:
+        
+        self._count(self.prefilter_stats, 'routed')
+        return None
+    
+    def _zone_quote(self, lat: float, lng: float, exact: bool = False) -> Optional[Dict[str, Any]]:
+        """Answer fee tier and range from the precomputed zone polygons.
+        
+        The reported distance is a straight-line estimate clamped to the
+        matched zone. With ``exact`` only out-of-range is answered here;
+        in-range points still need a routed distance.
+        """
+        if self.zones is None:
+            return None
+        
+        straight_km = min(haversine_km(hub['lat'], hub['lng'], lat, lng) for hub in self.hubs)
+        estimated_km = straight_km * self.road_circuity
+        zone = self.zones.lookup(lat, lng)
+        
+        if zone is None:
+            # Outside every zone only means out of range if zones reach max_km
+            if self.zones.max_range_km < self.max_km:
+                return None
             return {
-                'delivery_fee': self.fee_far,
-                'out_of_range': False
+                'ok': True,
+                'out_of_range': True,
+                'delivery_fee': 0,
+                'distance_km': round(max(estimated_km, self.max_km), 2),
+                'estimated': True
             }
+        
+        if exact:
+            return None
+        
+        # The zone's outer edge prices the tier; the estimate stays inside it
+        lower_km = max([r for r in self.zones.ranges_km if r < zone.range_km], default=0.0)
+        estimated_km = min(max(estimated_km, lower_km), zone.range_km)
+        pricing = self._apply_delivery_rules(zone.range_km, zone.hub_index)
+        return {
+            'ok': True,
+            'out_of_range': pricing['out_of_range'],
+            'delivery_fee': pricing['delivery_fee'],
+            'distance_km': round(estimated_km, 2),
+            'estimated': True
+        }
     
-    def quote_delivery(self, lat: float, lng: float) -> Dict[str, Any]:
-        """Get delivery quote for given coordinates"""
+    def _apply_delivery_rules(self, distance_km: float, hub_index: Optional[int] = None) -> Dict[str, Any]:
+        """Apply delivery pricing rules based on distance and the serving hub"""
+        return self.fee_schedules.for_hub(hub_index).price(distance_km)
+    
+    def price_distances(self, distances_km: Sequence[float], hub_index: Optional[int] = None):
+        """Price many distances at once for bulk re-pricing and analytics
+        
+        Returns ``(fees, out_of_range)``; NumPy arrays when NumPy is installed.
+        """
+        return self.fee_schedules.for_hub(hub_index).price_many(distances_km)
+    
+    def _settle_locally(self, lat: float, lng: float, exact: bool = False) -> Optional[Dict[str, Any]]:
+        """Settle obvious cases without calling OpenRouteService"""
+        settled = self._prefilter(lat, lng, exact=exact)
+        if settled is None:
+            settled = self._zone_quote(lat, lng, exact=exact)
+        return settled
+    
+    def _quote_from_route(self, route: Optional[RoutedDistance]) -> Dict[str, Any]:
+        """Build the quote response for a routed distance"""
+        if route is None:
+            _log('error', "Unable to calculate distance")
+            return {'ok': False, 'error': 'Unable to calculate distance'}
+        
+        # Apply delivery rules
+        pricing = self._apply_delivery_rules(route.distance_km, route.hub_index)
+        
+        return {
+            'ok': True,
+            'out_of_range': pricing['out_of_range'],
+            'delivery_fee': pricing['delivery_fee'],
+            'distance_km': round(route.distance_km, 2)
+        }
+    
+    def quote_delivery(self, lat: float, lng: float, exact: bool = False) -> Dict[str, Any]:
+        """Get delivery quote for given coordinates
+        
+        Pass ``exact=True`` when the driving distance will be persisted
+        (e.g. on an Order) so in-range points are always routed.
+        """
+        # Checkout quotes (exact) are timed separately from browsing quotes
+        # and may use the ORS quota held back for placing orders
+        priority = _ors_priority.set(QuotaScheduler.HIGH if exact else QuotaScheduler.LOW)
+        try:
+            with self.metrics.timer('quote_exact' if exact else 'quote'):
+                return self._quote_delivery(lat, lng, exact)
+        finally:
+            _ors_priority.reset(priority)
+    
+    def _quote_delivery(self, lat: float, lng: float, exact: bool) -> Dict[str, Any]:
         # Validate coordinates
         if not self._validate_coordinates(lat, lng):
             return {'ok': False, 'error': 'Invalid coordinates'}
+        lat, lng = float(lat), float(lng)
         
         try:
-            # Get distance from nearest hub
-            distance_km = self._get_distance_from_hubs(lat, lng)
+            settled = self._settle_locally(lat, lng, exact=exact)
+            if settled is not None:
+                return settled
             
-            if distance_km is None:
-                try:
-                    current_app.logger.error("Unable to calculate distance")
-                except RuntimeError:
-                    print("Unable to calculate distance")
-                return {'ok': False, 'error': 'Unable to calculate distance'}
+            # Get distance from nearest hub
+            route = self._get_distance_from_hubs(lat, lng, exact=exact)
+            return self._quote_from_route(route)
             
-            # Apply delivery rules
-            pricing = self._apply_delivery_rules(distance_km)
+        except Exception as e:
+            # Handle logging outside of Flask context
+            _log('error', f"Delivery calculation error: {e}")
+            return {'ok': False, 'error': f'Delivery calculation failed: {str(e)}'}
+    
+    async def quote_delivery_async(self, lat: float, lng: float, exact: bool = False) -> Dict[str, Any]:
+        """Async variant of quote_delivery that awaits the routing backend"""
+        priority = _ors_priority.set(QuotaScheduler.HIGH if exact else QuotaScheduler.LOW)
+        try:
+            with self.metrics.timer('quote_async'):
+                return await self._quote_delivery_async(lat, lng, exact)
+        finally:
+            _ors_priority.reset(priority)
+    
+    async def _quote_delivery_async(self, lat: float, lng: float, exact: bool) -> Dict[str, Any]:
+        if not self._validate_coordinates(lat, lng):
+            return {'ok': False, 'error': 'Invalid coordinates'}
+        lat, lng = float(lat), float(lng)
+        
+        try:
+            settled = self._settle_locally(lat, lng, exact=exact)
+            if settled is not None:
+                return settled
             
-            return {
-                'ok': True,
-                'out_of_range': pricing['out_of_range'],
-                'delivery_fee': pricing['delivery_fee'],
-                'distance_km': round(distance_km, 2)
-            }
+            route, cache_key, cell_key = self._lookup_cached_distance(lat, lng, exact=exact)
+            if route is None:
+                flight_key = self._flight_key(cache_key)
+                future, is_leader = self._inflight.begin(flight_key)
+                if not is_leader:
+                    # Another request is already routing this point
+                    route = await asyncio.wrap_future(future)
+                else:
+                    try:
+                        route = self._fresh_entry(cache_key)
+                        if route is None:
+                            with self.metrics.timer('routing'):
+                                distances = await self.router.hub_distances_async(self.hubs, lat, lng)
+                            route = self._store_hub_distances(distances, cache_key, cell_key)
+                    except Exception as e:
+                        self._inflight.finish(flight_key, future, error=e)
+                        raise
+                    self._inflight.finish(flight_key, future, result=route)
+            if route is None:
+                route = self._get_stale_distance(lat, lng, exact=exact)
+            return self._quote_from_route(route)
             
         except Exception as e:
-            # Handle logging outside of Flask context
-            try:
-                current_app.logger.error(f"Delivery calculation error: {e}")
-            except RuntimeError:
-                # Outside application context, use print for debugging
-                print(f"Delivery calculation error: {e}")
+            _log('error', f"Delivery calculation error: {e}")
             return {'ok': False, 'error': f'Delivery calculation failed: {str(e)}'}
     
+    def quote_delivery_batch(self, points: Iterable[Tuple[Any, Any]],
+                             exact: bool = False) -> Iterator[Dict[str, Any]]:
+        """Quote many coordinates, yielding each result as soon as it is known
+        
+        Every result carries the ``index`` of its input point. Invalid,
+        locally settled and cached points come first; identical points are
+        routed once, and the remaining misses go upstream in as few matrix
+        requests as the ORS limits allow. Stale hits are served at once and
+        refreshed together in the background.
+        """
+        misses = {}  # cache key -> (lat, lng, cell key, input indices)
+        stale = {}  # cache key -> (lat, lng, cell key), refreshed together at the end
+        for index, (lat, lng) in enumerate(points):
+            if not self._validate_coordinates(lat, lng):
+                yield {'index': index, 'ok': False, 'error': 'Invalid coordinates'}
+                continue
+            lat, lng = float(lat), float(lng)
+            
+            settled = self._settle_locally(lat, lng, exact=exact)
+            if settled is not None:
+                yield dict(settled, index=index)
+                continue
+            
+            route, cache_key, cell_key = self._lookup_cached_distance(lat, lng, exact=exact, refresh_later=stale)
+            if route is not None:
+                yield dict(self._quote_from_route(route), index=index)
+                continue
+            misses.setdefault(cache_key, (lat, lng, cell_key, []))[3].append(index)
+        
+        keys = list(misses)
+        chunk_size = self._matrix_chunk_size(len(self.hubs))
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            try:
+                with self.metrics.timer('routing_batch'):
+                    columns = self.router.hub_distances_many(
+                        self.hubs, [(misses[key][0], misses[key][1]) for key in chunk]
+                    )
+            except Exception as e:
+                _log('error', f"Batch delivery calculation error: {e}")
+                columns = [None] * len(chunk)
+            
+            for key, distances in zip(chunk, columns):
+                lat, lng, cell_key, indices = misses[key]
+                route = self._store_hub_distances(distances, key, cell_key)
+                if route is None:
+                    route = self._get_stale_distance(lat, lng, exact=exact)
+                quote = self._quote_from_route(route)
+                for index in indices:
+                    yield dict(quote, index=index)
+        
+        if stale:
+            self._schedule_refresh_many(stale)
+    
     def _validate_coordinates(self, lat: float, lng: float) -> bool:
         """Validate latitude and longitude ranges"""
         if lat is None or lng is None:
@@ -213,10 +918,57 @@ class DeliveryService:
             return False
         
         return (-90 <= lat_float <= 90) and (-180 <= lng_float <= 180)
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Return distance cache counters for monitoring"""
+        return self.cache.stats()
+    
+    def get_breaker_state(self) -> Dict[str, Any]:
+        """Return circuit breaker state and retry/hedge counters for monitoring"""
+        state = self.breaker.snapshot()
+        state.update(self.resilience_stats)
+        state['ors_latency_p95'] = self.ors_latency.percentile(95)
+        state['single_flight'] = self._inflight.snapshot()
+        return state
+    
+    def get_prefilter_stats(self) -> Dict[str, Any]:
+        """Return how many quotes the straight-line pre-filter settled"""
+        stats = dict(self.prefilter_stats)
+        stats['upstream_calls_avoided'] = stats['settled_out_of_range'] + stats['settled_near']
+        return stats
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return latency histograms (p50/p95/p99), upstream call counts and hub wins"""
+        metrics = self.metrics.snapshot()
+        counters = metrics['counters']
+        metrics['ors'] = {
+            'calls': counters.get('ors_calls', 0),
+            'failures': counters.get('ors_failures', 0),
+            'retries': self.resilience_stats['retries'],
+            'hedged_requests': self.resilience_stats['hedged_requests'],
+            'quota': self.quota.snapshot()
+        }
+        # Once per quote; the backend's own counters also see the cell and re-check lookups
+        lookups = counters.get('cache_hits', 0) + counters.get('cache_misses', 0)
+        metrics['cache_hit_ratio'] = round(counters.get('cache_hits', 0) / lookups, 4) if lookups else 0.0
+        metrics['hub_wins'] = [counters.get(f'hub_wins.{index}', 0) for index in range(len(self.hubs))]
+        return metrics
+    
+    def get_routing_stats(self) -> Dict[str, Any]:
+        """Return which routing backend is active and how often each answered"""
+        return self.router.stats()
 
 # Global instance
 delivery_service = DeliveryService()
 
-def quote_delivery(lat: float, lng: float) -> Dict[str, Any]:
+def quote_delivery(lat: float, lng: float, exact: bool = False) -> Dict[str, Any]:
     """Convenience function to get delivery quote"""
-    return delivery_service.quote_delivery(lat, lng)
+    return delivery_service.quote_delivery(lat, lng, exact=exact)
+
+async def quote_delivery_async(lat: float, lng: float, exact: bool = False) -> Dict[str, Any]:
+    """Convenience coroutine to get delivery quote without blocking on ORS"""
+    return await delivery_service.quote_delivery_async(lat, lng, exact=exact)
+
+def quote_delivery_batch(points: Iterable[Tuple[Any, Any]], exact: bool = False) -> Iterator[Dict[str, Any]]:
+    """Convenience generator to quote many coordinates at once"""
+    return delivery_service.quote_delivery_batch(points, exact=exact)
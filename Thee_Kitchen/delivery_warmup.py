@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Warm the delivery distance cache from historical orders
+
+Repeat customers are served from the cache instead of OpenRouteService
+right after a deploy. Runs automatically at startup when
+DELIVERY_CACHE_WARM_ON_STARTUP is enabled, or by hand:
+    python delivery_warmup.py
+    python delivery_warmup.py --days 30 --limit 500
+
+By hand it only helps with the shared sqlite cache; a memory cache would be
+warmed in this process and thrown away when it exits.
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Tuple
+
+from sqlalchemy import func
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from delivery_cache import SQLiteDistanceCache
+from delivery_geo import haversine_km
+from extensions import db
+from models import Order
+
+
+def frequent_order_locations(days: int, limit: int) -> List[Tuple[float, float, float, int]]:
+    """Return ``(lat, lng, distance_km, order_count)`` for recent order locations, most frequent first"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    order_count = func.count(Order.id)
+    rows = (
+        db.session.query(Order.customer_lat, Order.customer_lng, func.max(Order.distance_km), order_count)
+        .filter(Order.created_at >= cutoff)
+        .group_by(Order.customer_lat, Order.customer_lng)
+        .order_by(order_count.desc())
+        .limit(limit)
+        .all()
+    )
+    return [(lat, lng, float(distance_km), count) for lat, lng, distance_km, count in rows]
+
+
+def warm_delivery_cache(service, days: int = Config.DELIVERY_CACHE_WARM_DAYS,
+                        limit: int = Config.DELIVERY_CACHE_WARM_LIMIT) -> Dict[str, Any]:
+    """Load historical order distances into the service's distance cache.
+
+    Needs an application context. Points already cached are left alone.
+    Orders do not record which hub served them, so the straight-line
+    nearest hub is assumed for per-hub pricing.
+    """
+    limit = min(limit, service.cache.max_entries or limit)
+    locations = frequent_order_locations(days, limit)
+
+    # Insert least frequent first so the busiest addresses end up most
+    # recently used and are the last to be evicted
+    primed = 0
+    for lat, lng, distance_km, _ in reversed(locations):
+        hub_index = min(range(len(service.hubs)),
+                        key=lambda i: haversine_km(service.hubs[i]['lat'], service.hubs[i]['lng'], lat, lng))
+        if service.prime_distance(lat, lng, distance_km, hub_index):
+            primed += 1
+
+    return {'locations': len(locations), 'primed': primed, 'already_cached': len(locations) - primed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm the delivery distance cache from historical orders")
+    parser.add_argument('--days', type=int, default=Config.DELIVERY_CACHE_WARM_DAYS)
+    parser.add_argument('--limit', type=int, default=Config.DELIVERY_CACHE_WARM_LIMIT)
+    args = parser.parse_args(argv)
+
+    # Importing the app would run its own startup warm-up first; this run replaces it
+    Config.DELIVERY_CACHE_WARM_ON_STARTUP = False
+    # Import here to avoid circular import
+    from app import app
+    from delivery_service import delivery_service
+
+    if not isinstance(delivery_service.cache, SQLiteDistanceCache):
+        print(f"❌ The delivery cache is not shared (DELIVERY_CACHE_BACKEND={Config.DELIVERY_CACHE_BACKEND}); "
+              f"warming it here would be lost on exit. Use the sqlite backend or warm on startup.")
+        return 1
+
+    with app.app_context():
+        result = warm_delivery_cache(delivery_service, days=args.days, limit=args.limit)
+
+    print(f"🔥 Warmed delivery cache: {result['primed']} new, "
+          f"{result['already_cached']} already cached, from {result['locations']} order locations")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
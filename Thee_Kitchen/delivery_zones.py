@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Delivery zone polygons (driving isochrones) for O(1) fee tier lookup
+
+Build or refresh the zones file from OpenRouteService:
+    python delivery_zones.py build
+    python delivery_zones.py build --output /data/delivery_zones.geojson
+
+Check which tier a point falls in:
+    python delivery_zones.py check 30.0444 31.2357
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+from typing import Optional, Dict, Any, List, Tuple
+
+import requests
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from delivery_fees import FeeSchedules
+
+ISOCHRONES_PATH = "/v2/isochrones/driving-car"
+
+# Size (degrees) of the buckets used to index zone bounding boxes
+INDEX_CELL_DEGREES = 0.05
+
+
+def point_in_ring(lat: float, lng: float, ring: List[List[float]]) -> bool:
+    """Ray casting test against one GeoJSON ring of [lng, lat] pairs"""
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > lat) != (yj > lat):
+            x_cross = (xj - xi) * (lat - yi) / (yj - yi) + xi
+            if lng < x_cross:
+                inside = not inside
+        j = i
+    return inside
+
+
+def point_in_polygon(lat: float, lng: float, rings: List[List[List[float]]]) -> bool:
+    """Test a GeoJSON Polygon (outer ring followed by holes)"""
+    if not rings or not point_in_ring(lat, lng, rings[0]):
+        return False
+    return not any(point_in_ring(lat, lng, hole) for hole in rings[1:])
+
+
+class DeliveryZone:
+    """One isochrone polygon: everything within range_km driving of a hub"""
+
+    def __init__(self, hub_index: int, range_km: float, polygons: List[List[List[List[float]]]]):
+        self.hub_index = hub_index
+        self.range_km = range_km
+        self.polygons = polygons
+
+        points = [point for polygon in polygons for point in polygon[0]]
+        self.min_lng = min(point[0] for point in points)
+        self.max_lng = max(point[0] for point in points)
+        self.min_lat = min(point[1] for point in points)
+        self.max_lat = max(point[1] for point in points)
+
+    def contains(self, lat: float, lng: float) -> bool:
+        if not (self.min_lat <= lat <= self.max_lat and self.min_lng <= lng <= self.max_lng):
+            return False
+        return any(point_in_polygon(lat, lng, polygon) for polygon in self.polygons)
+
+
+class DeliveryZoneIndex:
+    """Spatial index over delivery zones.
+
+    Zone bounding boxes are bucketed into a coarse lat/lng grid, so a lookup
+    only runs point-in-polygon tests for the few zones overlapping the
+    point's bucket.
+    """
+
+    def __init__(self, zones: List[DeliveryZone]):
+        self.zones = sorted(zones, key=lambda zone: zone.range_km)
+        self.ranges_km = sorted({zone.range_km for zone in self.zones})
+        self._buckets = {}
+        for zone in self.zones:
+            for bucket in self._buckets_for_bbox(zone):
+                self._buckets.setdefault(bucket, []).append(zone)
+
+    @staticmethod
+    def _bucket(lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / INDEX_CELL_DEGREES), math.floor(lng / INDEX_CELL_DEGREES)
+
+    def _buckets_for_bbox(self, zone: DeliveryZone):
+        min_row, min_col = self._bucket(zone.min_lat, zone.min_lng)
+        max_row, max_col = self._bucket(zone.max_lat, zone.max_lng)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                yield row, col
+
+    @property
+    def max_range_km(self) -> float:
+        return self.ranges_km[-1] if self.ranges_km else 0.0
+
+    def lookup(self, lat: float, lng: float) -> Optional[DeliveryZone]:
+        """Return the tightest zone containing the point, or None if outside all"""
+        # Zones are kept sorted by range, so the first match is the tightest
+        for zone in self._buckets.get(self._bucket(lat, lng), []):
+            if zone.contains(lat, lng):
+                return zone
+        return None
+
+    @classmethod
+    def from_geojson(cls, data: Dict[str, Any]) -> 'DeliveryZoneIndex':
+        zones = []
+        for feature in data.get('features', []):
+            geometry = feature['geometry']
+            if geometry['type'] == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry['type'] == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+            properties = feature['properties']
+            zones.append(DeliveryZone(properties['hub_index'], float(properties['range_km']), polygons))
+        return cls(zones)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['DeliveryZoneIndex']:
+        """Load zones from a GeoJSON file; None when the file does not exist"""
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return cls.from_geojson(json.load(f))
+
+
+def build_zones(hubs: List[Dict[str, float]], ranges_km: List[float],
+                api_key: str) -> Dict[str, Any]:
+    """Fetch driving-distance isochrones for every hub from OpenRouteService"""
+    headers = {
+        'Authorization': api_key,
+        'Content-Type': 'application/json'
+    }
+    payload = {
+        # OpenRouteService expects [lng, lat] order
+        "locations": [[hub['lng'], hub['lat']] for hub in hubs],
+        "range": [int(range_km * 1000) for range_km in ranges_km],
+        "range_type": "distance"
+    }
+
+    url = f"{Config.ORS_BASE_URL.rstrip('/')}{ISOCHRONES_PATH}"
+    response = requests.post(url, json=payload, headers=headers, timeout=60)
+    response.raise_for_status()
+    data = response.json()
+
+    features = []
+    for feature in data.get('features', []):
+        properties = feature.get('properties', {})
+        features.append({
+            'type': 'Feature',
+            'geometry': feature['geometry'],
+            'properties': {
+                'hub_index': properties['group_index'],
+                'range_km': properties['value'] / 1000.0
+            }
+        })
+
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query delivery zone polygons")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Fetch isochrones from OpenRouteService")
+    build_parser.add_argument('--output', default=Config.DELIVERY_ZONES_PATH)
+
+    check_parser = subparsers.add_parser('check', help="Show the zone containing a point")
+    check_parser.add_argument('lat', type=float)
+    check_parser.add_argument('lng', type=float)
+    check_parser.add_argument('--zones', default=Config.DELIVERY_ZONES_PATH)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        ranges_km = FeeSchedules.from_config(Config.DELIVERY_FEE_TIERS, Config.DELIVERY_HUB_FEE_TIERS).boundaries()
+        print(f"🗺️ Building delivery zones for {len(Config.DELIVERY_HUBS)} hubs at {ranges_km} km")
+        zones = build_zones(Config.DELIVERY_HUBS, ranges_km, Config.ORS_API_KEY)
+
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{args.output}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(zones, f)
+        os.replace(tmp_path, args.output)
+
+        print(f"✅ Wrote {len(zones['features'])} zones to {args.output}")
+        print("Restart the app to load the new zones.")
+        return 0
+
+    index = DeliveryZoneIndex.load(args.zones)
+    if index is None:
+        print(f"❌ Zones file not found: {args.zones}")
+        return 1
+    zone = index.lookup(args.lat, args.lng)
+    if zone is None:
+        print(f"📍 {args.lat}, {args.lng} is outside every zone (out of range)")
+    else:
+        print(f"📍 {args.lat}, {args.lng} is within {zone.range_km} km of hub {zone.hub_index}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
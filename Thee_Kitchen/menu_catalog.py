@@ -0,0 +1,146 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, List
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from config import Config
+from extensions import db
+from models import MenuItem, MenuCatalogVersion
+
+
+@dataclass(frozen=True)
+class CatalogItem:
+    """Read-only copy of a menu item, safe to share between requests and threads"""
+    id: int
+    name_ar: str
+    name_en: str
+    description_ar: str
+    description_en: str
+    price: float
+    is_available: bool
+    image_urls: str
+    category: str
+
+    # Same display helpers as the model, so templates treat both alike
+    get_name = MenuItem.get_name
+    get_description = MenuItem.get_description
+    get_display_image = MenuItem.get_display_image
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Every menu item at one catalog version, indexed by id and category"""
+    version: Optional[int]
+    by_id: Dict[int, CatalogItem]
+    available: List[CatalogItem]
+    by_category: Dict[str, List[CatalogItem]]
+
+    def get_available(self, item_id: int) -> Optional[CatalogItem]:
+        item = self.by_id.get(item_id)
+        return item if item is not None and item.is_available else None
+
+
+class MenuCatalog:
+    """Process-local menu snapshot that is reloaded only when the menu changes.
+
+    Committing a change to a ``MenuItem`` drops this process's snapshot and
+    bumps the shared version row, which other workers compare against at
+    most once per ``check_interval`` seconds. Between checks, menu reads and
+    cart validation run no queries.
+    """
+
+    def __init__(self, check_interval: float = 30):
+        self.check_interval = check_interval
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._next_check = 0.0
+        self._lock = threading.RLock()
+
+    def snapshot(self) -> CatalogSnapshot:
+        """Current snapshot; needs an application context when a reload is due"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._next_check:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            now = time.monotonic()
+            if snapshot is not None and now < self._next_check:
+                return snapshot
+            version = read_catalog_version()
+            if snapshot is None or snapshot.version != version:
+                snapshot = self._snapshot = self._load(version)
+            self._next_check = now + self.check_interval
+            return snapshot
+
+    def get_available(self, item_id: int) -> Optional[CatalogItem]:
+        return self.snapshot().get_available(item_id)
+
+    def invalidate(self):
+        """Reload on next read (waits for a reload already in progress)"""
+        with self._lock:
+            self._snapshot = None
+
+    @staticmethod
+    def _load(version: Optional[int]) -> CatalogSnapshot:
+        columns = [getattr(MenuItem, field) for field in CatalogItem.__dataclass_fields__]
+        rows = db.session.execute(select(*columns).order_by(MenuItem.id)).all()
+
+        by_id = {}
+        available = []
+        by_category = {}
+        for row in rows:
+            item = CatalogItem(**dict(row._mapping, is_available=bool(row.is_available),
+                                      image_urls=row.image_urls or ''))
+            by_id[item.id] = item
+            if item.is_available:
+                available.append(item)
+                by_category.setdefault(item.category, []).append(item)
+        return CatalogSnapshot(version, by_id, available, by_category)
+
+
+def read_catalog_version() -> Optional[int]:
+    """Shared menu version, or None before the menu has ever changed"""
+    return db.session.execute(
+        select(MenuCatalogVersion.version).where(MenuCatalogVersion.id == 1)
+    ).scalar()
+
+
+def mark_menu_changed(session):
+    """Bump the shared menu version inside the session's transaction.
+
+    This process's snapshot is dropped once the session commits. Flushes of
+    ``MenuItem`` objects call this automatically; bulk statements such as
+    ``query.delete()`` or ``insert()`` skip the flush and must call it.
+    """
+    table = MenuCatalogVersion.__table__
+    connection = session.connection()
+    result = connection.execute(
+        table.update().where(table.c.id == 1).values(version=table.c.version + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(id=1, version=1))
+    session.info['menu_catalog_changed'] = True
+
+
+menu_catalog = MenuCatalog(check_interval=Config.MENU_CATALOG_CHECK_SECONDS)
+
+
+@event.listens_for(Session, 'after_flush')
+def _menu_items_flushed(session, flush_context):
+    changed = session.new | session.dirty | session.deleted
+    if any(isinstance(obj, MenuItem) for obj in changed):
+        mark_menu_changed(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _menu_items_committed(session):
+    if session.info.pop('menu_catalog_changed', False):
+        menu_catalog.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _menu_items_rolled_back(session):
+    session.info.pop('menu_catalog_changed', None)
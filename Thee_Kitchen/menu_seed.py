@@ -0,0 +1,92 @@
+"""
+Menu bootstrapping shared by app startup, seed_menu.py and add_sample_data.py
+
+Seeding is idempotent: without ``replace`` nothing is written once the menu
+has any items, so every worker can run it at startup.
+"""
+
+from typing import Dict, Any, List
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from menu_catalog import mark_menu_changed
+from models import MenuItem
+
+SAMPLE_MENU_ITEMS = [
+    {
+        "name_ar": "كبسة الدجاج",
+        "name_en": "Chicken Kabsa",
+        "description_ar": "طبق تقليدي شهير من الدجاج مع الأرز البسمتي والتوابل العربية",
+        "description_en": "Traditional famous dish of chicken with basmati rice and Arabic spices",
+        "price": 120.0,
+        "category": "main"
+    },
+    {
+        "name_ar": "مندي لحم",
+        "name_en": "Mandi Lamb",
+        "description_ar": "لحم ضأن مطهو ببطء على الفحم مع أرز معطر",
+        "description_en": "Slow-cooked lamb on charcoal with fragrant rice",
+        "price": 150.0,
+        "category": "main"
+    },
+    {
+        "name_ar": "سمبوسك خضار",
+        "name_en": "Vegetable Samosa",
+        "description_ar": "معجنات مقرمشة محشوة بالخضار المتبلة",
+        "description_en": "Crispy pastries filled with seasoned vegetables",
+        "price": 25.0,
+        "category": "side"
+    },
+    {
+        "name_ar": "سلطة عربية",
+        "name_en": "Arabic Salad",
+        "description_ar": "سلطة طازجة بالخضار الموسمية وتوابل السماق",
+        "description_en": "Fresh salad with seasonal vegetables and sumac spices",
+        "price": 30.0,
+        "category": "side"
+    },
+    {
+        "name_ar": "أم علي",
+        "name_en": "Um Ali",
+        "description_ar": "حلوى مصرية تقليدية بالكريم والتمر والمكسرات",
+        "description_en": "Traditional Egyptian dessert with cream, dates and nuts",
+        "price": 35.0,
+        "category": "dessert"
+    },
+    {
+        "name_ar": "كنافة بالجبن",
+        "name_en": "Kunafa with Cheese",
+        "description_ar": "كنافة مقرمشة بالجبن والشرق الحلو",
+        "description_en": "Crispy kunafa with cheese and sweet syrup",
+        "price": 40.0,
+        "category": "dessert"
+    }
+]
+
+
+def seed_menu_items(items: List[Dict[str, Any]], replace: bool = False) -> int:
+    """Bulk insert ``items`` into an empty menu; returns how many were added.
+
+    With ``replace`` the existing menu is deleted first. Needs an
+    application context. The menu version row is bumped before the
+    emptiness check, so concurrent workers seeding at startup wait for
+    each other and only the first one inserts.
+    """
+    try:
+        mark_menu_changed(db.session)
+        if replace:
+            MenuItem.query.delete()
+        elif db.session.query(MenuItem.id).limit(1).first() is not None:
+            db.session.rollback()
+            return 0
+
+        if items:
+            db.session.execute(insert(MenuItem), items)
+        db.session.commit()
+        return len(items)
+    except IntegrityError:
+        # Another worker created the version row first and is seeding
+        db.session.rollback()
+        return 0
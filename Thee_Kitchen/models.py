@@ -100,3 +100,24 @@ class OrderItem(db.Model):
     
     def __repr__(self):
         return f'<OrderItem {self.item_name}>'
+
+
+class StoredCart(db.Model):
+    __tablename__ = 'carts'
+    
+    id = db.Column(db.String(32), primary_key=True)  # Random id kept in the session cookie
+    items = db.Column(db.Text, nullable=False)  # JSON list of cart lines
+    expires_at = db.Column(db.Float, nullable=False, index=True)  # Unix time
+    
+    def __repr__(self):
+        return f'<StoredCart {self.id}>'
+
+
+class MenuCatalogVersion(db.Model):
+    __tablename__ = 'menu_catalog_version'
+    
+    id = db.Column(db.Integer, primary_key=True)  # Single row, id 1
+    version = db.Column(db.Integer, nullable=False, default=0)  # Bumped on every menu change
+    
+    def __repr__(self):
+        return f'<MenuCatalogVersion {self.version}>'
@@ -1,14 +1,16 @@
+import os
+
+# The menu is replaced below; skip the sample menu at app startup
+os.environ.setdefault('MENU_SEED_ON_STARTUP', 'false')
+
 from app import app
 from extensions import db
+from menu_seed import seed_menu_items
 from models import MenuItem
 
 def seed_menu():
-    """Seed the database with menu items"""
+    """Replace the menu with the full menu items"""
     with app.app_context():
-        # Clear existing menu items
-        MenuItem.query.delete()
-        db.session.commit()
-        
         menu_items = [
             # Main Dishes - الطواجن كلها و الفراخ و الملوخيه و البانيه
             {
@@ -237,13 +239,9 @@ def seed_menu():
             }
         ]
         
-        # Add all menu items
-        for item_data in menu_items:
-            item = MenuItem(**item_data)
-            db.session.add(item)
-        
-        db.session.commit()
-        print(f"✅ Successfully seeded {len(menu_items)} menu items!")
+        # Clear existing menu items and bulk insert the new ones
+        seeded = seed_menu_items(menu_items, replace=True)
+        print(f"✅ Successfully seeded {seeded} menu items!")
         
         # Show items by category
         categories = db.session.query(MenuItem.category).distinct().all()
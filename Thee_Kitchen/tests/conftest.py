@@ -19,8 +19,12 @@ os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
 
 # Import correctly - avoid shadowing fixture names
 from app import app as flask_app
+from delivery_cache import MemoryDistanceCache
+from delivery_service import DeliveryService
 from extensions import db
 from models import User, MenuItem, Order, OrderItem
+from menu_catalog import menu_catalog
+from sqlalchemy import event
 
 
 @pytest.fixture
@@ -37,6 +41,7 @@ def app():
     
     with flask_app.app_context():
         db.create_all()
+        menu_catalog.invalidate()  # the snapshot outlives each test's database
         yield flask_app
         db.session.remove()
         db.drop_all()
@@ -112,6 +117,20 @@ def sample_cart_items():
     ]
 
 
+@pytest.fixture
+def menu_queries(app):
+    """SELECT statements run against menu_items during the test"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'menu_items' in statement:
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
 @pytest.fixture
 def sample_menu_items(app):
     """Create sample menu items for testing"""
@@ -142,6 +161,31 @@ def sample_menu_items(app):
         return items
 
 
+@pytest.fixture
+def make_service():
+    """Factory for delivery services that are closed when the test ends"""
+    services = []
+
+    def make():
+        service = DeliveryService()
+        services.append(service)
+        return service
+
+    yield make
+    for service in services:
+        service.close()
+
+
+@pytest.fixture
+def service(make_service):
+    """Create a delivery service with a private cache and no local settlement"""
+    service = make_service()
+    service.cache = MemoryDistanceCache()
+    service.prefilter_enabled = False
+    service.zones = None
+    return service
+
+
 def login_user(client, user, app=None):
     """Helper to login a user"""
     if isinstance(user, int):
@@ -171,6 +215,11 @@ def login_user(client, user, app=None):
 
 
 def set_cart_in_session(client, cart_items):
-    """Helper to set cart in session"""
+    """Helper to store a cart server-side and point the session at it"""
+    from app import cart_store
+    from cart_store import Cart
+    cart_id = cart_store.new_id()
+    with client.application.app_context():
+        cart_store.save(cart_id, Cart.from_data(cart_items).to_data())
     with client.session_transaction() as sess:
-        sess['cart'] = cart_items
+        sess['cart_id'] = cart_id
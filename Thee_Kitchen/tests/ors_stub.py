@@ -0,0 +1,109 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from delivery_geo import haversine_km
+
+
+class ORSStubServer:
+    """Local stand-in for the OpenRouteService Matrix API.
+
+    Answers ``/v2/matrix/driving-car`` with straight-line distance times
+    ``circuity`` for every source/destination pair. Latency and failures can
+    be injected, and HTTP/1.1 keep-alive is supported so tests can check
+    connection reuse. Use as a context manager; ``base_url`` points at it.
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0,
+                 circuity: float = 1.3, distances_km=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.circuity = circuity
+        self.distances_km = distances_km  # Optional fixed distance per source
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; with Nagle on, every
+            # keep-alive response would wait ~40 ms for the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                with stub._lock:
+                    stub.requests += 1
+
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if stub.failure_rate and random.random() < stub.failure_rate:
+                    self._send(503, {'error': 'Service unavailable'})
+                    return
+
+                if self.path.endswith('/matrix/driving-car'):
+                    self._send(200, stub._matrix(payload))
+                else:
+                    self._send(404, {'error': 'Not found'})
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def _matrix(self, payload):
+        locations = payload['locations']
+        rows = []
+        for source in payload['sources']:
+            row = []
+            for destination in payload['destinations']:
+                if self.distances_km is not None:
+                    row.append(self.distances_km[source] * 1000.0)
+                    continue
+                (src_lng, src_lat), (dst_lng, dst_lat) = locations[source], locations[destination]
+                row.append(haversine_km(src_lat, src_lng, dst_lat, dst_lng) * self.circuity * 1000.0)
+            rows.append(row)
+        return {'distances': rows}
+
+    def start(self) -> 'ORSStubServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'ORSStubServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,225 @@
+import time
+import pytest
+from unittest.mock import patch
+from cart_store import Cart, MemoryCartStore, DatabaseCartStore, create_cart_store
+from extensions import db
+from models import MenuItem, StoredCart
+
+
+@pytest.fixture(params=['memory', 'database'])
+def store(request, app):
+    """Each cart store backend with a one-hour TTL"""
+    return create_cart_store(request.param, ttl=3600)
+
+
+@pytest.fixture
+def item_id(app, sample_menu_items):
+    """Id of an available sample menu item"""
+    return MenuItem.query.order_by(MenuItem.id).first().id
+
+
+class TestCart:
+    """Test the id-keyed cart and its running totals"""
+
+    def test_running_totals(self, sample_cart_items):
+        """Test count and subtotal follow adds, changes and removals"""
+        cart = Cart.from_data(sample_cart_items)
+        assert (cart.count, cart.subtotal) == (3, 250.0)
+
+        cart.add(1, 'Test Item 1', 100.0, 1)
+        cart.change(2, 2)
+        assert (cart.count, cart.subtotal) == (6, 450.0)
+        assert cart.get(1)['quantity'] == 3
+
+        cart.remove(1)
+        assert (cart.count, cart.subtotal) == (3, 150.0)
+
+    def test_change_to_zero_removes_line(self):
+        """Test a line is dropped once its quantity reaches zero"""
+        cart = Cart()
+        cart.add(7, 'Koshary', 45.5, 2)
+
+        cart.change(7, -5)
+        cart.change(99, 1)  # not in the cart
+
+        assert len(cart) == 0
+        assert (cart.count, cart.subtotal) == (0, 0.0)
+
+    def test_subtotal_does_not_drift(self):
+        """Test many small float updates still give the exact subtotal"""
+        cart = Cart()
+        for _ in range(10):
+            cart.add(1, 'Tea', 0.1)
+
+        assert cart.subtotal == 1.0
+
+    def test_compact_round_trip(self, sample_cart_items):
+        """Test carts serialize to rows and load back identical"""
+        data = Cart.from_data(sample_cart_items).to_data()
+
+        assert data == [[1, 'Test Item 1', 100.0, 2], [2, 'Test Item 2', 50.0, 1]]
+        assert Cart.from_data(data).lines() == sample_cart_items
+
+
+class TestCartStore:
+    """Test the server-side cart backends"""
+
+    def test_round_trip(self, store):
+        """Test a saved cart reads back unchanged and can be deleted"""
+        cart_id = store.new_id()
+        items = [{'id': 1, 'name': 'Test Item 1', 'price': 100.0, 'quantity': 2}]
+
+        store.save(cart_id, items)
+        assert store.get(cart_id) == items
+
+        store.delete(cart_id)
+        assert store.get(cart_id) is None
+
+    def test_cart_expires(self, store):
+        """Test a cart untouched for longer than the TTL is gone"""
+        cart_id = store.new_id()
+        with patch('cart_store.time.time', return_value=time.time() - 7200):
+            store.save(cart_id, [{'id': 1, 'quantity': 1}])
+
+        assert store.get(cart_id) is None
+
+    def test_purge_expired(self, store):
+        """Test only expired carts are purged"""
+        store.save('fresh', [])
+        with patch('cart_store.time.time', return_value=time.time() - 7200):
+            store.save('old', [])
+
+        assert store.purge_expired() == 1
+        assert store.get('fresh') == []
+
+    def test_reads_do_not_share_state(self):
+        """Test mutating a loaded cart does not change the stored one"""
+        store = MemoryCartStore(ttl=3600)
+        store.save('abc', [{'id': 1, 'quantity': 1}])
+
+        store.get('abc')[0]['quantity'] = 5
+
+        assert store.get('abc')[0]['quantity'] == 1
+
+    def test_database_carts_are_shared(self, app):
+        """Test a cart saved by one worker's store is read by another's"""
+        DatabaseCartStore(ttl=3600).save('shared', [{'id': 1, 'quantity': 3}])
+
+        assert DatabaseCartStore(ttl=3600).get('shared') == [{'id': 1, 'quantity': 3}]
+        assert db.session.get(StoredCart, 'shared') is not None
+
+    def test_unknown_backend(self):
+        """Test misconfigured backends fail loudly"""
+        with pytest.raises(ValueError):
+            create_cart_store('redis')
+
+
+class TestCartRoutes:
+    """Test the cart routes keep only a cart id in the session"""
+
+    def test_session_holds_only_cart_id(self, client, item_id):
+        """Test adding items stores them server-side, not in the cookie"""
+        response = client.post('/add_to_cart', json={'item_id': item_id, 'quantity': 2})
+        assert response.get_json()['cart_count'] == 2
+
+        with client.session_transaction() as sess:
+            assert 'cart' not in sess
+            assert len(sess['cart_id']) <= 32
+
+        cart = client.get('/get_cart').get_json()
+        assert cart['cart_count'] == 2
+        assert cart['cart'][0]['id'] == item_id
+
+    def test_update_and_remove(self, client, item_id):
+        """Test quantity changes and removals persist between requests"""
+        client.post('/add_to_cart', json={'item_id': item_id, 'quantity': 1})
+
+        assert client.post('/update_cart', json={'item_id': item_id, 'change': 2}).get_json()['cart_count'] == 3
+        assert client.get('/get_cart').get_json()['cart_count'] == 3
+
+        assert client.post('/remove_from_cart', json={'item_id': item_id}).get_json()['cart_count'] == 0
+        assert client.get('/get_cart').get_json()['cart'] == []
+
+    def test_string_item_id(self, client, item_id):
+        """Test ids sent as strings update the same line"""
+        client.post('/add_to_cart', json={'item_id': str(item_id)})
+        client.post('/add_to_cart', json={'item_id': item_id})
+
+        response = client.post('/update_cart', json={'item_id': str(item_id), 'change': 1}).get_json()
+
+        assert len(response['cart']) == 1
+        assert response['cart_count'] == 3
+
+    def test_clear_cart(self, client, item_id):
+        """Test clearing the cart forgets the cart id"""
+        client.post('/add_to_cart', json={'item_id': item_id})
+
+        client.get('/clear_cart')
+
+        with client.session_transaction() as sess:
+            assert 'cart_id' not in sess
+        assert client.get('/get_cart').get_json()['cart_count'] == 0
+
+
+
+@pytest.fixture
+def item_ids(app, sample_menu_items):
+    """Ids of both sample menu items"""
+    return [item.id for item in MenuItem.query.order_by(MenuItem.id)]
+
+
+class TestBatchCartRoute:
+    """Test applying several cart operations in one request"""
+
+    def test_operations_apply_in_order(self, client, item_ids):
+        """Test adds, changes and removals land in one round trip"""
+        first, second = item_ids
+        response = client.post('/update_cart_batch', json={'operations': [
+            {'op': 'add', 'item_id': first, 'quantity': 2},
+            {'op': 'add', 'item_id': str(second)},
+            {'op': 'change', 'item_id': first, 'change': 3},
+            {'op': 'remove', 'item_id': second},
+        ]}).get_json()
+
+        assert response['success'] is True
+        assert response['cart_count'] == 5
+        assert [line['id'] for line in response['cart']] == [first]
+        assert client.get('/get_cart').get_json()['cart_count'] == 5
+
+    def test_items_validated_without_queries(self, client, item_ids, menu_queries):
+        """Test added items are checked against the cached catalog, not the database"""
+        client.get('/menu')  # load the catalog
+        operations = [{'op': 'add', 'item_id': item_id} for item_id in item_ids * 5]
+
+        response = client.post('/update_cart_batch', json={'operations': operations}).get_json()
+
+        assert response['cart_count'] == 10
+        assert len(menu_queries) == 1  # the catalog load only
+
+    def test_invalid_item_leaves_cart_unchanged(self, client, item_ids):
+        """Test one unknown item rejects the whole batch"""
+        client.post('/update_cart_batch', json={'operations': [{'op': 'add', 'item_id': item_ids[0]}]})
+
+        response = client.post('/update_cart_batch', json={'operations': [
+            {'op': 'clear'},
+            {'op': 'add', 'item_id': item_ids[1]},
+            {'op': 'add', 'item_id': 9999},
+        ]}).get_json()
+
+        assert response['success'] is False
+        assert response['item_ids'] == [9999]
+        assert client.get('/get_cart').get_json()['cart_count'] == 1
+
+    @pytest.mark.parametrize('operations', [
+        [],
+        [{'op': 'explode', 'item_id': 1}],
+        [{'op': 'add', 'item_id': 'abc'}],
+        [{'op': 'add', 'item_id': 1, 'quantity': 0}],
+        [{'op': 'change', 'item_id': 1, 'change': -1}] * 101,
+    ])
+    def test_malformed_batches_rejected(self, client, operations):
+        """Test bad operation lists are refused before touching the cart"""
+        response = client.post('/update_cart_batch', json={'operations': operations}).get_json()
+
+        assert response['success'] is False
+        assert response['message']
@@ -168,7 +168,8 @@ class TestOrderPlacement:
             
             # Cart should be empty after successful order
             with logged_in_client.session_transaction() as sess:
-                assert 'cart' not in sess or sess.get('cart') == []
+                assert 'cart_id' not in sess
+            assert logged_in_client.get('/get_cart').get_json()['cart'] == []
 
     def test_place_order_requires_login(self, client):
         """Test order placement requires login"""
@@ -0,0 +1,409 @@
+import random
+import sys
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from config import Config
+from delivery_cache import MemoryDistanceCache, SQLiteDistanceCache, create_distance_cache, grid_cell_key
+from delivery_resilience import SingleFlight
+from delivery_routing import FallbackBackend, RoutingBackend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache(request, tmp_path):
+    """Create each cache backend with a small capacity"""
+    return create_distance_cache(
+        request.param,
+        path=str(tmp_path / 'delivery_cache.sqlite3'),
+        max_entries=3,
+        ttl=600
+    )
+
+
+class TestCacheBackends:
+    """Test LRU and TTL behaviour shared by every cache backend"""
+
+    def test_get_returns_stored_value(self, cache):
+        """Test a stored value is returned with its timestamp"""
+        cache.set('a', 12.5)
+
+        stored_at, value = cache.get('a')
+
+        assert value == 12.5
+        assert stored_at > 0
+        assert cache.get('missing') is None
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_lru_eviction(self, cache):
+        """Test the least recently used entry is evicted at capacity"""
+        with patch('delivery_cache.time.time', return_value=1000.0):
+            cache.set('a', 1.0)
+            cache.set('b', 2.0)
+            cache.set('c', 3.0)
+        # Past the SQLite touch interval, so the read refreshes recency on every backend
+        with patch('delivery_cache.time.time', return_value=1000.0 + 120):
+            cache.get('a')  # 'b' becomes least recently used
+            cache.set('d', 4.0)
+
+            assert len(cache) == 3
+            assert cache.get('b') is None
+            assert cache.get('a') is not None
+        assert cache.stats()['evictions'] == 1
+
+    def test_ttl_expiry(self, cache):
+        """Test entries older than the TTL are dropped on read"""
+        with patch('delivery_cache.time.time', return_value=1000.0):
+            cache.set('a', 1.0)
+
+        with patch('delivery_cache.time.time', return_value=1000.0 + 601):
+            assert cache.get('a') is None
+
+        assert len(cache) == 0
+        assert cache.stats()['evictions'] == 1
+
+
+class TestSQLiteCacheWrites:
+    """Test the SQLite backend keeps reads and writes to one statement"""
+
+    @pytest.fixture
+    def sqlite_cache(self, tmp_path):
+        return SQLiteDistanceCache(str(tmp_path / 'cache.sqlite3'), max_entries=20)
+
+    def test_hit_within_touch_interval_does_not_write(self, sqlite_cache):
+        """Test recency is only refreshed once it is older than the touch interval"""
+        def accessed_at():
+            return sqlite_cache._connect().execute(
+                "SELECT accessed_at FROM distance_cache WHERE key = 'a'").fetchone()[0]
+
+        with patch('delivery_cache.time.time', return_value=1000.0):
+            sqlite_cache.set('a', 1.0)
+        with patch('delivery_cache.time.time', return_value=1030.0):
+            assert sqlite_cache.get('a')[1] == 1.0
+        assert accessed_at() == 1000.0
+
+        with patch('delivery_cache.time.time', return_value=1000.0 + SQLiteDistanceCache.TOUCH_INTERVAL):
+            sqlite_cache.get('a')
+        assert accessed_at() == 1000.0 + SQLiteDistanceCache.TOUCH_INTERVAL
+
+    def test_writes_below_capacity_do_not_count_rows(self, sqlite_cache):
+        """Test the running count spares a COUNT(*) on every write"""
+        with patch.object(SQLiteDistanceCache, '__len__', autospec=True, return_value=0) as mock_len:
+            for i in range(20):
+                sqlite_cache.set(f'k{i}', float(i))
+        assert mock_len.call_count == 0
+
+    def test_eviction_frees_a_batch(self, sqlite_cache):
+        """Test crossing capacity evicts the oldest tenth at once"""
+        for i in range(20):
+            with patch('delivery_cache.time.time', return_value=1000.0 + i):
+                sqlite_cache.set(f'k{i}', float(i))
+        with patch('delivery_cache.time.time', return_value=1100.0):
+            sqlite_cache.set('k20', 20.0)
+
+            assert len(sqlite_cache) == 18
+            assert sqlite_cache.stats()['evictions'] == 3
+            assert sqlite_cache.get('k2') is None
+            assert sqlite_cache.get('k3') is not None
+
+    def test_replacing_keys_does_not_evict(self, sqlite_cache):
+        """Test rewriting existing keys is corrected by the re-count, not evicted"""
+        for _ in range(3):
+            for i in range(15):
+                sqlite_cache.set(f'k{i}', float(i))
+
+        assert len(sqlite_cache) == 15
+        assert sqlite_cache.stats()['evictions'] == 0
+
+
+class TestSharedCache:
+    """Test the SQLite backend is shared between cache instances"""
+
+    def test_entries_visible_across_instances(self, tmp_path):
+        """Test two workers pointing at one file share entries"""
+        path = str(tmp_path / 'shared.sqlite3')
+        worker_a = SQLiteDistanceCache(path)
+        worker_b = SQLiteDistanceCache(path)
+
+        worker_a.set('key', 33.3)
+
+        assert worker_b.get('key')[1] == 33.3
+
+    def test_unusable_cache_path_falls_back_to_memory(self, tmp_path, monkeypatch, make_service):
+        """Test a cache file that cannot be created does not stop the service starting"""
+        blocker = tmp_path / 'data'
+        blocker.write_text('not a directory')
+        monkeypatch.setattr(Config, 'DELIVERY_CACHE_BACKEND', 'sqlite')
+        monkeypatch.setattr(Config, 'DELIVERY_CACHE_PATH', str(blocker / 'delivery_cache.sqlite3'))
+
+        service = make_service()
+
+        assert isinstance(service.cache, MemoryDistanceCache)
+        assert service.cache.ttl == Config.DELIVERY_CACHE_HARD_TTL
+
+    def test_service_uses_cache_backend(self, make_service):
+        """Test repeated quotes are served from the cache"""
+        service = make_service()
+        service.cache = MemoryDistanceCache()
+
+        with patch.object(service, '_call_ors_matrix', return_value=[15.0, 30.0]) as mock_matrix:
+            first = service.quote_delivery(30.05, 31.05)
+            second = service.quote_delivery(30.05, 31.05)
+
+        assert mock_matrix.call_count == 1
+        assert first == second
+        assert service.get_cache_stats()['hits'] == 1
+
+
+class TestGridCellKeys:
+    """Test spatial snapping of cache keys"""
+
+    def test_nearby_points_share_cell(self):
+        """Test points a few metres apart map to the same ~100 m cell"""
+        key1 = grid_cell_key(30.05001, 31.05001, 100)
+        key2 = grid_cell_key(30.05021, 31.05031, 100)
+        key3 = grid_cell_key(30.06000, 31.05000, 100)
+
+        assert key1 == key2
+        assert key3 != key1
+
+    def test_neighbour_reuses_cached_distance(self, make_service):
+        """Test a second customer in the same cell does not call ORS"""
+        service = make_service()
+        service.cache = MemoryDistanceCache()
+
+        with patch.object(service, '_call_ors_matrix', return_value=[15.0, 30.0]) as mock_matrix:
+            service.quote_delivery(30.05001, 31.05001)
+            result = service.quote_delivery(30.05021, 31.05031)
+
+        assert mock_matrix.call_count == 1
+        assert result['distance_km'] == 15.0
+
+    def test_boundary_distance_uses_exact_lookup(self, make_service):
+        """Test distances near the 25 km boundary are not shared by the cell"""
+        service = make_service()
+        service.cache = MemoryDistanceCache()
+
+        with patch.object(service, '_call_ors_matrix', return_value=[24.8, 40.0]) as mock_matrix:
+            service.quote_delivery(30.05001, 31.05001)
+            service.quote_delivery(30.05021, 31.05031)
+            service.quote_delivery(30.05001, 31.05001)
+
+        # The neighbour routes on its own; the exact repeat is still cached
+        assert mock_matrix.call_count == 2
+
+    def test_exact_quote_ignores_neighbour_cell(self, service):
+        """Test a checkout quote next to a cached cell is routed for its own point"""
+        with patch.object(service, '_call_ors_matrix', side_effect=[[15.0, 30.0], [15.4, 30.0]]) as mock_matrix:
+            service.quote_delivery(30.05001, 31.05001)
+            result = service.quote_delivery(30.05021, 31.05031, exact=True)
+
+        assert mock_matrix.call_count == 2
+        assert result['distance_km'] == 15.4
+
+    def test_exact_quote_routes_stale_entry(self, service):
+        """Test a checkout quote never takes a stale distance while ORS answers"""
+        service.cache = MemoryDistanceCache(ttl=Config.DELIVERY_CACHE_HARD_TTL)
+        with patch('delivery_cache.time.time', return_value=time.time() - 3600):
+            service.cache.set(service._get_cache_key(30.05, 31.05), 33.0)
+
+        with patch.object(service, '_call_ors_matrix', return_value=[31.0, 45.0]) as mock_matrix:
+            result = service.quote_delivery(30.05, 31.05, exact=True)
+
+        assert mock_matrix.call_count == 1
+        assert result['distance_km'] == 31.0
+
+
+class TestStaleWhileRevalidate:
+    """Test expired entries are served immediately and refreshed in the background"""
+
+    def _service_with_stale_entry(self, make_service, age_seconds):
+        service = make_service()
+        service.cache = MemoryDistanceCache(ttl=service.cache.ttl)
+        service.prefilter_enabled = False
+        with patch('delivery_cache.time.time', return_value=time.time() - age_seconds):
+            service.cache.set(service._get_cache_key(30.05, 31.05), 33.0)
+        return service
+
+    def test_stale_entry_served_and_refreshed(self, make_service):
+        """Test a stale hit returns at once and the refresh repopulates the cache"""
+        service = self._service_with_stale_entry(make_service, age_seconds=3600)
+
+        with patch.object(service, '_call_ors_matrix', return_value=[31.0, 45.0]) as mock_matrix:
+            result = service.quote_delivery(30.05, 31.05)
+            assert result['distance_km'] == 33.0
+
+            service._refresh_executor.shutdown(wait=True)
+
+        assert mock_matrix.call_count == 1
+        route, fresh = service._get_cache_entry(service._get_cache_key(30.05, 31.05))
+        assert route.distance_km == 31.0
+        assert route.hub_index == 0
+        assert fresh is True
+
+    def test_batch_refreshes_stale_points_together(self, make_service):
+        """Test stale hits in a batch are refreshed with one many-point routing call"""
+        service = self._service_with_stale_entry(make_service, age_seconds=3600)
+        service.zones = None
+        points = [(30.05, 31.05), (30.25, 31.25), (30.45, 31.45)]
+        with patch('delivery_cache.time.time', return_value=time.time() - 3600):
+            for lat, lng in points[1:]:
+                service.cache.set(service._get_cache_key(lat, lng), 33.0)
+
+        with patch.object(service.router, 'hub_distances_many',
+                          return_value=[[31.0, 45.0]] * len(points)) as mock_many, \
+                patch.object(service.router, 'hub_distances') as mock_single:
+            results = list(service.quote_delivery_batch(points))
+            service._refresh_executor.shutdown(wait=True)
+
+        assert [result['distance_km'] for result in results] == [33.0, 33.0, 33.0]
+        assert mock_many.call_count == 1
+        assert len(mock_many.call_args.args[1]) == len(points)
+        assert mock_single.call_count == 0
+        route, fresh = service._get_cache_entry(service._get_cache_key(30.45, 31.45))
+        assert (route.distance_km, fresh) == (31.0, True)
+
+    def test_entry_past_hard_ttl_is_dropped(self, make_service):
+        """Test entries older than the hard TTL are routed synchronously"""
+        service = self._service_with_stale_entry(make_service, age_seconds=Config.DELIVERY_CACHE_HARD_TTL + 1)
+
+        with patch.object(service, '_call_ors_matrix', return_value=[31.0, 45.0]) as mock_matrix:
+            result = service.quote_delivery(30.05, 31.05)
+
+        assert mock_matrix.call_count == 1
+        assert result['distance_km'] == 31.0
+
+
+class TestSingleFlight:
+    """Test concurrent lookups for one point share a single upstream call"""
+
+    def test_concurrent_quotes_share_one_call(self, service):
+        """Test many threads quoting the same point route it once"""
+        release = threading.Event()
+
+        def slow_matrix(hubs, lat, lng, timeout=None):
+            release.wait(2)
+            return [18.0, 40.0]
+
+        results = []
+        with patch.object(service, '_call_ors_matrix', side_effect=slow_matrix) as mock_matrix:
+            threads = [
+                threading.Thread(target=lambda: results.append(service.quote_delivery(30.05, 31.05)))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        assert mock_matrix.call_count == 1
+        assert len(results) == 8
+        assert all(result['distance_km'] == 18.0 for result in results)
+
+    def test_errors_reach_every_waiter(self):
+        """Test a failing leader raises in every caller and clears the key"""
+        flight = SingleFlight()
+
+        def boom():
+            raise ValueError("upstream exploded")
+
+        with pytest.raises(ValueError):
+            flight.do('key', boom)
+
+        assert flight.do('key', lambda: 42) == 42
+        assert flight.snapshot()['in_flight'] == 0
+
+
+class CoordinateBackend(RoutingBackend):
+    """Deterministic distances derived from the point, after a short pause"""
+
+    name = 'stub'
+
+    def hub_distances(self, hubs, lat, lng):
+        time.sleep(0.001)
+        return [expected_distance(lat, lng) + i for i in range(len(hubs))]
+
+
+def expected_distance(lat, lng):
+    return round((lat - 30.0) * 100 + (lng - 31.0) * 10, 3)
+
+
+class TestConcurrentQuotes:
+    """Test the service under many threads, as with gthread workers"""
+
+    def test_sharded_cache_under_contention(self):
+        """Test concurrent writers and readers never lose or corrupt entries"""
+        cache = MemoryDistanceCache(max_entries=20000, shards=16)
+        errors = []
+
+        def worker(thread_id):
+            try:
+                for i in range(500):
+                    key = f"t{thread_id}:{i}"
+                    cache.set(key, float(i))
+                    stored = cache.get(key)
+                    assert stored is not None and stored[1] == float(i)
+            except Exception as e:  # surfaced in the main thread
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert len(cache) == 16 * 500
+        assert cache.stats()['hits'] == 16 * 500
+
+    def test_capacity_is_split_across_shards(self):
+        """Test a sharded cache never grows past max_entries"""
+        cache = MemoryDistanceCache(max_entries=1024, shards=16)
+        for i in range(5000):
+            cache.set(f"k{i}", float(i))
+
+        assert len(cache) <= 1024
+        assert cache.stats()['evictions'] == 5000 - len(cache)
+
+    def test_hammered_quotes_are_consistent(self, make_service):
+        """Test concurrent quotes are correct and each point is routed once"""
+        service = make_service()
+        service.cache = MemoryDistanceCache()
+        service.cache_cell_meters = 0
+        service.prefilter_enabled = False
+        service.zones = None
+        service.router = FallbackBackend([CoordinateBackend()])
+
+        rng = random.Random(3)
+        points = [(round(rng.uniform(30.0, 30.2), 5), round(rng.uniform(31.0, 31.4), 5)) for _ in range(200)]
+        errors = []
+
+        def worker(seed):
+            picks = random.Random(seed)
+            try:
+                for _ in range(150):
+                    lat, lng = picks.choice(points)
+                    result = service.quote_delivery(lat, lng)
+                    assert result['ok'] is True
+                    assert result['distance_km'] == round(expected_distance(lat, lng), 2)
+            except Exception as e:  # surfaced in the main thread
+                errors.append(e)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)  # force frequent thread switches
+        try:
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(24)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+
+        assert errors == []
+        assert service.get_routing_stats()['answered_by']['stub'] <= len(set(points))
+        assert sum(service.get_metrics()['hub_wins']) == service.get_routing_stats()['answered_by']['stub']
+        assert service.metrics.histogram('quote').count == 24 * 150
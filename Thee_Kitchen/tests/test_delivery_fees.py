@@ -0,0 +1,108 @@
+import pytest
+from unittest.mock import patch
+import delivery_fees
+from delivery_fees import FeeSchedule, FeeSchedules
+
+DEFAULT_TIERS = [(25.0, 50), (70.0, 80)]
+
+
+class TestFeeSchedule:
+    """Test breakpoint table lookups"""
+
+    @pytest.mark.parametrize('distance_km, fee, out_of_range', [
+        (0.0, 50, False),
+        (25.0, 50, False),
+        (25.01, 80, False),
+        (70.0, 80, False),
+        (70.01, 0, True),
+    ])
+    def test_tier_boundaries(self, distance_km, fee, out_of_range):
+        """Test a breakpoint belongs to the tier it closes"""
+        pricing = FeeSchedule(DEFAULT_TIERS).price(distance_km)
+        assert pricing == {'delivery_fee': fee, 'out_of_range': out_of_range}
+
+    def test_tiers_are_sorted(self):
+        """Test tiers may be configured in any order"""
+        schedule = FeeSchedule([(40.0, 70), (10.0, 30), (25.0, 50)])
+        assert schedule.breakpoints == [10.0, 25.0, 40.0]
+        assert schedule.price(30.0)['delivery_fee'] == 70
+
+    def test_price_many_without_numpy(self):
+        """Test the bisect fallback prices arrays like single lookups"""
+        schedule = FeeSchedule(DEFAULT_TIERS)
+        distances = [3.0, 25.0, 40.0, 90.0]
+        with patch.object(delivery_fees, 'np', None):
+            fees, out_of_range = schedule.price_many(distances)
+
+        assert fees == [50, 50, 80, 0]
+        assert out_of_range == [False, False, False, True]
+
+    def test_price_many_with_numpy(self):
+        """Test searchsorted agrees with the bisect lookups"""
+        np = pytest.importorskip('numpy')
+        schedule = FeeSchedule(DEFAULT_TIERS)
+        distances = np.array([3.0, 25.0, 40.0, 90.0])
+        fees, out_of_range = schedule.price_many(distances)
+
+        assert fees.tolist() == [50, 50, 80, 0]
+        assert out_of_range.tolist() == [False, False, False, True]
+
+    def test_empty_schedule_rejected(self):
+        """Test a schedule needs at least one tier"""
+        with pytest.raises(ValueError):
+            FeeSchedule([])
+
+    def test_common_first_tier(self):
+        """Test hubs only share a first tier when they charge the same for it"""
+        schedules = FeeSchedules.from_config(DEFAULT_TIERS, {1: [(15.0, 50), (60.0, 90)]})
+        assert schedules.common_first_tier() == (15.0, 50)
+        assert schedules.boundaries() == [15.0, 25.0, 60.0, 70.0]
+
+        schedules = FeeSchedules.from_config(DEFAULT_TIERS, {1: [(15.0, 40)]})
+        assert schedules.common_first_tier() is None
+
+
+class TestPerHubPricing:
+    """Test the serving hub's fee schedule prices the quote"""
+
+    def test_nearest_hub_schedule_applies(self, service):
+        """Test a quote served by hub 1 uses hub 1's tiers"""
+        service.fee_schedules = FeeSchedules.from_config(DEFAULT_TIERS, {1: [(10.0, 30), (20.0, 45)]})
+
+        with patch.object(service, '_call_ors_matrix', return_value=[40.0, 12.0]):
+            result = service.quote_delivery(30.05, 31.05)
+
+        assert result['distance_km'] == 12.0
+        assert result['delivery_fee'] == 45
+
+    def test_serving_hub_is_cached(self, service):
+        """Test cached quotes keep pricing with the hub that served them"""
+        service.fee_schedules = FeeSchedules.from_config(DEFAULT_TIERS, {1: [(10.0, 30), (20.0, 45)]})
+
+        with patch.object(service, '_call_ors_matrix', return_value=[40.0, 12.0]) as mock_matrix:
+            service.quote_delivery(30.05, 31.05)
+            result = service.quote_delivery(30.05, 31.05)
+
+        assert mock_matrix.call_count == 1
+        assert result['delivery_fee'] == 45
+
+    def test_bare_cached_distance_uses_default_schedule(self, service):
+        """Test entries cached before per-hub pricing still quote"""
+        service.cache.set(service._get_cache_key(30.05, 31.05), 33.0)
+
+        result = service.quote_delivery(30.05, 31.05)
+
+        assert result['distance_km'] == 33.0
+        assert result['delivery_fee'] == 80
+
+    def test_prefilter_skips_near_tier_when_hubs_disagree(self, service):
+        """Test near points are routed when hubs charge different first-tier fees"""
+        service.prefilter_enabled = True
+        service.fee_schedules = FeeSchedules.from_config(DEFAULT_TIERS, {1: [(25.0, 40), (70.0, 80)]})
+        hub = service.hubs[1]
+
+        with patch.object(service, '_call_ors_matrix', return_value=[40.0, 1.0]) as mock_matrix:
+            result = service.quote_delivery(hub['lat'] + 0.001, hub['lng'])
+
+        assert mock_matrix.call_count == 1
+        assert result['delivery_fee'] == 40
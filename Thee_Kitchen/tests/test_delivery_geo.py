@@ -0,0 +1,155 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import delivery_zones
+from delivery_geo import haversine_km
+from delivery_zones import DeliveryZoneIndex, point_in_polygon
+
+# Shubra Masr hub from Config.DELIVERY_HUBS
+HUB_LAT, HUB_LNG = 30.0809753, 31.2355689
+
+
+@pytest.fixture
+def service(service):
+    """The test delivery service with the straight-line pre-filter on"""
+    service.prefilter_enabled = True
+    return service
+
+
+class TestHaversine:
+    """Test great-circle distance helper"""
+
+    def test_known_distance(self):
+        """Test one degree of latitude is about 111 km"""
+        assert haversine_km(30.0, 31.0, 31.0, 31.0) == pytest.approx(111.2, abs=0.2)
+
+    def test_zero_distance(self):
+        """Test identical points are 0 km apart"""
+        assert haversine_km(HUB_LAT, HUB_LNG, HUB_LAT, HUB_LNG) == 0.0
+
+
+class TestPrefilter:
+    """Test straight-line pre-filter settles clear-cut quotes locally"""
+
+    def test_far_point_is_out_of_range_without_routing(self, service):
+        """Test a point in Alexandria is out of range without calling ORS"""
+        with patch.object(service, '_call_ors_matrix') as mock_matrix:
+            result = service.quote_delivery(31.2001, 29.9187)
+
+        mock_matrix.assert_not_called()
+        assert result['ok'] is True
+        assert result['out_of_range'] is True
+        assert result['estimated'] is True
+
+    def test_close_point_gets_near_fee_without_routing(self, service):
+        """Test a point 500 m from a hub gets the near fee without calling ORS"""
+        with patch.object(service, '_call_ors_matrix') as mock_matrix:
+            result = service.quote_delivery(HUB_LAT + 0.0045, HUB_LNG)
+
+        mock_matrix.assert_not_called()
+        assert result['ok'] is True
+        assert result['out_of_range'] is False
+        assert result['delivery_fee'] == 50
+        assert service.get_prefilter_stats()['upstream_calls_avoided'] == 1
+
+    def test_exact_quote_routes_close_point(self, service):
+        """Test exact quotes (used by place_order) still route in-range points"""
+        with patch.object(service, '_call_ors_matrix', return_value=[1.2, 40.0]) as mock_matrix:
+            result = service.quote_delivery(HUB_LAT + 0.0045, HUB_LNG, exact=True)
+
+        assert mock_matrix.call_count == 1
+        assert result['distance_km'] == 1.2
+        assert 'estimated' not in result
+
+    def test_ambiguous_band_is_routed(self, service):
+        """Test points near the fee thresholds are routed"""
+        with patch.object(service, '_call_ors_matrix', return_value=[60.0, 65.0]) as mock_matrix:
+            result = service.quote_delivery(HUB_LAT + 0.45, HUB_LNG)
+
+        assert mock_matrix.call_count == 1
+        assert result['delivery_fee'] == 80
+        assert service.get_prefilter_stats()['routed'] == 1
+
+
+def square(lat, lng, half_size):
+    """GeoJSON polygon ring for a square centred on a point"""
+    return [[
+        [lng - half_size, lat - half_size],
+        [lng + half_size, lat - half_size],
+        [lng + half_size, lat + half_size],
+        [lng - half_size, lat + half_size],
+        [lng - half_size, lat - half_size],
+    ]]
+
+
+@pytest.fixture
+def zone_index():
+    """Two nested square zones around the Shubra hub"""
+    return DeliveryZoneIndex.from_geojson({
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': square(HUB_LAT, HUB_LNG, 0.2)},
+             'properties': {'hub_index': 1, 'range_km': 25.0}},
+            {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': square(HUB_LAT, HUB_LNG, 0.5)},
+             'properties': {'hub_index': 1, 'range_km': 70.0}},
+        ]
+    })
+
+
+class TestDeliveryZones:
+    """Test point-in-polygon fee tiers from precomputed zones"""
+
+    def test_lookup_returns_tightest_zone(self, zone_index):
+        """Test lookup picks the smallest containing zone"""
+        assert zone_index.lookup(HUB_LAT + 0.1, HUB_LNG).range_km == 25.0
+        assert zone_index.lookup(HUB_LAT + 0.3, HUB_LNG).range_km == 70.0
+        assert zone_index.lookup(HUB_LAT + 0.6, HUB_LNG) is None
+
+    def test_polygon_hole_is_excluded(self):
+        """Test points inside a hole are outside the polygon"""
+        rings = square(0.0, 0.0, 1.0) + square(0.0, 0.0, 0.5)
+        assert point_in_polygon(0.0, 0.0, rings) is False
+        assert point_in_polygon(0.75, 0.0, rings) is True
+
+    def test_service_prices_from_zones(self, service, zone_index):
+        """Test the service answers the tier without calling ORS"""
+        service.prefilter_enabled = False
+        service.zones = zone_index
+
+        with patch.object(service, '_call_ors_matrix') as mock_matrix:
+            near = service.quote_delivery(HUB_LAT + 0.1, HUB_LNG)
+            far = service.quote_delivery(HUB_LAT + 0.3, HUB_LNG)
+            outside = service.quote_delivery(HUB_LAT + 0.6, HUB_LNG)
+
+        mock_matrix.assert_not_called()
+        assert near['delivery_fee'] == 50
+        assert far['delivery_fee'] == 80
+        assert outside['out_of_range'] is True
+
+    def test_exact_quote_routes_inside_zone(self, service, zone_index):
+        """Test exact quotes still fetch the routed distance inside a zone"""
+        service.prefilter_enabled = False
+        service.zones = zone_index
+
+        with patch.object(service, '_call_ors_matrix', return_value=[50.0, 31.5]) as mock_matrix:
+            result = service.quote_delivery(HUB_LAT + 0.3, HUB_LNG, exact=True)
+
+        assert mock_matrix.call_count == 1
+        assert result['distance_km'] == 31.5
+
+    def test_build_and_load_zones(self, tmp_path):
+        """Test the builder converts ORS isochrones into a loadable zones file"""
+        ors_response = MagicMock()
+        ors_response.json.return_value = {
+            'features': [{
+                'geometry': {'type': 'Polygon', 'coordinates': square(HUB_LAT, HUB_LNG, 0.2)},
+                'properties': {'group_index': 0, 'value': 25000.0}
+            }]
+        }
+        output = tmp_path / 'zones.geojson'
+
+        with patch('delivery_zones.requests.post', return_value=ors_response) as mock_post:
+            assert delivery_zones.main(['build', '--output', str(output)]) == 0
+
+        assert mock_post.call_args.kwargs['json']['range_type'] == 'distance'
+        index = DeliveryZoneIndex.load(str(output))
+        assert index.lookup(HUB_LAT, HUB_LNG).range_km == 25.0
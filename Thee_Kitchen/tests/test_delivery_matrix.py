@@ -0,0 +1,371 @@
+import asyncio
+import json
+import time
+import requests
+from unittest.mock import patch, MagicMock, AsyncMock
+from delivery_cache import MemoryDistanceCache
+from delivery_resilience import CircuitBreaker
+from ors_stub import ORSStubServer
+
+
+def make_matrix_response(distances_m):
+    """Build a mocked ORS matrix response with one row per hub"""
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = {
+        'distances': [[distance] for distance in distances_m]
+    }
+    return response
+
+
+def make_matrix_response_many(hub_count, point_count, distance_m):
+    """Build a mocked ORS matrix response with the same distance in every cell"""
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = {
+        'distances': [[distance_m] * point_count for _ in range(hub_count)]
+    }
+    return response
+
+
+class TestMultiSourceMatrix:
+    """Test that every hub is routed in a single ORS matrix request"""
+
+    def test_single_request_for_all_hubs(self, make_service):
+        """Test all hubs are sent as sources in one POST"""
+        service = make_service()
+        service.hubs = [
+            {'lat': 30.0, 'lng': 31.0},
+            {'lat': 30.1, 'lng': 31.1},
+            {'lat': 30.2, 'lng': 31.2},
+        ]
+        service.prefilter_enabled = False
+        service.router.candidates = len(service.hubs)
+
+        with patch.object(service.http, 'post') as mock_post:
+            mock_post.return_value = make_matrix_response([40000, 12000, 30000])
+
+            result = service.quote_delivery(30.05, 31.05)
+
+            assert mock_post.call_count == 1
+            payload = mock_post.call_args.kwargs['json']
+            assert payload['sources'] == [0, 1, 2]
+            assert payload['destinations'] == [3]
+            assert payload['locations'][3] == [31.05, 30.05]
+
+            assert result['ok'] is True
+            assert result['distance_km'] == 12.0
+            assert result['delivery_fee'] == 50
+
+    def test_unroutable_hub_is_ignored(self, make_service):
+        """Test a null cell for one hub does not hide the others"""
+        service = make_service()
+
+        with patch.object(service.http, 'post') as mock_post:
+            mock_post.return_value = make_matrix_response([None, 40000])
+
+            result = service.quote_delivery(30.05, 31.05)
+
+            assert result['ok'] is True
+            assert result['distance_km'] == 40.0
+            assert result['delivery_fee'] == 80
+
+    def test_retries_are_bounded(self, make_service):
+        """Test a failing matrix call is retried up to max_retries and then gives up"""
+        service = make_service()
+        service.cache = MemoryDistanceCache()
+        service.max_retries = 1
+
+        with patch.object(service.http, 'post') as mock_post, patch('delivery_service.time.sleep'):
+            mock_post.return_value = make_matrix_response([None, None])
+
+            result = service.quote_delivery(30.05, 31.05)
+
+            assert mock_post.call_count == 2
+            assert result['ok'] is False
+
+
+class TestAsyncQuote:
+    """Test the asyncio quote path and async endpoint"""
+
+    def test_async_quote_uses_batched_matrix(self, service):
+        """Test the async path sends one batched request when it succeeds"""
+        with patch('delivery_async.AsyncORSClient._post_matrix', new_callable=AsyncMock) as mock_post:
+            mock_post.return_value = [30.0, 12.0]
+
+            result = asyncio.run(service.quote_delivery_async(30.05, 31.05))
+
+        assert mock_post.await_count == 1
+        assert result['distance_km'] == 12.0
+        assert result['delivery_fee'] == 50
+
+    def test_async_quote_falls_back_to_concurrent_hubs(self, service):
+        """Test a batch ORS rejected is retried as concurrent per-hub requests"""
+        answers = [None, None, [40.0]]
+
+        async def fake_post(session, hubs, lat, lng, outcome=None, timeout=None):
+            if outcome is not None:
+                outcome['rejected'] = True
+            return answers.pop(0)
+
+        with patch('delivery_async.AsyncORSClient._post_matrix', side_effect=fake_post) as mock_post:
+            result = asyncio.run(service.quote_delivery_async(30.05, 31.05))
+
+        assert mock_post.call_count == 3
+        assert result['ok'] is True
+        assert result['distance_km'] == 40.0
+
+    def test_async_quote_no_fan_out_when_ors_failing(self, service):
+        """Test a batch lost to an upstream failure is retried whole, never split per hub"""
+        service.retry_backoff = 0.001
+
+        with patch('delivery_async.AsyncORSClient._post_matrix', new_callable=AsyncMock) as mock_post:
+            mock_post.return_value = None
+
+            result = asyncio.run(service.quote_delivery_async(30.05, 31.05))
+
+        assert mock_post.await_count == service.max_retries + 1
+        assert all(len(call.args[1]) == 2 for call in mock_post.await_args_list)
+        assert result['ok'] is False
+
+    def test_async_quote_retries_transient_failure(self, service):
+        """Test one failed ORS call is retried with backoff instead of failing the quote"""
+        service.retry_backoff = 0.001
+
+        with patch('delivery_async.AsyncORSClient._post_matrix', new_callable=AsyncMock) as mock_post:
+            mock_post.side_effect = [None, [30.0, 12.0]]
+
+            result = asyncio.run(service.quote_delivery_async(30.05, 31.05))
+
+        assert mock_post.await_count == 2
+        assert result['distance_km'] == 12.0
+        assert service.get_breaker_state()['retries'] == 1
+
+    def test_async_quote_hedged_after_p95(self, service):
+        """Test a slow async call is hedged and the faster answer wins"""
+        service.hedge_enabled = True
+        for _ in range(service.hedge_min_samples):
+            service.ors_latency.record(0.01)
+        calls = []
+
+        async def fake_post(session, hubs, lat, lng, outcome=None, timeout=None):
+            calls.append(timeout)
+            if len(calls) == 1:
+                await asyncio.sleep(0.5)
+                return [50.0, 60.0]
+            return [12.0, 30.0]
+
+        with patch('delivery_async.AsyncORSClient._post_matrix', side_effect=fake_post):
+            started = time.monotonic()
+            result = asyncio.run(service.quote_delivery_async(30.05, 31.05))
+            elapsed = time.monotonic() - started
+
+        assert len(calls) == 2
+        assert elapsed < 0.4
+        assert result['distance_km'] == 12.0
+        assert service.get_breaker_state()['hedged_requests'] == 1
+
+    def test_async_quote_deadline(self, service):
+        """Test a hung ORS call is cut off at the retry deadline and frees the breaker probe"""
+        service.retry_deadline = 0.05
+        service.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        service.breaker.record_failure()
+        time.sleep(0.02)  # half open, so the call takes the probe
+
+        with ORSStubServer(latency=0.5) as stub:
+            service.ors_base_url = stub.base_url
+            started = time.monotonic()
+            result = asyncio.run(service.quote_delivery_async(30.05, 31.05))
+            elapsed = time.monotonic() - started
+
+        assert result['ok'] is False
+        assert elapsed < 0.4
+        time.sleep(0.02)
+        assert service.breaker.allow_request() is True
+
+    def test_async_quotes_share_connection(self, service):
+        """Test async quotes from separate event loops reuse one keep-alive connection"""
+        with ORSStubServer() as stub:
+            service.ors_base_url = stub.base_url
+
+            for i in range(3):
+                result = asyncio.run(service.quote_delivery_async(30.2 + i * 0.01, 31.4))
+                assert result['ok'] is True
+
+        assert stub.requests == 3
+        assert stub.connections == 1
+
+    def test_async_endpoint(self, client):
+        """Test /api/delivery/quote awaits the async quote"""
+        with patch('app.quote_delivery_async', new_callable=AsyncMock) as mock_quote:
+            mock_quote.return_value = {
+                'ok': True,
+                'out_of_range': False,
+                'delivery_fee': 80,
+                'distance_km': 40.0
+            }
+
+            response = client.post('/api/delivery/quote', json={'lat': '30.0', 'lng': '31.0'})
+
+        data = response.get_json()
+        assert data['ok'] is True
+        assert data['delivery_fee'] == 80
+
+
+class TestPooledSession:
+    """Test ORS calls reuse keep-alive connections against a local stub"""
+
+    def test_connections_are_reused(self, service):
+        """Test repeated quotes share one TCP connection"""
+        with ORSStubServer() as stub:
+            service.ors_base_url = stub.base_url
+
+            for i in range(5):
+                result = service.quote_delivery(30.2 + i * 0.01, 31.4)
+                assert result['ok'] is True
+
+            stats = service.get_http_pool_stats()
+
+        assert stub.requests == 5
+        assert stub.connections == 1
+        assert stats['requests'] == 5
+        assert stats['connections_opened'] == 1
+        assert stats['connections_reused'] == 4
+
+    def test_auth_header_sent_on_session(self, make_service):
+        """Test the API key is sent on every pooled request"""
+        service = make_service()
+        assert service.http.headers['Authorization'] == service.api_key
+
+
+class TestCircuitBreaker:
+    """Test failing fast and serving stale distances while ORS is unhealthy"""
+
+    def test_breaker_half_open_probe(self):
+        """Test an open breaker lets a single probe through after the reset timeout"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.allow_request() is False
+
+        time.sleep(0.06)
+        assert breaker.allow_request() is True
+        assert breaker.allow_request() is False  # Only one probe at a time
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_open_breaker_fails_fast(self, service):
+        """Test quotes stop calling ORS once the breaker has opened"""
+        service.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+        with patch.object(service.http, 'post', side_effect=requests.exceptions.Timeout) as mock_post, \
+                patch('delivery_service.time.sleep'):
+            service.quote_delivery(30.05, 31.05)
+            calls_after_first_quote = mock_post.call_count
+            result = service.quote_delivery(30.06, 31.06)
+
+        assert calls_after_first_quote == 2
+        assert mock_post.call_count == 2
+        assert result['ok'] is False
+        assert service.get_breaker_state()['state'] == 'open'
+
+    def test_stale_distance_served_when_ors_down(self, make_service):
+        """Test an expired cache entry is used when ORS cannot be reached"""
+        service = make_service()
+        service.cache = MemoryDistanceCache(ttl=86400)
+        service.prefilter_enabled = False
+        service.stale_while_revalidate = False
+
+        with patch('delivery_cache.time.time', return_value=time.time() - 3600):
+            service.cache.set(service._get_cache_key(30.05, 31.05), 33.0)
+
+        with patch.object(service, '_call_ors_matrix', return_value=None), \
+                patch('delivery_service.time.sleep'):
+            result = service.quote_delivery(30.05, 31.05)
+
+        assert result['ok'] is True
+        assert result['distance_km'] == 33.0
+        assert service.get_breaker_state()['stale_served'] == 1
+
+    def test_hedged_request_after_p95(self, service):
+        """Test a slow primary request is hedged and the faster answer wins"""
+        service.hedge_enabled = True
+        for _ in range(service.hedge_min_samples):
+            service.ors_latency.record(0.01)
+
+        calls = []
+
+        def fake_matrix(hubs, lat, lng, timeout=None):
+            calls.append(timeout)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return [50.0, 60.0]
+            return [12.0, 30.0]
+
+        with patch.object(service, '_call_ors_matrix', side_effect=fake_matrix):
+            result = service.quote_delivery(30.05, 31.05)
+
+        assert len(calls) == 2
+        assert result['distance_km'] == 12.0
+        assert service.get_breaker_state()['hedged_requests'] == 1
+
+
+class TestBatchQuote:
+    """Test quoting many coordinates with few matrix requests"""
+
+    def test_batch_dedupes_and_chunks(self, service):
+        """Test misses are deduped and packed into matrix requests within the ORS limits"""
+        service.cache.set(service._get_cache_key(30.5, 31.5), 20.0)
+
+        def fake_post(url, json=None, timeout=None):
+            assert len(json['locations']) <= 5
+            return make_matrix_response_many(len(json['sources']), len(json['destinations']), 30000)
+
+        points = [(30.0 + i * 0.01, 31.0) for i in range(7)]
+        points += [points[0], points[1], ('bad', None), (30.5, 31.5)]
+
+        with patch('delivery_service.Config.ORS_MATRIX_MAX_LOCATIONS', 5), \
+                patch.object(service.http, 'post', side_effect=fake_post) as mock_post:
+            results = list(service.quote_delivery_batch(points))
+
+        assert mock_post.call_count == 3  # 7 unique misses, 3 per request
+        assert sorted(result['index'] for result in results) == list(range(len(points)))
+        by_index = {result['index']: result for result in results}
+        assert by_index[7]['distance_km'] == 30.0
+        assert by_index[9]['error'] == 'Invalid coordinates'
+        assert by_index[10]['distance_km'] == 20.0
+
+    def test_failed_chunk_reports_errors(self, service):
+        """Test a failed matrix request fails only its own points"""
+        service.max_retries = 0
+
+        with patch.object(service.http, 'post', side_effect=requests.exceptions.Timeout):
+            results = list(service.quote_delivery_batch([(30.05, 31.05), (30.06, 31.06)]))
+
+        assert [result['ok'] for result in results] == [False, False]
+
+    def test_batch_endpoint_requires_admin(self, client):
+        """Test non-admins cannot run bulk quotes"""
+        response = client.post('/api/delivery/quote/batch', json={'points': [{'lat': 30.0, 'lng': 31.0}]})
+        assert response.status_code == 403
+
+    def test_batch_endpoint_streams_ndjson(self, client):
+        """Test results are streamed back one JSON object per line"""
+        with client.session_transaction() as sess:
+            sess['is_admin'] = True
+
+        with patch('app.quote_delivery_batch') as mock_batch:
+            mock_batch.return_value = iter([
+                {'index': 1, 'ok': True, 'out_of_range': False, 'delivery_fee': 50, 'distance_km': 5.0},
+                {'index': 0, 'ok': False, 'error': 'Invalid coordinates'}
+            ])
+            response = client.post('/api/delivery/quote/batch', json={
+                'points': [{'lat': 'x', 'lng': 31.0}, {'lat': 30.0, 'lng': 31.0}]
+            })
+
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert response.mimetype == 'application/x-ndjson'
+        assert [line['index'] for line in lines] == [1, 0]
+        assert mock_batch.call_args.args[0] == [('x', 31.0), (30.0, 31.0)]
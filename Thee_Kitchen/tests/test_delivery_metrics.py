@@ -0,0 +1,91 @@
+import pytest
+import requests
+from unittest.mock import patch
+from delivery_metrics import Histogram, DeliveryMetrics
+from test_delivery_matrix import make_matrix_response
+
+
+class TestHistogram:
+    """Test bucketed latency percentiles"""
+
+    def test_percentiles(self):
+        """Test p50/p95/p99 land in the right buckets"""
+        histogram = Histogram()
+        for _ in range(90):
+            histogram.observe(4.0)
+        for _ in range(9):
+            histogram.observe(80.0)
+        histogram.observe(3000.0)
+
+        assert 2 < histogram.percentile(50) <= 5
+        assert 50 < histogram.percentile(95) <= 100
+        assert 50 < histogram.percentile(99) <= 100
+        assert histogram.percentile(100) == 3000.0
+
+    def test_empty_histogram(self):
+        """Test an empty histogram reports no percentiles"""
+        snapshot = Histogram().snapshot()
+        assert snapshot['count'] == 0
+        assert snapshot['p95_ms'] is None
+
+    def test_timer_records_failures(self):
+        """Test a timed block that raises is still recorded"""
+        metrics = DeliveryMetrics()
+        with pytest.raises(RuntimeError):
+            with metrics.timer('work'):
+                raise RuntimeError('boom')
+        assert metrics.histogram('work').count == 1
+
+
+class TestServiceMetrics:
+    """Test the delivery service records where quote time goes"""
+
+    def test_quote_and_ors_accounting(self, service):
+        """Test quote latency, ORS calls, cache hits and hub wins are recorded"""
+        with patch.object(service.http, 'post') as mock_post:
+            mock_post.return_value = make_matrix_response([40000, 12000])
+            service.quote_delivery(30.05, 31.05)
+            service.quote_delivery(30.05, 31.05)
+            service.quote_delivery(30.06, 31.06, exact=True)
+
+        metrics = service.get_metrics()
+        assert metrics['latency']['quote']['count'] == 2
+        assert metrics['latency']['quote_exact']['count'] == 1
+        assert metrics['latency']['ors_call']['count'] == 2
+        assert metrics['latency']['routing']['p50_ms'] is not None
+        assert metrics['ors']['calls'] == 2
+        assert metrics['ors']['failures'] == 0
+        assert metrics['hub_wins'] == [0, 2]
+        assert metrics['cache_hit_ratio'] == pytest.approx(1 / 3, abs=1e-4)
+
+    def test_cache_hit_ratio_counts_quotes(self, service):
+        """Test the hit ratio counts each quote once, not every backend lookup"""
+        with patch.object(service.http, 'post') as mock_post:
+            mock_post.return_value = make_matrix_response([40000, 12000])
+            service.quote_delivery(30.05, 31.05)
+            service.quote_delivery(30.05, 31.05)
+
+        assert service.get_metrics()['cache_hit_ratio'] == 0.5
+
+    def test_failed_ors_calls_counted(self, service):
+        """Test failed upstream calls are counted and timed"""
+        service.max_retries = 0
+        with patch.object(service.http, 'post', side_effect=requests.exceptions.ConnectionError):
+            service.quote_delivery(30.05, 31.05)
+
+        metrics = service.get_metrics()
+        assert metrics['ors']['calls'] == 1
+        assert metrics['ors']['failures'] == 1
+        assert metrics['latency']['ors_call']['count'] == 1
+
+    def test_metrics_endpoint(self, client):
+        """Test admins see the latency histograms next to the other delivery stats"""
+        with client.session_transaction() as sess:
+            sess['is_admin'] = True
+
+        response = client.get('/admin/delivery-metrics')
+
+        data = response.get_json()
+        assert response.status_code == 200
+        assert 'latency' in data['metrics']
+        assert 'hub_wins' in data['metrics']
@@ -0,0 +1,126 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import patch
+from delivery_cache import MemoryDistanceCache
+from delivery_resilience import CircuitBreaker, QuotaScheduler
+from test_delivery_matrix import make_matrix_response
+
+NO_WAIT = {QuotaScheduler.HIGH: 0.0, QuotaScheduler.LOW: 0.0}
+
+
+@pytest.fixture
+def service(service):
+    """The test delivery service with its ORS quota nearly spent"""
+    service.quota = QuotaScheduler(per_minute=4, per_day=100, reserve=0.5, max_wait=NO_WAIT)
+    assert service.quota.try_acquire(QuotaScheduler.LOW)
+    assert service.quota.try_acquire(QuotaScheduler.LOW)
+    return service
+
+
+class TestQuotaScheduler:
+    """Test the client-side token bucket and its reserved capacity"""
+
+    def test_low_priority_leaves_reserve(self):
+        """Test low-priority calls stop at the reserve and high-priority calls use it"""
+        quota = QuotaScheduler(per_minute=4, per_day=100, reserve=0.5, max_wait=NO_WAIT)
+
+        low = [quota.acquire(QuotaScheduler.LOW) for _ in range(3)]
+        high = [quota.acquire(QuotaScheduler.HIGH) for _ in range(3)]
+
+        assert low == [True, True, False]
+        assert high == [True, True, False]
+        assert quota.snapshot()['shed'] == {'high': 1, 'low': 1}
+
+    def test_daily_quota_reserve(self):
+        """Test the daily budget is held back for high priority the same way"""
+        quota = QuotaScheduler(per_minute=100, per_day=4, reserve=0.5, max_wait=NO_WAIT)
+
+        assert [quota.try_acquire(QuotaScheduler.LOW) for _ in range(3)] == [True, True, False]
+        assert [quota.try_acquire(QuotaScheduler.HIGH) for _ in range(3)] == [True, True, False]
+
+    def test_low_priority_waits_for_refill(self):
+        """Test a low-priority call queues briefly for the next token"""
+        quota = QuotaScheduler(per_minute=6000, per_day=100000, reserve=0.0,
+                               max_wait={QuotaScheduler.HIGH: 0.0, QuotaScheduler.LOW: 0.5})
+        while quota.try_acquire(QuotaScheduler.LOW):
+            pass
+
+        assert quota.acquire(QuotaScheduler.LOW) is True
+        assert asyncio.run(quota.acquire_async(QuotaScheduler.LOW)) is True
+
+    def test_headers_correct_daily_remaining(self):
+        """Test the upstream's remaining count replaces the local estimate"""
+        quota = QuotaScheduler(per_minute=40, per_day=500, reserve=0.25, max_wait=NO_WAIT)
+
+        quota.update_from_headers({'x-ratelimit-limit': '500', 'x-ratelimit-remaining': '1'}, 200)
+
+        assert quota.snapshot()['daily_remaining'] == 1
+        assert quota.try_acquire(QuotaScheduler.LOW) is False
+        assert quota.try_acquire(QuotaScheduler.HIGH) is True
+
+    def test_throttled_response_pauses_everyone(self):
+        """Test a 429 blocks every priority until Retry-After passes"""
+        quota = QuotaScheduler(per_minute=40, per_day=500, reserve=0.25, max_wait=NO_WAIT)
+
+        quota.update_from_headers({'retry-after': '30'}, 429)
+
+        assert quota.try_acquire(QuotaScheduler.HIGH) is False
+        assert quota.snapshot()['throttled'] == 1
+
+    def test_malformed_headers_are_ignored(self):
+        """Test missing or junk header values leave the counts alone"""
+        quota = QuotaScheduler(per_minute=40, per_day=500, reserve=0.25, max_wait=NO_WAIT)
+
+        quota.update_from_headers({'x-ratelimit-remaining': 'soon'}, 200)
+        quota.update_from_headers(None, 200)
+
+        assert quota.snapshot()['daily_remaining'] == 500
+
+
+class TestQuotePriorities:
+    """Test browsing quotes are shed before checkout quotes"""
+
+    def test_browsing_quote_is_shed(self, service):
+        """Test an exploratory quote does not spend the order reserve"""
+        with patch.object(service, '_call_ors_matrix', return_value=[12.0, 40.0]) as mock_matrix:
+            result = service.quote_delivery(30.05, 31.05)
+
+        assert mock_matrix.call_count == 0
+        assert result['ok'] is False
+        assert service.get_metrics()['counters']['ors_shed.low'] == 1
+
+    def test_checkout_quote_uses_reserve(self, service):
+        """Test place_order quotes still reach ORS when only the reserve is left"""
+        with patch.object(service, '_call_ors_matrix', return_value=[12.0, 40.0]) as mock_matrix:
+            result = service.quote_delivery(30.05, 31.05, exact=True)
+
+        assert mock_matrix.call_count == 1
+        assert result['distance_km'] == 12.0
+        assert service.get_metrics()['ors']['quota']['granted']['high'] == 1
+
+    def test_shed_async_call_keeps_breaker_probe(self, service):
+        """Test a shed async quote does not take the half-open probe slot"""
+        service.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        service.breaker.record_failure()
+        time.sleep(0.02)
+
+        result = asyncio.run(service.quote_delivery_async(30.05, 31.05))
+
+        assert result['ok'] is False
+        assert service.get_metrics()['counters']['ors_shed.low'] >= 1
+        assert service.breaker.allow_request() is True
+
+    def test_response_headers_update_quota(self, make_service):
+        """Test each ORS response reports the remaining daily quota"""
+        service = make_service()
+        service.cache = MemoryDistanceCache()
+        service.prefilter_enabled = False
+        service.zones = None
+        response = make_matrix_response([12000, 40000])
+        response.headers = {'x-ratelimit-limit': '500', 'x-ratelimit-remaining': '321'}
+
+        with patch.object(service.http, 'post', return_value=response):
+            service.quote_delivery(30.05, 31.05)
+
+        assert service.quota.snapshot()['daily_remaining'] == 321
@@ -1,213 +1,175 @@
 import pytest
 import json
-from unittest.mock import patch, MagicMock
-from app import app
-from delivery_service import quote_delivery, _distance_cache
+from unittest.mock import patch, AsyncMock
+from delivery_cache import MemoryDistanceCache
+from delivery_resilience import CircuitBreaker, QuotaScheduler
+from delivery_service import DeliveryService, delivery_service, quote_delivery
+from benchmarks.bench_delivery_quote import find_regressions, run_benchmark
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    """Give the global delivery service a private cache, healthy ORS state and always route"""
+    monkeypatch.setattr(delivery_service, 'cache', MemoryDistanceCache())
+    monkeypatch.setattr(delivery_service, 'breaker', CircuitBreaker())
+    monkeypatch.setattr(delivery_service, 'quota', QuotaScheduler())
+    monkeypatch.setattr(delivery_service, 'prefilter_enabled', False)
+    monkeypatch.setattr(delivery_service, 'zones', None)
+    return delivery_service
+
+
+def mock_async_matrix(distances_km):
+    """Patch the async ORS client to answer with fixed per-hub distances"""
+    return patch('delivery_async.AsyncORSClient._post_matrix', new_callable=AsyncMock,
+                 return_value=distances_km)
+
 
 class TestDeliveryQuote:
-    """Test delivery quote API endpoint and service logic"""
-
-    def test_quote_ok_near_fee(self, client):
-        """Test quote with distance <= 25km returns 50 EGP fee"""
-        with patch('delivery_service.osrm_distance_km') as mock_distance:
-            mock_distance.return_value = 10.0  # 10km distance
-            
-            response = client.post('/api/delivery/quote', data={
-                'lat': '30.0',
-                'lng': '31.0'
-            })
-            
-            assert response.status_code == 200
-            data = json.loads(response.data)
-            assert data['ok'] is True
-            assert data['out_of_range'] is False
-            assert data['delivery_fee'] == 50
-            assert data['distance_km'] == 10.0
-
-    def test_quote_ok_far_fee(self, client):
-        """Test quote with distance 40km returns 80 EGP fee"""
-        with patch('delivery_service.osrm_distance_km') as mock_distance:
-            mock_distance.return_value = 40.0  # 40km distance
-            
-            response = client.post('/api/delivery/quote', data={
-                'lat': '30.0',
-                'lng': '31.0'
-            })
-            
-            assert response.status_code == 200
-            data = json.loads(response.data)
-            assert data['ok'] is True
-            assert data['out_of_range'] is False
-            assert data['delivery_fee'] == 80
-            assert data['distance_km'] == 40.0
-
-    def test_quote_out_of_range(self, client):
+    """Test delivery quote API endpoint"""
+
+    @pytest.mark.parametrize('distance_km, fee', [(10.0, 50), (40.0, 80)])
+    def test_quote_in_range(self, client, routed, distance_km, fee):
+        """Test in-range quotes return the tier fee of the nearest hub"""
+        with mock_async_matrix([distance_km, distance_km + 20]):
+            response = client.post('/api/delivery/quote', data={'lat': '30.0', 'lng': '31.0'})
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['ok'] is True
+        assert data['out_of_range'] is False
+        assert data['delivery_fee'] == fee
+        assert data['distance_km'] == distance_km
+
+    def test_quote_out_of_range(self, client, routed):
         """Test quote with distance > 70km returns out of range"""
-        with patch('delivery_service.osrm_distance_km') as mock_distance:
-            mock_distance.return_value = 80.0  # 80km distance
-            
-            response = client.post('/api/delivery/quote', data={
-                'lat': '30.0',
-                'lng': '31.0'
-            })
-            
-            assert response.status_code == 200
-            data = json.loads(response.data)
-            assert data['ok'] is True
-            assert data['out_of_range'] is True
-            assert data['distance_km'] == 80.0
-            assert 'delivery_fee' not in data
+        with mock_async_matrix([80.0, 95.0]):
+            response = client.post('/api/delivery/quote', data={'lat': '30.0', 'lng': '31.0'})
+
+        data = json.loads(response.data)
+        assert data['ok'] is True
+        assert data['out_of_range'] is True
+        assert data['distance_km'] == 80.0
+        assert 'delivery_fee' not in data
 
     def test_quote_invalid_latlng(self, client):
         """Test quote with missing/invalid coordinates returns error"""
-        # Test missing coordinates
         response = client.post('/api/delivery/quote', data={})
-        assert response.status_code == 200
         data = json.loads(response.data)
         assert data['ok'] is False
         assert 'error' in data
 
-        # Test invalid coordinates
-        response = client.post('/api/delivery/quote', data={
-            'lat': 'invalid',
-            'lng': '31.0'
-        })
-        assert response.status_code == 200
+        response = client.post('/api/delivery/quote', data={'lat': 'invalid', 'lng': '31.0'})
         data = json.loads(response.data)
         assert data['ok'] is False
         assert 'error' in data
 
-    def test_quote_json_input(self, client):
+    def test_quote_json_input(self, client, routed):
         """Test quote API accepts JSON input"""
-        with patch('delivery_service.osrm_distance_km') as mock_distance:
-            mock_distance.return_value = 15.0
-            
-            response = client.post('/api/delivery/quote', 
-                              json={'lat': '30.0', 'lng': '31.0'},
-                              content_type='application/json')
-            
-            assert response.status_code == 200
-            data = json.loads(response.data)
-            assert data['ok'] is True
-            assert data['delivery_fee'] == 50
-
-    def test_osrm_service_error(self, client):
-        """Test quote when OSRM service fails"""
-        with patch('delivery_service.osrm_distance_km') as mock_distance:
-            mock_distance.return_value = None  # Service failure
-            
-            response = client.post('/api/delivery/quote', data={
-                'lat': '30.0',
-                'lng': '31.0'
-            })
-            
-            assert response.status_code == 200
-            data = json.loads(response.data)
-            assert data['ok'] is False
-            assert 'error' in data
+        with mock_async_matrix([15.0, 30.0]):
+            response = client.post('/api/delivery/quote', json={'lat': '30.0', 'lng': '31.0'})
 
+        data = json.loads(response.data)
+        assert data['ok'] is True
+        assert data['delivery_fee'] == 50
 
-class TestDeliveryService:
-    """Test delivery service logic directly"""
+    def test_routing_failure(self, client, routed):
+        """Test quote when ORS cannot route the point"""
+        with mock_async_matrix(None):
+            response = client.post('/api/delivery/quote', data={'lat': '30.0', 'lng': '31.0'})
 
-    def test_boundary_25_fee_50(self):
-        """Test exact boundary at 25km returns 50 EGP"""
-        with patch('delivery_service.osrm_distance_km') as mock_distance:
-            mock_distance.return_value = 25.0
-            
-            result = quote_delivery('30.0', '31.0')
-            
-            assert result['ok'] is True
-            assert result['out_of_range'] is False
-            assert result['delivery_fee'] == 50
-            assert result['distance_km'] == 25.0
-
-    def test_boundary_25_01_fee_80(self):
-        """Test just over 25km boundary returns 80 EGP"""
-        with patch('delivery_service.osrm_distance_km') as mock_distance:
-            mock_distance.return_value = 25.01
-            
-            result = quote_delivery('30.0', '31.0')
-            
-            assert result['ok'] is True
-            assert result['out_of_range'] is False
-            assert result['delivery_fee'] == 80
-            assert result['distance_km'] == 25.01
-
-    def test_boundary_70_fee_80(self):
-        """Test exact boundary at 70km returns 80 EGP"""
-        with patch('delivery_service.osrm_distance_km') as mock_distance:
-            mock_distance.return_value = 70.0
-            
-            result = quote_delivery('30.0', '31.0')
-            
-            assert result['ok'] is True
-            assert result['out_of_range'] is False
-            assert result['delivery_fee'] == 80
-            assert result['distance_km'] == 70.0
-
-    def test_boundary_70_01_out_of_range(self):
-        """Test just over 70km boundary returns out of range"""
-        with patch('delivery_service.osrm_distance_km') as mock_distance:
-            mock_distance.return_value = 70.01
-            
+        data = json.loads(response.data)
+        assert data['ok'] is False
+        assert 'error' in data
+
+
+class TestDeliveryService:
+    """Test fee boundaries through the module-level quote function"""
+
+    @pytest.mark.parametrize('distance_km, fee, out_of_range', [
+        (25.0, 50, False),
+        (25.01, 80, False),
+        (70.0, 80, False),
+        (70.01, 0, True),
+    ])
+    def test_fee_boundaries(self, routed, distance_km, fee, out_of_range):
+        """Test a boundary distance belongs to the tier it closes"""
+        with patch.object(routed, '_call_ors_matrix', return_value=[distance_km, 99.0]):
             result = quote_delivery('30.0', '31.0')
-            
-            assert result['ok'] is True
-            assert result['out_of_range'] is True
-            assert result['distance_km'] == 70.01
-            assert 'delivery_fee' not in result
+
+        assert result['ok'] is True
+        assert result['out_of_range'] is out_of_range
+        assert result['delivery_fee'] == fee
+        assert result['distance_km'] == distance_km
 
     def test_invalid_coordinates(self):
         """Test service with invalid coordinates"""
-        result = quote_delivery('', '')
-        assert result['ok'] is False
-        assert 'error' in result
-
-        result = quote_delivery('invalid', '31.0')
-        assert result['ok'] is False
-        assert 'error' in result
+        assert quote_delivery('', '')['ok'] is False
+        assert quote_delivery('invalid', '31.0')['ok'] is False
+        assert quote_delivery('95.0', '31.0')['ok'] is False
 
 
 class TestCaching:
-    """Test delivery distance caching functionality"""
-
-    def test_cache_hit_avoids_recompute(self):
-        """Test that cache hit avoids OSRM recomputation"""
-        with patch('delivery_service.requests.get') as mock_get:
-            # Mock successful OSRM response
-            mock_response = MagicMock()
-            mock_response.status_code = 200
-            mock_response.json.return_value = {
-                'code': 'Ok',
-                'routes': [{'distance': 15000}]  # 15km in meters
-            }
-            mock_get.return_value = mock_response
-            
-            # Clear cache
-            _distance_cache.clear()
-            
-            # First call should hit OSRM for each hub (2 hubs = 2 calls)
-            result1 = quote_delivery('30.0', '31.0')
-            assert mock_get.call_count == 2
-            
-            # Second call with same coordinates should use cache
-            result2 = quote_delivery('30.0', '31.0')
-            assert mock_get.call_count == 2  # Still only called once per hub
-            
-            # Results should be identical
-            assert result1 == result2
-
-    def test_cache_key_precision(self):
-        """Test cache key uses 5 decimal precision"""
-        from delivery_service import _get_cache_key
-        
-        # Different precision should map to same cache key
-        key1 = _get_cache_key(30.0, 31.0, 30.123456, 31.654321)
-        key2 = _get_cache_key(30.0, 31.0, 30.12346, 31.65432)  # Both round to 30.12346, 31.65432
-        
-        assert key1 == key2
-        
-        # Different coordinates should have different keys
-        key3 = _get_cache_key(30.0, 31.0, 30.12345, 31.65432)  # This rounds to 30.12345, 31.65432
-        assert key3 != key1
+    """Test repeat quotes are served from the distance cache"""
+
+    def test_cache_hit_avoids_recompute(self, routed):
+        """Test a second quote for the same point does not route again"""
+        with patch.object(routed, '_call_ors_matrix', return_value=[15.0, 30.0]) as mock_matrix:
+            first = quote_delivery('30.0', '31.0')
+            second = quote_delivery('30.0', '31.0')
+
+        assert mock_matrix.call_count == 1
+        assert first == second
+
+    def test_cache_key_precision(self, routed):
+        """Test cache keys round coordinates to 5 decimals"""
+        key = routed._get_cache_key(30.123456, 31.654321)
+
+        assert routed._get_cache_key(30.12346, 31.65432) == key
+        assert routed._get_cache_key(30.12345, 31.65432) != key
+
+    def test_cache_key_follows_hub_changes(self, routed, monkeypatch):
+        """Test the hub fingerprint is hashed once per hub change, not per key"""
+        key = routed._get_cache_key(30.1, 31.6)
+        with patch('delivery_service.hashlib.sha1') as mock_sha1:
+            assert routed._get_cache_key(30.1, 31.6) == key
+        assert mock_sha1.call_count == 0
+
+        monkeypatch.setattr(routed, 'hubs', [{'lat': 30.0, 'lng': 31.0}])
+        assert routed._get_cache_key(30.1, 31.6) != key
+
+
+class TestBenchmarkHarness:
+    """Smoke test the quote benchmark against the local ORS stub"""
+
+    def test_reports_every_scenario(self):
+        """Test cold, warm and failure runs are reported with percentiles"""
+        report = run_benchmark(requests=6, concurrency=[2], latency=0.0, failure_rate=0.5, targets=['service'])
+        results = {result['scenario']: result for result in report['results']}
+
+        assert set(results) == {'cold', 'warm', 'failure'}
+        assert results['cold']['ors_requests'] == 6
+        assert results['warm']['ors_requests'] == 0
+        assert results['warm']['errors'] == 0
+        assert results['cold']['latency_ms']['p95'] is not None
+
+    def test_closes_every_service(self):
+        """Test each scenario's service is closed, even when a run fails"""
+        close = DeliveryService.close
+        with patch.object(DeliveryService, 'close', autospec=True, side_effect=close) as mock_close:
+            run_benchmark(requests=2, concurrency=[1], latency=0.0, targets=['service'])
+        assert mock_close.call_count == 2  # cold+warm share one service; failure gets its own
+
+        with patch.object(DeliveryService, 'close', autospec=True, side_effect=close) as mock_close, \
+                patch('benchmarks.bench_delivery_quote.run_load', side_effect=RuntimeError('boom')):
+            with pytest.raises(RuntimeError):
+                run_benchmark(requests=2, concurrency=[1], latency=0.0, targets=['service'])
+        assert mock_close.call_count == 1
+
+    def test_regressions_are_flagged(self):
+        """Test a slower p95 or lower throughput than the baseline is reported"""
+        def report(p95, rps):
+            return {'results': [{'scenario': 'cold', 'target': 'service', 'concurrency': 8,
+                                 'latency_ms': {'p95': p95}, 'throughput_rps': rps}]}
+
+        assert find_regressions(report(50.0, 100.0), report(48.0, 101.0), tolerance=0.2) == []
+        assert len(find_regressions(report(90.0, 60.0), report(50.0, 100.0), tolerance=0.2)) == 2
@@ -0,0 +1,378 @@
+import asyncio
+import os
+import random
+import pytest
+from unittest.mock import patch
+from build_road_graph import read_road_csv
+from delivery_cache import MemoryDistanceCache
+from delivery_geo import haversine_km
+from delivery_routing import (
+    KDTree, RoadGraph, HubDistanceTables, HubTableBackend, LocalGraphBackend, NearestHubPruning,
+    RoutingBackend, write_road_graph, write_hub_tables
+)
+from test_delivery_matrix import make_matrix_response
+
+# Hubs spread west to east across the city, ~5 km apart
+HUB_LINE = [{'lat': 30.05, 'lng': 31.20 + 0.05 * i} for i in range(6)]
+
+# Synthetic 3x3 street grid (~1 km blocks); n0 -> n1 is one-way
+ROAD_GRAPH_DIR = os.path.join(os.path.dirname(__file__), 'data', 'road_graph')
+
+
+@pytest.fixture
+def graph_path(tmp_path):
+    """Build the synthetic road graph into a temporary file"""
+    lats, lngs, edges = read_road_csv(
+        os.path.join(ROAD_GRAPH_DIR, 'nodes.csv'),
+        os.path.join(ROAD_GRAPH_DIR, 'edges.csv')
+    )
+    path = str(tmp_path / 'roads.graph')
+    write_road_graph(path, lats, lngs, edges)
+    return path
+
+
+@pytest.fixture
+def road_graph(graph_path):
+    graph = RoadGraph(graph_path)
+    yield graph
+    graph.close()
+
+
+@pytest.fixture
+def tables_path(graph_path, road_graph, tmp_path):
+    """Precompute hub tables for the graph service hubs"""
+    path = str(tmp_path / 'hub_tables.bin')
+    write_hub_tables(path, road_graph, [{'lat': 30.0, 'lng': 31.2}, {'lat': 30.02, 'lng': 31.2}])
+    return path
+
+
+@pytest.fixture
+def graph_service(graph_path, make_service):
+    """Create a delivery service routing over the synthetic graph"""
+    service = make_service()
+    service.cache = MemoryDistanceCache()
+    service.prefilter_enabled = False
+    service.zones = None
+    service.hubs = [{'lat': 30.0, 'lng': 31.2}, {'lat': 30.02, 'lng': 31.2}]
+    service.router = service._create_router('local_graph', graph_path)
+    return service
+
+
+class StraightLineBackend(RoutingBackend):
+    """Routes as 1.3x the straight line, plus any configured detours"""
+
+    name = 'stub'
+
+    def __init__(self, detours=None):
+        self.detours = detours or {}
+        self.calls = []
+
+    def hub_distances(self, hubs, lat, lng):
+        self.calls.append([(hub['lat'], hub['lng']) for hub in hubs])
+        return [
+            haversine_km(hub['lat'], hub['lng'], lat, lng) * 1.3 + self.detours.get((hub['lat'], hub['lng']), 0)
+            for hub in hubs
+        ]
+
+
+class TestKDTree:
+    """Test nearest-neighbour lookup against brute force"""
+
+    def test_matches_brute_force(self):
+        """Test the tree finds the same nearest point as a linear scan"""
+        rng = random.Random(7)
+        lats = [29.9 + rng.random() * 0.3 for _ in range(500)]
+        lngs = [31.1 + rng.random() * 0.5 for _ in range(500)]
+        tree = KDTree(lats, lngs)
+
+        for _ in range(50):
+            lat, lng = 29.9 + rng.random() * 0.3, 31.1 + rng.random() * 0.5
+            expected = min(range(500), key=lambda i: haversine_km(lat, lng, lats[i], lngs[i]))
+            assert tree.nearest(lat, lng) == [expected]
+
+    def test_k_nearest_in_order(self):
+        """Test k results come back closest first"""
+        tree = KDTree([30.0, 30.1, 30.2, 30.3], [31.0, 31.0, 31.0, 31.0])
+        assert tree.nearest(30.22, 31.0, k=3) == [2, 3, 1]
+
+    def test_reuses_stored_order(self):
+        """Test a tree given a built order answers the same without rebuilding"""
+        rng = random.Random(11)
+        lats = [29.9 + rng.random() * 0.3 for _ in range(200)]
+        lngs = [31.1 + rng.random() * 0.5 for _ in range(200)]
+        built = KDTree(lats, lngs)
+
+        with patch.object(KDTree, '_build') as mock_build:
+            tree = KDTree(lats, lngs, order=built.order)
+
+        assert mock_build.call_count == 0
+        for _ in range(20):
+            lat, lng = 29.9 + rng.random() * 0.3, 31.1 + rng.random() * 0.5
+            assert tree.nearest(lat, lng, k=3) == built.nearest(lat, lng, k=3)
+
+
+class TestRoadGraph:
+    """Test the memory-mapped graph and its search"""
+
+    def test_graph_loads(self, road_graph):
+        """Test node and edge counts survive the round trip"""
+        assert road_graph.node_count == 9
+        assert road_graph.edge_count == 23  # 12 streets, one of them one-way
+        assert road_graph.lats[4] == 30.01
+
+    def test_nearest_node(self, road_graph):
+        """Test coordinates snap to the closest node"""
+        node, snap_km = road_graph.nearest_node(30.0101, 31.2099)
+        assert node == 4
+        assert snap_km < 0.02
+
+    def test_shortest_path(self, road_graph):
+        """Test the search finds the shortest route across the grid"""
+        assert road_graph.distances_to(8, [0], limit_km=50) == [pytest.approx(4.978)]
+
+    def test_one_way_street_is_respected(self, road_graph):
+        """Test the reverse of a one-way street takes the detour"""
+        assert road_graph.distances_to(1, [0], limit_km=50) == [pytest.approx(1.156)]
+        assert road_graph.distances_to(0, [1], limit_km=50) == [pytest.approx(3.823)]
+
+    def test_all_sources_in_one_search(self, road_graph):
+        """Test several hubs are answered together"""
+        assert road_graph.distances_to(7, [0, 6], limit_km=50) == [
+            pytest.approx(3.823), pytest.approx(1.155)
+        ]
+
+    def test_search_limit(self, road_graph):
+        """Test sources beyond the limit are not reported"""
+        assert road_graph.distances_to(8, [0], limit_km=2) == [None]
+
+    def test_search_gives_up_after_max_settled(self, road_graph):
+        """Test a search that settles too many nodes is abandoned"""
+        assert road_graph.distances_to(8, [0], limit_km=50, max_settled=3) is None
+        assert road_graph.distances_to(8, [0], limit_km=50, max_settled=9) == [pytest.approx(4.978)]
+
+    def test_kd_order_loaded_from_file(self, graph_path):
+        """Test workers map the stored KD-tree order instead of building one"""
+        with patch.object(KDTree, '_build') as mock_build:
+            graph = RoadGraph(graph_path)
+        try:
+            assert mock_build.call_count == 0
+            assert graph.nearest_node(30.0101, 31.2099)[0] == 4
+        finally:
+            graph.close()
+
+    def test_rejects_outdated_format(self, graph_path):
+        """Test a graph written by an older version must be rebuilt"""
+        with open(graph_path, 'r+b') as f:
+            f.seek(4)
+            f.write((1).to_bytes(4, 'little'))
+        with pytest.raises(ValueError, match='rebuild'):
+            RoadGraph(graph_path)
+
+    def test_rejects_other_files(self, tmp_path):
+        """Test a file that is not a road graph is refused"""
+        path = tmp_path / 'bogus.graph'
+        path.write_bytes(b'not a graph at all')
+        with pytest.raises(ValueError):
+            RoadGraph(str(path))
+
+
+class TestLocalGraphBackend:
+    """Test quotes routed in-process without calling ORS"""
+
+    def test_quote_without_http(self, graph_service):
+        """Test the local graph answers without any ORS request"""
+        with patch.object(graph_service.http, 'post') as mock_post:
+            result = graph_service.quote_delivery(30.02, 31.22)
+
+        assert mock_post.call_count == 0
+        assert result['ok'] is True
+        assert result['distance_km'] == pytest.approx(2.31, abs=0.01)
+        assert graph_service.get_routing_stats()['answered_by'] == {'local_graph': 1, 'ors': 0}
+
+    def test_async_quote_without_http(self, graph_service):
+        """Test the async path also routes locally"""
+        with patch('delivery_async.AsyncORSClient.hub_distances') as mock_ors:
+            result = asyncio.run(graph_service.quote_delivery_async(30.0, 31.21))
+
+        assert mock_ors.call_count == 0
+        assert result['distance_km'] == pytest.approx(1.16, abs=0.01)
+
+    def test_off_graph_point_falls_back_to_ors(self, graph_service):
+        """Test a point far from any graph node is routed by ORS"""
+        with patch.object(graph_service.http, 'post') as mock_post:
+            mock_post.return_value = make_matrix_response([40000, 30000])
+            result = graph_service.quote_delivery(30.2, 31.4)
+
+        assert mock_post.call_count == 1
+        assert result['distance_km'] == 30.0
+        assert graph_service.get_routing_stats()['answered_by']['ors'] == 1
+
+    def test_unreachable_hub_is_out_of_range(self, road_graph):
+        """Test a hub that cannot reach the customer within the limit prices as out of range"""
+        backend = LocalGraphBackend(road_graph, limit_km=2)
+        assert backend.hub_distances([{'lat': 30.0, 'lng': 31.2}], 30.02, 31.22) == [2]
+
+    def test_abandoned_search_falls_back_to_ors(self, graph_service):
+        """Test a search over the node budget is answered by ORS instead"""
+        graph_service.router.backends[0].max_settled = 2
+        with patch.object(graph_service.http, 'post') as mock_post:
+            mock_post.return_value = make_matrix_response([5000, 2500])
+            result = graph_service.quote_delivery(30.02, 31.22)
+
+        assert mock_post.call_count == 1
+        assert result['distance_km'] == 2.5
+        stats = graph_service.get_routing_stats()
+        assert stats['answered_by'] == {'local_graph': 0, 'ors': 1}
+        assert stats['local_graph']['searches_abandoned'] == 1
+
+    def test_missing_graph_uses_ors(self, tmp_path, make_service):
+        """Test the service still works on ORS when the graph file is missing"""
+        service = make_service()
+        router = service._create_router('local_graph', str(tmp_path / 'missing.graph'))
+        assert router.name == 'ors'
+
+
+class TestHubTables:
+    """Test precomputed per-hub distance tables"""
+
+    def test_tables_match_graph_search(self, road_graph, tables_path):
+        """Test every table entry equals a direct search"""
+        tables = HubDistanceTables(tables_path)
+        for node in range(road_graph.node_count):
+            expected = road_graph.distances_to(node, [0, 6], limit_km=50)
+            assert tables.distance(0, node) == pytest.approx(expected[0], abs=1e-3)
+            assert tables.distance(1, node) == pytest.approx(expected[1], abs=1e-3)
+        tables.close()
+
+    def test_tables_answer_first(self, graph_path, tables_path, service):
+        """Test quotes are served from the tables when they match the hubs"""
+        service.hubs = [{'lat': 30.0, 'lng': 31.2}, {'lat': 30.02, 'lng': 31.2}]
+        service.router = service._create_router('local_graph', graph_path, tables_path)
+
+        with patch.object(RoadGraph, 'distances_to') as mock_search:
+            result = service.quote_delivery(30.02, 31.22)
+
+        assert mock_search.call_count == 0
+        assert result['distance_km'] == pytest.approx(2.31, abs=0.01)
+        assert service.get_routing_stats()['answered_by']['hub_tables'] == 1
+
+    def test_stale_tables_are_skipped(self, graph_path, tables_path, make_service):
+        """Test tables built for other hubs are not used"""
+        service = make_service()
+        service.hubs = [{'lat': 30.01, 'lng': 31.21}]
+        router = service._create_router('local_graph', graph_path, tables_path)
+        assert router.name == 'local_graph+ors'
+
+    @pytest.mark.parametrize('change', ['weight', 'edge'])
+    def test_tables_for_another_graph_are_stale(self, tmp_path, tables_path, make_service, change):
+        """Test tables are skipped once the graph's edges change, even with the same nodes"""
+        lats, lngs, edges = read_road_csv(
+            os.path.join(ROAD_GRAPH_DIR, 'nodes.csv'),
+            os.path.join(ROAD_GRAPH_DIR, 'edges.csv')
+        )
+        source, target, length_m = edges[0]
+        if change == 'weight':
+            edges[0] = (source, target, length_m + 250.0)
+        else:
+            edges.append((target, source, length_m))
+        graph_path = str(tmp_path / 'changed.graph')
+        write_road_graph(graph_path, lats, lngs, edges)
+
+        service = make_service()
+        service.hubs = [{'lat': 30.0, 'lng': 31.2}, {'lat': 30.02, 'lng': 31.2}]
+        router = service._create_router('local_graph', graph_path, tables_path)
+        assert router.name == 'local_graph+ors'
+
+    def test_unreachable_node_is_none(self, tmp_path):
+        """Test nodes a hub cannot reach are stored as unreachable"""
+        path = str(tmp_path / 'split.graph')
+        write_road_graph(path, [30.0, 30.01], [31.2, 31.2], [(0, 1, 1000.0)])
+        graph = RoadGraph(path)
+        tables_path = str(tmp_path / 'split_tables.bin')
+        write_hub_tables(tables_path, graph, [{'lat': 30.01, 'lng': 31.2}])
+
+        tables = HubDistanceTables(tables_path)
+        assert tables.distance(0, 0) is None
+        assert tables.distance(0, 1) == 0.0
+        tables.close()
+        graph.close()
+
+    def test_tables_answer_for_hub_subsets(self, road_graph, tables_path):
+        """Test a subset of the tabled hubs is answered row by row"""
+        backend = HubTableBackend(road_graph, HubDistanceTables(tables_path))
+        subset = backend.hub_distances([{'lat': 30.02, 'lng': 31.2}], 30.02, 31.22)
+        both = backend.hub_distances([{'lat': 30.0, 'lng': 31.2}, {'lat': 30.02, 'lng': 31.2}], 30.02, 31.22)
+
+        assert subset == [both[1]]
+        assert backend.hub_distances([{'lat': 30.01, 'lng': 31.21}], 30.02, 31.22) is None
+        backend.tables.close()
+
+
+class TestNearestHubPruning:
+    """Test only hubs that could be nearest by road are routed"""
+
+    def test_far_hubs_are_not_routed(self):
+        """Test hubs farther in a straight line than the best route are skipped"""
+        backend = StraightLineBackend()
+        router = NearestHubPruning(backend, candidates=2)
+
+        distances = router.hub_distances(HUB_LINE, 30.05, 31.201)
+
+        assert len(backend.calls) == 1
+        assert backend.calls[0] == [(30.05, 31.20), (30.05, 31.25)]
+        assert distances[2:] == [None] * 4
+        assert min(d for d in distances if d is not None) == pytest.approx(0.096 * 1.3, abs=0.01)
+        assert router.stats()['hub_pruning'] == {'candidates': 2, 'hubs_routed': 2, 'hubs_pruned': 4}
+
+    def test_detour_routes_next_candidates(self):
+        """Test a long detour to the nearest hubs brings farther hubs into play"""
+        backend = StraightLineBackend(detours={(30.05, 31.20): 20.0, (30.05, 31.25): 20.0})
+        router = NearestHubPruning(backend, candidates=2)
+
+        distances = router.hub_distances(HUB_LINE, 30.05, 31.201)
+
+        assert len(backend.calls) > 1
+        best = min(range(len(distances)), key=lambda i: distances[i] if distances[i] is not None else float('inf'))
+        assert best == 2
+
+    def test_pruned_result_matches_full_routing(self):
+        """Test pruning never changes which hub wins"""
+        random.seed(7)
+        backend = StraightLineBackend(detours={(hub['lat'], hub['lng']): random.uniform(0, 8) for hub in HUB_LINE})
+        router = NearestHubPruning(backend, candidates=2)
+
+        for _ in range(50):
+            lat, lng = random.uniform(30.0, 30.1), random.uniform(31.15, 31.5)
+            pruned = router.hub_distances(HUB_LINE, lat, lng)
+            full = backend.hub_distances(HUB_LINE, lat, lng)
+            assert min(d for d in pruned if d is not None) == pytest.approx(min(full))
+
+    def test_few_hubs_route_together(self):
+        """Test hub lists no longer than the candidate count are routed in one call"""
+        backend = StraightLineBackend()
+        router = NearestHubPruning(backend, candidates=2)
+
+        assert len(router.hub_distances(HUB_LINE[:2], 30.05, 31.3)) == 2
+        assert backend.calls == [[(30.05, 31.20), (30.05, 31.25)]]
+
+    def test_failed_backend_returns_none(self):
+        """Test nothing is reported when the first candidates cannot be routed"""
+        backend = StraightLineBackend()
+        router = NearestHubPruning(backend, candidates=2)
+
+        with patch.object(backend, 'hub_distances', return_value=None):
+            assert router.hub_distances(HUB_LINE, 30.05, 31.201) is None
+
+    def test_service_routes_nearest_hubs(self, service):
+        """Test quotes send only the candidate hubs to ORS"""
+        service.hubs = HUB_LINE
+
+        with patch.object(service, '_call_ors_matrix', side_effect=lambda hubs, *args, **kwargs: [
+            haversine_km(hub['lat'], hub['lng'], 30.05, 31.401) * 1.3 for hub in hubs
+        ]) as mock_matrix:
+            result = service.quote_delivery(30.05, 31.401)
+
+        assert mock_matrix.call_count == 1
+        assert len(mock_matrix.call_args[0][0]) == 2
+        assert result['distance_km'] == pytest.approx(0.13, abs=0.01)
+        assert service.get_metrics()['hub_wins'][4] == 1
@@ -0,0 +1,107 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from config import Config
+from delivery_cache import MemoryDistanceCache, SQLiteDistanceCache
+from delivery_service import delivery_service
+from delivery_warmup import frequent_order_locations, main, warm_delivery_cache
+from extensions import db
+from models import Order
+
+
+def add_order(lat, lng, distance_km, days_ago=1):
+    """Add a minimal historical order at the given location"""
+    db.session.add(Order(
+        subtotal=100, delivery_fee=50, distance_km=distance_km, total=150, deposit_amount=30,
+        address_text='Somewhere', customer_lat=lat, customer_lng=lng,
+        customer_name='Customer', customer_phone='01000000000',
+        created_at=datetime.now(timezone.utc) - timedelta(days=days_ago)
+    ))
+
+
+class TestCacheWarmup:
+    """Test preloading the distance cache from past orders"""
+
+    def test_locations_ordered_by_frequency(self, app):
+        """Test the busiest addresses come first and old orders are ignored"""
+        add_order(30.05, 31.05, 12.0)
+        add_order(30.10, 31.10, 30.0)
+        add_order(30.10, 31.10, 30.0)
+        add_order(30.20, 31.20, 40.0, days_ago=400)
+        db.session.commit()
+
+        locations = frequent_order_locations(days=180, limit=10)
+
+        assert locations == [(30.10, 31.10, 30.0, 2), (30.05, 31.05, 12.0, 1)]
+
+    def test_repeat_customer_skips_ors(self, app, service):
+        """Test a warmed address is quoted without routing"""
+        add_order(30.05, 31.05, 12.0)
+        db.session.commit()
+
+        result = warm_delivery_cache(service, days=180, limit=10)
+
+        assert result == {'locations': 1, 'primed': 1, 'already_cached': 0}
+        with patch.object(service, '_call_ors_matrix') as mock_matrix:
+            quote = service.quote_delivery(30.05, 31.05)
+        assert mock_matrix.call_count == 0
+        assert quote['distance_km'] == 12.0
+
+    def test_existing_entries_are_kept(self, app, service):
+        """Test warm-up never overwrites a distance already in the cache"""
+        service.prime_distance(30.05, 31.05, 11.0)
+        add_order(30.05, 31.05, 12.0)
+        db.session.commit()
+
+        result = warm_delivery_cache(service, days=180, limit=10)
+
+        assert result['already_cached'] == 1
+        assert service.quote_delivery(30.05, 31.05)['distance_km'] == 11.0
+
+    def test_busiest_addresses_survive_eviction(self, app, service):
+        """Test the most frequent address is the last one evicted"""
+        service.cache = MemoryDistanceCache(max_entries=2)
+        service.cache_cell_meters = 0
+        add_order(30.05, 31.05, 12.0)
+        add_order(30.06, 31.06, 13.0)
+        add_order(30.06, 31.06, 13.0)
+        db.session.commit()
+
+        warm_delivery_cache(service, days=180, limit=10)
+        service.prime_distance(30.07, 31.07, 14.0)
+
+        assert service._get_cache_entry(service._get_cache_key(30.06, 31.06)) is not None
+        assert service._get_cache_entry(service._get_cache_key(30.05, 31.05)) is None
+
+    def test_cli_refuses_memory_cache(self, app, monkeypatch, capsys):
+        """Test the script will not warm a cache that dies with its own process"""
+        monkeypatch.setattr(delivery_service, 'cache', MemoryDistanceCache())
+
+        with patch('delivery_warmup.warm_delivery_cache') as mock_warm:
+            assert main([]) == 1
+
+        assert mock_warm.call_count == 0
+        assert 'sqlite' in capsys.readouterr().out
+
+    def test_cli_does_not_warm_on_app_import(self, app, monkeypatch):
+        """Test importing the app from the script skips the startup warm-up"""
+        monkeypatch.setattr(Config, 'DELIVERY_CACHE_WARM_ON_STARTUP', True)
+        monkeypatch.delitem(sys.modules, 'app')  # make the script import the app afresh
+        monkeypatch.setattr(delivery_service, 'cache', MemoryDistanceCache())
+
+        with patch('delivery_warmup.warm_delivery_cache') as mock_warm:
+            assert main([]) == 1
+
+        assert mock_warm.call_count == 0
+        assert Config.DELIVERY_CACHE_WARM_ON_STARTUP is False
+
+    def test_cli_warms_shared_cache(self, app, monkeypatch, tmp_path):
+        """Test the script primes the shared sqlite cache other workers read"""
+        path = str(tmp_path / 'delivery_cache.sqlite3')
+        monkeypatch.setattr(delivery_service, 'cache', SQLiteDistanceCache(path))
+        add_order(30.05, 31.05, 12.0)
+        db.session.commit()
+
+        assert main(['--days', '180']) == 0
+
+        assert SQLiteDistanceCache(path).get(delivery_service._get_cache_key(30.05, 31.05)) is not None
@@ -0,0 +1,94 @@
+import pytest
+from extensions import db
+from menu_catalog import MenuCatalog, mark_menu_changed, menu_catalog, read_catalog_version
+from models import MenuItem
+
+
+@pytest.fixture
+def dish(app, sample_menu_items):
+    """The first sample menu item"""
+    return MenuItem.query.order_by(MenuItem.id).first()
+
+
+class TestMenuCatalog:
+    """Test the cached menu snapshot and its invalidation"""
+
+    def test_snapshot_indexes(self, app, sample_menu_items, dish):
+        """Test available items are indexed by id and category"""
+        dish.is_available = False
+        db.session.commit()
+
+        snapshot = menu_catalog.snapshot()
+
+        assert len(snapshot.by_id) == 2
+        assert snapshot.get_available(dish.id) is None
+        assert [item.get_name('en') for item in snapshot.by_category['main']] == ['Test Dish 2']
+
+    def test_steady_state_runs_no_queries(self, client, sample_menu_items, menu_queries):
+        """Test repeat menu views and cart adds are served from the snapshot"""
+        client.get('/menu')
+        loaded = len(menu_queries)
+
+        client.get('/menu')
+        client.get('/menu?category=main')
+        client.post('/add_to_cart', json={'item_id': menu_catalog.snapshot().available[0].id})
+
+        assert loaded == 1
+        assert len(menu_queries) == loaded
+
+    def test_commit_invalidates_snapshot(self, app, dish):
+        """Test an edited item is visible right after the commit"""
+        assert menu_catalog.get_available(dish.id).price == 100.0
+
+        dish.price = 120.0
+        db.session.commit()
+
+        assert menu_catalog.get_available(dish.id).price == 120.0
+
+    def test_rollback_keeps_snapshot(self, app, dish):
+        """Test an abandoned edit neither changes nor drops the snapshot"""
+        before = menu_catalog.snapshot()
+
+        dish.price = 1.0
+        db.session.flush()
+        db.session.rollback()
+
+        assert menu_catalog.snapshot() is before
+
+    def test_other_workers_see_version_bump(self, app, dish):
+        """Test a worker reloads once the shared version moves on"""
+        worker = MenuCatalog(check_interval=0)
+        worker.snapshot()
+        version = read_catalog_version()
+
+        # Bulk statements skip the flush hooks and mark the change themselves
+        MenuItem.query.filter_by(id=dish.id).update({'price': 99.0})
+        mark_menu_changed(db.session)
+        db.session.commit()
+
+        assert read_catalog_version() == version + 1
+        assert worker.get_available(dish.id).price == 99.0
+
+    def test_checks_are_rate_limited(self, app, dish, menu_queries):
+        """Test the shared version is not read again before the check interval"""
+        dish_id = dish.id
+        worker = MenuCatalog(check_interval=60)
+        worker.snapshot()
+        loaded = len(menu_queries)
+
+        MenuItem.query.filter_by(id=dish_id).update({'price': 99.0})
+        mark_menu_changed(db.session)
+        db.session.commit()
+
+        assert worker.get_available(dish_id).price == 100.0
+        assert len(menu_queries) == loaded
+
+    def test_unavailable_item_rejected_by_cart(self, client, dish):
+        """Test add_to_cart follows availability changes as soon as they commit"""
+        dish.is_available = False
+        db.session.commit()
+        assert client.post('/add_to_cart', json={'item_id': dish.id}).get_json()['success'] is False
+
+        dish.is_available = True
+        db.session.commit()
+        assert client.post('/add_to_cart', json={'item_id': dish.id}).get_json()['success'] is True
@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import event
+from extensions import db
+from menu_catalog import menu_catalog
+from menu_seed import SAMPLE_MENU_ITEMS, seed_menu_items
+from models import MenuItem
+
+
+@pytest.fixture
+def menu_inserts(app):
+    """INSERT statements run against menu_items during the test"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('INSERT') and 'menu_items' in statement:
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+class TestMenuSeed:
+    """Test the shared, idempotent menu bootstrapping"""
+
+    def test_seeds_empty_menu_in_bulk(self, app, menu_inserts):
+        """Test the sample menu goes in with a single bulk INSERT"""
+        assert seed_menu_items(SAMPLE_MENU_ITEMS) == len(SAMPLE_MENU_ITEMS)
+
+        assert len(menu_inserts) == 1
+        assert MenuItem.query.count() == len(SAMPLE_MENU_ITEMS)
+        assert all(item.is_available for item in MenuItem.query)
+
+    def test_seeding_is_idempotent(self, app):
+        """Test a second run leaves an existing menu alone"""
+        seed_menu_items(SAMPLE_MENU_ITEMS)
+
+        assert seed_menu_items(SAMPLE_MENU_ITEMS) == 0
+        assert MenuItem.query.count() == len(SAMPLE_MENU_ITEMS)
+
+    def test_replace_swaps_the_menu(self, app, sample_menu_items):
+        """Test replace deletes the old items before inserting"""
+        assert seed_menu_items(SAMPLE_MENU_ITEMS[:2], replace=True) == 2
+
+        assert sorted(item.name_en for item in MenuItem.query) == ['Chicken Kabsa', 'Mandi Lamb']
+
+    def test_seeded_items_reach_the_catalog(self, app):
+        """Test a cached empty catalog is refreshed after seeding"""
+        assert menu_catalog.snapshot().by_id == {}
+
+        seed_menu_items(SAMPLE_MENU_ITEMS)
+
+        assert len(menu_catalog.snapshot().available) == len(SAMPLE_MENU_ITEMS)
+
+    def test_menu_view_does_not_seed(self, client, menu_inserts):
+        """Test an empty menu renders its empty state without writing"""
+        response = client.get('/menu')
+
+        assert response.status_code == 200
+        assert menu_inserts == []
+        assert MenuItem.query.count() == 0